@@ -11,6 +11,8 @@ import escargot.cypher.memgraph as memgraph
 
 from escargot.parser import ESCARGOTParser
 from escargot.coder import Coder
+from escargot.coder.memo import StepMemo
+from escargot.preview import preview
 
 from escargot import Escargot
 from escargot import operations
@@ -21,7 +23,7 @@ from abc import ABC, abstractmethod
 from typing import Dict, List
 import re
 import logging
-from utils import strip_answer_helper, strip_answer_helper_all, parse_xml, parse_xml_code
+from utils import strip_answer_helper, strip_answer_helper_all, parse_xml, parse_xml_code, answer_batch, configure_controller
 
 class CypherESCARGOTParser(ESCARGOTParser):
      def parse_generate_answer(self, state: Dict, texts: List[str]) -> List[Dict]:
@@ -228,6 +230,14 @@ Here are the steps, code, and output:
 
 Return the final variable that answers the question."""
 
+    direct_output_prompt = """Answer the following question from your own knowledge, without access to the knowledge graph. Answer briefly and do not include any additional information.
+Question: {question}"""
+
+    direct_array_output_prompt = """Answer the following question from your own knowledge, without access to the knowledge graph.
+Question: {question}
+
+Return only a Python list of the items that answer the question."""
+
     determine_variable_name_prompt = """Given the following Python code, you will be asked to determine the variable name for the knowledge request. A knowledge request should look like: variable_a = knowledge_request("GENE OVEREXPRESSED IN BODYPART-Brain")
 
 Code: {code}
@@ -312,15 +322,17 @@ Question:
                 return self.xml_conversion_prompt.format(instructions=input)
             elif kwargs["phase"] == "xml_cleanup":
                 return self.xml_cleanup_prompt.format(xml=input, node_types=self.node_types, relationship_types=self.relationship_types)
+            elif kwargs["phase"] == "direct_answer":
+                if kwargs["answer_type"] == "array":
+                    return self.direct_array_output_prompt.format(question=question)
+                else:
+                    return self.direct_output_prompt.format(question=question)
             elif kwargs["phase"] == "output":
                 steps = ""
                 for step in kwargs["instructions"]:
                     steps += "Step " + step["StepID"] + ": " + step["Instruction"] + "\n"
                     steps += "Code: " + step["Code"][0] + "\n"
-                    output = input[step["StepID"]]
-                    if len(str(output)) > 256:
-                        output = str(output)[:256] + "..."
-                    steps += "Output: " + str(output) + "\n\n"
+                    steps += "Output: " + preview(input[step["StepID"]]) + "\n\n"
                 if kwargs["answer_type"] == "array":
                     return self.array_output_prompt.format(question=question, steps=steps)
                 else:
@@ -332,7 +344,7 @@ Question:
         if statement_to_embed == "" or statement_to_embed is None:
             return []
         if self.graph_client is not None:
-            knowledge_array = list(self.graph_client.client.execute_and_fetch(statement_to_embed))
+            knowledge_array = self.graph_client.fetch(statement_to_embed)
             # knowledge_array = self.graph_client.execute(self.lm, self.memgraph_prompt_1.format(schema=self.graph_client.schema) + str(self.memgraph_prompt_2) + str(self.memgraph_prompt_3.format(instruction=str(instruction),cypher=str(statement_to_embed))),str(statement_to_embed))
             #Identify genes associated with Alzheimer’s disease and filter bodypart linked to both these genes 
 # and Alzheimer’s disease. Then, exclude the genes already associated with Alzheimer’s disease, and rank the
@@ -380,6 +392,7 @@ class CypherEscargot(Escargot):
         self.question = ""
         self.controller = None
         self.operations_graph = None
+        self.shortcuts = []
         if self.vdb.client is None:
             self.vdb = None
         self.graph_client = memgraph.MemgraphClient(config, logger)
@@ -393,22 +406,55 @@ class CypherEscargot(Escargot):
                 self.relationship_types = relationship_types
         self.relationship_scores = relationship_scores
 
-    def ask(self, question, answer_type = 'natural', num_strategies=1, debug_level = 0, memory_name = "escargot_memory", max_run_tries = 3):
+    def get_memory(self, memory_name = "escargot_memory"):
         """
-        Ask a question and get an answer.
+        Get the memory for a collection, reusing the one from the previous question when possible.
+        The underlying Chroma client is shared per store path, so no client is opened per question.
+
+        :param memory_name: The name of the memory collection.
+        :type memory_name: str
+        :return: The memory for the collection.
+        :rtype: memory.Memory
+        """
+        if self.memory is None or self.memory.collection_name != memory_name:
+            self.memory = memory.Memory(self.lm, collection_name = memory_name)
+        return self.memory
+
+    def answer(self, question, lm, answer_type = 'natural', num_strategies=1, max_run_tries = 3, deadline = None, plan_cache = None, plan_library = None, sampling = None, speculation = False, early_start = False, memo = None, repair_candidates = 1, executor = None, step_timeout = None):
+        """
+        Answer a question with a Controller of its own, so questions can be answered concurrently.
 
         :param question: The question to ask.
         :type question: str
+        :param lm: The language model, e.g. the BatchingLanguageModel shared by a batch.
+        :type lm: AbstractLanguageModel
         :param answer_type: The type of answer to expect. Defaults to 'natural'. Options are 'natural', 'array'.
         :type answer_type: str
-        :param num_strategies: The number of strategies to generate. Defaults to 3.
+        :param num_strategies: The number of strategies to generate. Defaults to 1.
         :type num_strategies: int
-        :return: The answer to the question.
-        :rtype: str
+        :param deadline: The budget in seconds for the question. Defaults to None (no budget).
+        :type deadline: float
+        :param plan_cache: PlanCache reusing the validated plans of questions with the same template, e.g. get_shared_plan_cache(). Defaults to None.
+        :type plan_cache: PlanCache
+        :param plan_library: PlanLibrary reusing or seeding the plans of similar questions. Defaults to None.
+        :type plan_library: PlanLibrary
+        :param sampling: AdaptiveSampling of the planning, conversion and assessment branches. Defaults to None (all branches at once).
+        :type sampling: AdaptiveSampling
+        :param speculation: Whether the phase after an assessment starts for the leading candidate. Defaults to False.
+        :type speculation: bool
+        :param early_start: Whether the leading steps of the plan are prefetched while it is streamed. Defaults to False.
+        :type early_start: bool
+        :param memo: StepMemo reusing the outcome of steps whose code and inputs did not change. Defaults to None.
+        :type memo: StepMemo
+        :param repair_candidates: Number of fixes of a failed step tried in parallel. Defaults to 1.
+        :type repair_candidates: int
+        :param executor: WorkerPool running the step code in sandboxed processes. Defaults to None (in process).
+        :type executor: WorkerPool
+        :param step_timeout: Budget of each step in seconds. Defaults to None (no limit).
+        :type step_timeout: float
+        :return: The answer to the question and the Controller that answered it.
+        :rtype: Tuple[str, controller.Controller]
         """
-
-        #setup logger
-        log_stream, c_handler, f_handler = self.setup_logger(debug_level)
         def got() -> operations.GraphOfOperations:
             operations_graph = operations.GraphOfOperations()
 
@@ -419,42 +465,138 @@ class CypherEscargot(Escargot):
         
         # Create the Controller
         got = got()
+        question_controller = controller.Controller(
+            lm, 
+            got, 
+            CypherESCARGOTPrompter(graph_client = self.graph_client,vector_db = self.vdb, lm=lm,node_types=self.node_types,relationship_types=self.relationship_types, relationship_scores=self.relationship_scores,logger = self.logger),
+            CypherESCARGOTParser(self.logger),
+            self.logger,
+            Coder(executor = executor, repair_candidates = repair_candidates, memo = memo, step_timeout = step_timeout),
+            {
+                "question": question,
+                "input": "",
+                "phase": "querying",
+                "method" : "got",
+                "num_branches_response": num_strategies,
+                "answer_type": answer_type,
+            }
+        )
+        question_controller.max_run_tries = max_run_tries
+        question_controller.deadline = deadline
+        configure_controller(question_controller, plan_cache, plan_library, sampling, speculation, early_start, self.logger)
         try:
-            self.memory = memory.Memory(self.lm, collection_name = memory_name)
-            self.controller = controller.Controller(
-                self.lm, 
-                got, 
-                CypherESCARGOTPrompter(graph_client = self.graph_client,vector_db = self.vdb, lm=self.lm,node_types=self.node_types,relationship_types=self.relationship_types, relationship_scores=self.relationship_scores,logger = self.logger),
-                CypherESCARGOTParser(self.logger),
-                self.logger,
-                Coder(),
-                {
-                    "question": question,
-                    "input": "",
-                    "phase": "querying",
-                    "method" : "got",
-                    "num_branches_response": num_strategies,
-                    "answer_type": answer_type,
-                }
-            )
-            self.controller.max_run_tries = max_run_tries
-            self.controller.run()
+            question_controller.run()
         except Exception as e:
             self.logger.error("Error executing controller: %s", e)
 
-        self.operations_graph = self.controller.graph.operations
         output = ""
-        if self.controller.final_thought is not None:
-            if answer_type == 'natural':
-                output = self.controller.final_thought.state['input']
+        if question_controller.final_thought is not None:
+            if answer_type == 'natural' or question_controller.final_thought.state.get("direct_answer"):
+                output = question_controller.final_thought.state['input']
             elif answer_type == 'array':
                 # output = list(list(self.controller.coder.step_output.values())[-1].values())[-1]
-                output = list(self.controller.coder.step_output.values())[-1]
+                output = list(question_controller.coder.step_output.values())[-1]
 
         self.logger.warning(f"Output: {output}")
+        return output, question_controller
+
+    def ask(self, question, answer_type = 'natural', num_strategies=1, debug_level = 0, memory_name = "escargot_memory", max_run_tries = 3, deadline = None, plan_cache = None, plan_library = None, sampling = None, speculation = False, early_start = False, memoize = False, repair_candidates = 1, executor = None, step_timeout = None):
+        """
+        Ask a question and get an answer.
+
+        :param question: The question to ask.
+        :type question: str
+        :param answer_type: The type of answer to expect. Defaults to 'natural'. Options are 'natural', 'array'.
+        :type answer_type: str
+        :param num_strategies: The number of strategies to generate. Defaults to 3.
+        :type num_strategies: int
+        :param deadline: The budget in seconds for the question. As it runs out, fewer strategies and candidates are
+                         tried, assessments and repairs are skipped, and finally the question is answered directly.
+                         The shortcuts taken are kept in shortcuts. Defaults to None (no budget).
+        :type deadline: float
+        :param plan_cache: PlanCache reusing the validated plans of questions with the same template, e.g. get_shared_plan_cache(). Defaults to None.
+        :type plan_cache: PlanCache
+        :param plan_library: PlanLibrary reusing or seeding the plans of similar questions. Defaults to None.
+        :type plan_library: PlanLibrary
+        :param sampling: AdaptiveSampling of the planning, conversion and assessment branches. Defaults to None (all branches at once).
+        :type sampling: AdaptiveSampling
+        :param speculation: Whether the phase after an assessment starts for the leading candidate. Defaults to False.
+        :type speculation: bool
+        :param early_start: Whether the leading steps of the plan are prefetched while it is streamed. Defaults to False.
+        :type early_start: bool
+        :param memoize: Whether step outcomes are memoized. Defaults to False.
+        :type memoize: bool
+        :param repair_candidates: Number of fixes of a failed step tried in parallel. Defaults to 1.
+        :type repair_candidates: int
+        :param executor: WorkerPool running the step code in sandboxed processes. Defaults to None (in process).
+        :type executor: WorkerPool
+        :param step_timeout: Budget of each step in seconds. Defaults to None (no limit).
+        :type step_timeout: float
+        :return: The answer to the question.
+        :rtype: str
+        """
+
+        #setup logger
+        log_stream, c_handler, f_handler = self.setup_logger(debug_level)
+        output = ""
+        self.shortcuts = []
+        try:
+            self.memory = self.get_memory(memory_name)
+            memo = StepMemo() if memoize else None
+            output, self.controller = self.answer(question, self.lm, answer_type, num_strategies, max_run_tries, deadline, plan_cache = plan_cache, plan_library = plan_library, sampling = sampling, speculation = speculation, early_start = early_start, memo = memo, repair_candidates = repair_candidates, executor = executor, step_timeout = step_timeout)
+            self.operations_graph = self.controller.graph.operations
+            self.shortcuts = self.controller.shortcuts
+        except Exception as e:
+            self.logger.error("Error executing controller: %s", e)
 
         #remove logger
         self.finalize_logger(log_stream, c_handler, f_handler)
 
         return output
-    
\ No newline at end of file
+
+    def ask_batch(self, questions, answer_type = 'natural', num_strategies=1, debug_level = 0, memory_name = "escargot_memory", max_run_tries = 3, max_concurrency = 8, max_batch = 16, deadline = None, plan_cache = None, plan_library = None, sampling = None, speculation = False, early_start = False, memoize = False, repair_candidates = 1, executor = None, step_timeout = None):
+        """
+        Answer many questions at once. Each question runs its own Controller, and the prompts of all questions
+        are sent concurrently, at most max_batch at a time, so a sweep is bound by the provider's throughput.
+
+        :param questions: The questions to ask.
+        :type questions: List[str]
+        :param answer_type: The type of answer to expect. Defaults to 'natural'. Options are 'natural', 'array'.
+        :type answer_type: str
+        :param num_strategies: The number of strategies to generate. Defaults to 1.
+        :type num_strategies: int
+        :param max_concurrency: The number of questions answered at once. Defaults to 8.
+        :type max_concurrency: int
+        :param max_batch: The maximum number of prompts in flight. Defaults to 16.
+        :type max_batch: int
+        :param deadline: The budget in seconds for each question. Defaults to None (no budget).
+        :type deadline: float
+        :param plan_cache: PlanCache reusing the validated plans of questions with the same template, e.g. get_shared_plan_cache(). Defaults to None.
+        :type plan_cache: PlanCache
+        :param plan_library: PlanLibrary reusing or seeding the plans of similar questions. Defaults to None.
+        :type plan_library: PlanLibrary
+        :param sampling: AdaptiveSampling of the planning, conversion and assessment branches. Shared by the questions. Defaults to None (all branches at once).
+        :type sampling: AdaptiveSampling
+        :param speculation: Whether the phase after an assessment starts for the leading candidate. Defaults to False.
+        :type speculation: bool
+        :param early_start: Whether the leading steps of the plan are prefetched while it is streamed. Defaults to False.
+        :type early_start: bool
+        :param memoize: Whether step outcomes are memoized, in one memo shared by the questions. Defaults to False.
+        :type memoize: bool
+        :param repair_candidates: Number of fixes of a failed step tried in parallel. Defaults to 1.
+        :type repair_candidates: int
+        :param executor: WorkerPool running the step code in sandboxed processes. Defaults to None (in process).
+        :type executor: WorkerPool
+        :param step_timeout: Budget of each step in seconds. Defaults to None (no limit).
+        :type step_timeout: float
+        :return: The answers, in the order of the questions.
+        :rtype: List[str]
+        """
+        log_stream, c_handler, f_handler = self.setup_logger(debug_level)
+        try:
+            self.memory = self.get_memory(memory_name)
+            memo = StepMemo() if memoize else None
+            outputs = answer_batch(lambda question, lm: self.answer(question, lm, answer_type, num_strategies, max_run_tries, deadline, plan_cache = plan_cache, plan_library = plan_library, sampling = sampling, speculation = speculation, early_start = early_start, memo = memo, repair_candidates = repair_candidates, executor = executor, step_timeout = step_timeout)[0], questions, self.lm, max_concurrency, max_batch, self.logger)
+        finally:
+            self.finalize_logger(log_stream, c_handler, f_handler)
+        return outputs
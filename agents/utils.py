@@ -6,63 +6,12 @@ import logging
 import os
 import pandas as pd
 import numpy as np
-
-def strip_answer_helper(text: str, tag: str = "") -> str:
-    """
-    Helper function to remove tags from a text.
-
-    :param text: The input text.
-    :type text: str
-    :param tag: The tag to be stripped. Defaults to "".
-    :type tag: str
-    :return: The stripped text.
-    :rtype: str
-    """
-
-    text = text.strip()
-    if "Output:" in text:
-        text = text[text.index("Output:") + len("Output:") :].strip()
-    if tag != "":
-        start = text.rfind(f"<{tag}>")
-        end = text.rfind(f"</{tag}>")
-        if start != -1 and end != -1:
-            text = text[start + len(f"<{tag}>") : end].strip()
-        elif start != -1:
-            logging.warning(
-                f"Only found the start tag <{tag}> in answer: {text}. Returning everything after the tag."
-            )
-            text = text[start + len(f"<{tag}>") :].strip()
-        elif end != -1:
-            logging.warning(
-                f"Only found the end tag </{tag}> in answer: {text}. Returning everything before the tag."
-            )
-            text = text[:end].strip()
-        else:
-            logging.warning(
-                f"Could not find any tag {tag} in answer: {text}. Returning the full answer."
-            )
-    return text
-
-#strip answer helper but returns all instances of the tag
-def strip_answer_helper_all(text: str, tag: str = "") -> str:
-    """
-    Helper function to remove tags from a text.
-
-    :param text: The input text.
-    :type text: str
-    :param tag: The tag to be stripped. Defaults to "".
-    :type tag: str
-    :return: The stripped text.
-    :rtype: str
-    """
-
-    text = text.strip()
-    #get all instances of the tag
-    start = [m.start() for m in re.finditer(f"<{tag}>", text)]
-    end = [m.start() for m in re.finditer(f"</{tag}>", text)]
-    # print(start)
-    # print(end)
-    return [text[text.index(f"<{tag}>", start[i]) + len(f"<{tag}>") : end[i]].strip() for i in range(len(start))]
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+from escargot.preview import preview
+from escargot.language_models.batching import BatchingLanguageModel
+from escargot.operations.speculation import Speculator
+from escargot.parser.utils import strip_answer_helper, strip_answer_helper_all
 
 def parse_xml(xml_data, logger):
     # Parse the XML string
@@ -224,21 +173,20 @@ def retrieve_file_descriptions(chat_id, step_limit = float('inf')):
             if hasattr(obj, 'shape'):
                 pickle_info['shape'] = obj.shape
             if hasattr(obj, 'keys'):
-                pickle_info['keys'] = obj.keys()
-                pickle_info['examples'] = str(obj)[:100]+'...'
+                pickle_info['keys'] = preview(obj.keys())
+                pickle_info['examples'] = preview(obj, 100)
                 # for key in obj.keys():
                 #     #stringity the values and put the first 100 characters in the description
                 #     pickle_info['examples'][key] = str(obj[key])[:100]+'...'
-            if hasattr(obj, 'describe'):
-                pickle_info['describe'] = obj.describe()
-            if hasattr(obj, 'info'):
-                pickle_info['info'] = obj.info()
+            if hasattr(obj, 'dtypes'):
+                #head, shape and dtypes only, describe() and info() scan the whole DataFrame
+                pickle_info['preview'] = preview(obj, 1024)
             if type(obj) == list:
                 pickle_info['length'] = len(obj)
-                pickle_info['peek inside'] = str(obj)[:100]+'...'
+                pickle_info['peek inside'] = preview(obj, 100)
             if type(obj) == str:
                 pickle_info['length'] = len(obj)
-                pickle_info['peek inside'] = obj
+                pickle_info['peek inside'] = preview(obj, 1024)
             file_descriptions.append(pickle_info)
 
     return file_descriptions
@@ -314,6 +262,67 @@ def final_operation(operations_graph):
     print(operation)
     return operation
 
+def configure_controller(question_controller, plan_cache = None, plan_library = None, sampling = None, speculation = False, early_start = False, logger = None):
+    """
+    Turn on the optional features of the Controller answering a question. The plan cache, the plan library and
+    the adaptive sampling can be shared by the questions of a batch. Speculation gets a Speculator per question,
+    since a run discards the pending speculations of its Speculator.
+
+    :param question_controller: The Controller of the question.
+    :type question_controller: controller.Controller
+    :param plan_cache: PlanCache reusing the validated plans of questions with the same template. Defaults to None.
+    :type plan_cache: PlanCache
+    :param plan_library: PlanLibrary reusing or seeding the plans of similar questions. Defaults to None.
+    :type plan_library: PlanLibrary
+    :param sampling: AdaptiveSampling of the planning, conversion and assessment branches. Defaults to None.
+    :type sampling: AdaptiveSampling
+    :param speculation: Whether the phase after an assessment starts for the leading candidate. Defaults to False.
+    :type speculation: bool
+    :param early_start: Whether the leading steps of the plan are prefetched while it is streamed. Defaults to False.
+    :type early_start: bool
+    """
+    question_controller.plan_cache = plan_cache
+    question_controller.plan_library = plan_library
+    question_controller.sampling = sampling
+    question_controller.speculation = Speculator(logger = logger) if speculation else None
+    question_controller.early_start = early_start
+
+def answer_batch(answer, questions, lm, max_concurrency = 8, max_batch = 16, logger = None):
+    """
+    Answer questions concurrently, each with its own Controller, sharing a BatchingLanguageModel
+    that bounds the prompts in flight, and groups them for a model with query_batch.
+
+    :param answer: Answers a question with a language model, answer(question, lm) -> answer.
+    :type answer: Callable
+    :param questions: The questions.
+    :type questions: List[str]
+    :param lm: The language model.
+    :type lm: AbstractLanguageModel
+    :param max_concurrency: The number of questions answered at once. Defaults to 8.
+    :type max_concurrency: int
+    :param max_batch: The maximum number of prompts in flight. Defaults to 16.
+    :type max_batch: int
+    :return: The answers in the order of the questions, "" for the questions that failed.
+    :rtype: List
+    """
+    logger = logger if logger is not None else logging.getLogger(__name__)
+    batching_lm = BatchingLanguageModel(lm, max_batch = max_batch, logger = logger)
+    outputs = []
+    try:
+        with ThreadPoolExecutor(max_workers = max_concurrency) as executor:
+            # every question gets a copy of the caller's context, so deadlines and other context stay per question
+            futures = [executor.submit(contextvars.copy_context().run, answer, question, batching_lm) for question in questions]
+            for question, future in zip(questions, futures):
+                try:
+                    outputs.append(future.result())
+                except Exception as e:
+                    logger.error(f"Error answering {question}: {e}")
+                    outputs.append("")
+    finally:
+        batching_lm.close()
+    logger.info(f"Answered {len(questions)} questions with {batching_lm.queries} prompts, at most {batching_lm.largest_batch} dispatched at once")
+    return outputs
+
 def retrieve_from_chat_history(chat_history, chat_id, message_id):
     all_file_descriptions = []
     all_plans = []
@@ -77,6 +77,13 @@ The relationships are the following:
 
 import json
 import dill
+from escargot.plan_cache import PlanCache
+from escargot.operations.sampling import AdaptiveSampling
+# one plan cache and one sampling policy for the whole sweep, so the questions of every file reuse the plans of the
+# questions answered before them. The steps run in process, and the plan library is left off: it persists plans in
+# the default memory store, so a sweep would reuse the plans of a previous sweep.
+plan_cache = PlanCache()
+sampling = AdaptiveSampling()
 json_files =  ['MCQ_1hop.json', 'MCQ_2hop.json', 'OpenEnded_1hop.json', 'OpenEnded_2hop.json', 'True_or_False_1hop.json', 'True_or_False_2hop.json']
 responses = {}
 for json_file in json_files:
@@ -84,17 +91,22 @@ for json_file in json_files:
     with open("../dataset/"+json_file) as f:
         data = json.load(f)
     responses[json_file] = {}
-    for question in data:
-        response = ''
-        tries = 0
-        while response == '' and tries < 3:
-            escargot.graph_client.cache = {}
-            try:
-                response = escargot.ask(question['question'], answer_type= "array",debug_level = 0)
-            except Exception as e:
-                response = ''
-            tries += 1
-        
+    questions = [question['question'] for question in data]
+    answers = [''] * len(questions)
+    # the questions of a file are answered together, and the ones without a response are asked again
+    pending = list(range(len(questions)))
+    tries = 0
+    while tries < 3 and len(pending) > 0:
+        escargot.graph_client.cache = {}
+        batch_answers = escargot.ask_batch([questions[i] for i in pending], answer_type= "array",debug_level = 0,
+                                           plan_cache = plan_cache, sampling = sampling, speculation = True, early_start = True,
+                                           memoize = True, repair_candidates = 2, step_timeout = 120)
+        for i, answer in zip(pending, batch_answers):
+            answers[i] = answer
+        pending = [i for i in pending if isinstance(answers[i], str) and answers[i] == '']
+        tries += 1
+
+    for question, response in zip(data, answers):
         print('question:', question['question'], 'answer:', question['answer'], 'response:', response)
         print("------------------------------------------------------------------------------------------------------------------------------\n")
         responses[json_file][question['question']] = str(response)
@@ -1,56 +1,138 @@
 from __future__ import annotations
-from typing import Dict, List
+from typing import Callable, Dict, List, Tuple
+from collections import OrderedDict
+import functools
+import hashlib
 import re
 import logging
+import threading
+import contextvars
+import copy
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from escargot.prompter import ESCARGOTPrompter
+from escargot.coder.namespace import StepNamespace
+from escargot.coder.liveness import analyze_code, plan_reads, live_variables, live_closure, consumed_outputs, step_key
+from escargot.preview import preview
+from escargot.coder.memo import StepMemo, read_paths
+from escargot.coder.instrumentation import StepRecorder
+from escargot.deadline import Deadline, deadline_scope, enter_deadline, get_deadline, run_with_deadline, take_shortcut, wait_for
 import ast
 import numpy as np
 
-def determine_and_execute(code_snippet, namespace={}):
-    local_context = {}
+# compiled step code keyed by the hash of its normalized source, shared by retries, benchmark questions and replays
+compiled_code_cache = OrderedDict()
+compiled_code_cache_lock = threading.Lock()
+compiled_code_cache_size = 1024
+
+@functools.lru_cache(maxsize=1024)
+def normalize_code(code: str) -> str:
+    #detect long spaces within the code and remove them, but keep \n
+    code = code.replace('            ','')
+    if """```python""" in code:
+        code = code.replace("""```python""",'')
+    if """```""" in code:
+        code = code.replace("""```""",'')
+    if """\n\n""" in code:
+        code = code.replace("""\n\n""",'\n')
+    return code
+
+def compile_code(code_snippet: str) -> Tuple[object, str]:
+    """
+    Parse the code once, classify it as an expression ('eval') or statements ('exec') and compile it.
+    Compiled code objects are cached by the hash of the source.
+    """
+    key = hashlib.sha256(code_snippet.encode("utf-8")).hexdigest()
+    with compiled_code_cache_lock:
+        if key in compiled_code_cache:
+            compiled_code_cache.move_to_end(key)
+            return compiled_code_cache[key]
     #detect if there is a print statement in the code
-    if 'print' in code_snippet:
-        code_snippet = code_snippet.replace('print','')
+    source = code_snippet.replace('print','') if 'print' in code_snippet else code_snippet
     try:
         # Try to parse as an expression
-        ast.parse(code_snippet, mode='eval')
-        # If successful, it's an expression
-        return eval(code_snippet, namespace, local_context), 'eval', local_context
+        compiled = compile(ast.parse(source, mode='eval'), '<step>', 'eval'), 'eval'
     except SyntaxError:
-        # add numpy to the namespace
-        namespace['np'] = np
-        # If there's a syntax error, try to parse as statements
-        #change working directory.
-        # code_snippet = 'os.chdir("/content")\n' + code_snippet
-        exec(code_snippet, namespace, local_context)
-        #find new assets in the directory
-        # logger.info(f"NEW_ASSET|directory: {os.listdir()}: {new_files}")
-        # logger.info(f"NEW_ASSET|directory: {os.listdir()}: {new_files}")
-        return None, 'exec', local_context
+        # If there's a syntax error, parse as statements
+        compiled = compile(ast.parse(source, mode='exec'), '<step>', 'exec'), 'exec'
+    with compiled_code_cache_lock:
+        compiled_code_cache[key] = compiled
+        while len(compiled_code_cache) > compiled_code_cache_size:
+            compiled_code_cache.popitem(last=False)
+    return compiled
+
+def determine_and_execute(code_snippet, namespace={}):
+    local_context = {}
+    code_object, expression_type = compile_code(code_snippet)
+    if expression_type == 'eval':
+        return eval(code_object, namespace, local_context), 'eval', local_context
+    # add numpy to the namespace
+    namespace['np'] = np
+    #change working directory.
+    # code_snippet = 'os.chdir("/content")\n' + code_snippet
+    exec(code_object, namespace, local_context)
+    return None, 'exec', local_context
 
 class Coder:
     """
     Coder class to manage the code generation and execution.
     """
 
-    def __init__(self, file_descriptions = "") -> None:
+    def __init__(self, file_descriptions = "", executor = None, prune_variables = False, repair_candidates = 1, memo = None, memoize = False, trace_memory = False, step_timeout = None) -> None:
         """
         Initialize the Coder instance with the logger.
+
+        :param file_descriptions: Descriptions of the files available to the code. Defaults to "".
+        :type file_descriptions: str
+        :param executor: Optional WorkerPool that runs the code in sandboxed worker processes. Defaults to None (run in process).
+        :type executor: WorkerPool
+        :param prune_variables: Whether variables that no pending step reads, directly or through the functions it calls, are released after each step. Defaults to False.
+        :type prune_variables: bool
+        :param repair_candidates: Number of fixes requested per failed attempt. Candidates run in parallel and the first one that succeeds is kept. Defaults to 1.
+        :type repair_candidates: int
+        :param memo: StepMemo reusing the outcome of steps whose code and inputs did not change, implies memoize. Defaults to None.
+        :type memo: StepMemo
+        :param memoize: Whether step outcomes are memoized, in a memo of this Coder unless memo is given. Defaults to False.
+        :type memoize: bool
+        :param trace_memory: Whether step peak memory is traced with tracemalloc instead of sampled from the RSS. Defaults to False.
+        :type trace_memory: bool
+        :param step_timeout: Budget of each step in seconds, shared by its attempts, repairs and knowledge_extract calls. Defaults to None (no limit).
+        :type step_timeout: float
         """
-        self.local_context = {}
-        self.local_context_by_step = {}
+        self.namespace = StepNamespace()
         self.step_output = {}
         self.executed_code = {}
         self.instructions = {}
         self.file_descriptions = file_descriptions
+        self.executor = executor
+        self.prune_variables = prune_variables
+        self.repair_candidates = repair_candidates
+        self.memo = memo if memo is not None else (StepMemo() if memoize else None)
+        # keys the steps executed ahead of time by prefetch, whether or not outcomes are memoized
+        self.prefetch_keys = self.memo if self.memo is not None else StepMemo(max_items=0)
+        self.trace_memory = trace_memory
+        self.step_timeout = step_timeout
+        # futures of the outcomes of steps executed ahead of time by prefetch, keyed by memo key
+        self.prefetched = {}
+        self.prefetch_executor = None
+        self.step_metrics = {}
+
+    @property
+    def local_context(self) -> Dict:
+        return self.namespace.globals
 
-    def execute_code(self, code: str, instruction: str, step_id: str, prompter: ESCARGOTPrompter, logger: logging.Logger, full_code = "") -> str:
+    @property
+    def local_context_by_step(self) -> Dict:
+        return self.namespace.views
+
+    def execute_code(self, code: str, instruction: str, step_id: str, prompter: ESCARGOTPrompter, logger: logging.Logger, full_code = "", instructions: List[Dict] = None) -> str:
         """
         Execute the code and return the output.
 
         :param code: The code to be executed.
         :type code: str
+        :param instructions: All instructions of the plan, used to prune variables no later step reads. Defaults to None.
+        :type instructions: List[Dict]
         :return: The output of the code execution.
         :rtype: str
         """
@@ -62,44 +144,84 @@ class Coder:
             for cur_step_id, step in self.instructions.items():
                 context += "Step " + cur_step_id + ": " + step + "\n"
                 context += "Code: " + self.executed_code[cur_step_id] + "\n"
-                output = self.step_output[cur_step_id]
-                if len(str(output)) > 256:
-                    output = str(output)[:256] + "..."
-                context += "Local variables: " + str(output) + "\n"
+                context += "Local variables: " + preview(self.step_output[cur_step_id]) + "\n"
 
             # code = prompter.adjust_code(code, instruction, context)
 
-        def knowledge_extract(request):
-            return prompter.get_knowledge(request,instruction,code,full_code)
+        recorder = StepRecorder(step_id, self.trace_memory)
+        knowledge_extract = self.knowledge_extractor(prompter, instruction, code, full_code, recorder)
         # Add the knowledge_extract function to the local context
-        self.local_context["knowledge_extract"] = knowledge_extract
-        self.local_context["prompter"] = prompter
+        self.namespace.set_base("knowledge_extract", knowledge_extract)
+        self.namespace.set_base("prompter", prompter)
 
-        backup_local_context = self.local_context.copy()
-        
-        while tries > 0 and not compiled:
-            try:
-                #detect long spaces within the code and remove them, but keep \n
-                code = code.replace('            ','')
-                if """```python""" in code:
-                    code = code.replace("""```python""",'')
-                if """```""" in code:
-                    code = code.replace("""```""",'')
-                if """\n\n""" in code:
-                    code = code.replace("""\n\n""",'\n')
-                
-                result, expression_type, local_context = determine_and_execute(code, self.local_context)
-                compiled = True
-            except Exception as e:
-                logger.warning(f"Could not execute code: {code}. Encountered exception: {e}")
-                self.local_context = backup_local_context.copy()
-                #debug using the prompter and using the error message
-                prompt = prompter.generate_debug_code_prompt(code, instruction, e)
-                code =prompter.lm.get_response_texts(
-                    prompter.lm.query(prompt, num_responses=1)
-                )[0]
-                # code = prompter.adjust_code(code, instruction, context)
-                tries -= 1
+        try:
+            with recorder, deadline_scope(self.step_timeout, name=f"step {step_id}") as deadline:
+                memo_key = None
+                if self.memo is not None or len(self.prefetched) > 0:
+                    memo_code = code = normalize_code(code)
+                    memo_inputs = self.prefetch_keys.inputs(memo_code, self.local_context, exclude=self.namespace.base)
+                    memo_key = self.prefetch_keys.key(memo_code, inputs=memo_inputs)
+                    outcome = None
+                    if memo_key in self.prefetched:
+                        try:
+                            outcome = wait_for(self.prefetched.pop(memo_key), f"the prefetched step {step_id}")
+                            recorder.metrics["prefetched"] = True
+                        except TimeoutError:
+                            raise
+                        except Exception as e:
+                            logger.debug(f"Prefetched execution of step {step_id} failed: {e}")
+                    if outcome is None and self.memo is not None and memo_key is not None:
+                        outcome = self.memo.get(memo_key)
+                        recorder.metrics["memoized"] = outcome is not None
+                    if outcome is not None:
+                        code, result, expression_type, local_context = outcome
+                        compiled = True
+                        logger.info(f"Reusing the {'prefetched' if recorder.metrics.get('prefetched') else 'memoized'} output of step {step_id}")
+
+                candidates = [code]
+                while tries > 0 and not compiled:
+                    recorder.metrics["attempts"] += 1
+                    if len(candidates) == 1:
+                        try:
+                            code = normalize_code(candidates[0])
+                            # the knowledge is adapted to the code that runs, not to the code before its repair
+                            knowledge_extract = self.knowledge_extractor(prompter, instruction, code, full_code, recorder)
+                            self.namespace.set_base("knowledge_extract", knowledge_extract)
+                            result, expression_type, local_context = self.run(code, self.local_context, knowledge_extract)
+                            compiled = True
+                        except Exception as e:
+                            error = e
+                    else:
+                        code, outcome, error = self.run_candidates(candidates, instruction, prompter, full_code, recorder)
+                        if outcome is not None:
+                            result, expression_type, local_context = outcome
+                            compiled = True
+                    if not compiled:
+                        if deadline is not None and deadline.expired():
+                            raise TimeoutError(str(error)) if not isinstance(error, TimeoutError) else error
+                        if take_shortcut("skip_repair", f"step {step_id}"):
+                            logger.warning(f"Not enough time left to repair step {step_id}: {error}")
+                            break
+                        logger.warning(f"Could not execute code: {code}. Encountered exception: {error}")
+                        self.namespace.rollback()
+                        #debug using the prompter and using the error message
+                        prompt = prompter.generate_debug_code_prompt(code, instruction, error)
+                        candidates = prompter.lm.get_response_texts(
+                            prompter.lm.query(prompt, num_responses=self.repair_candidates)
+                        )[:max(self.repair_candidates, 1)]
+                        code = candidates[0]
+                        # code = prompter.adjust_code(code, instruction, context)
+                        tries -= 1
+                    # steps that changed their inputs in place are not memoized, reusing them would skip the change
+                    elif memo_key is not None and self.memo is not None and self.memo.unchanged(memo_code, memo_inputs, self.local_context):
+                        self.memo.put(memo_key, (code, result, expression_type, local_context))
+        except TimeoutError as e:
+            # cancelled: undo the partial step and let the controller retry
+            self.namespace.rollback()
+            recorder.metrics["timed_out"] = True
+            self.step_metrics[step_id] = recorder.metrics
+            logger.error(f"Step {step_id} cancelled: {e}")
+            raise
         if compiled:
             self.executed_code[step_id] = code
             self.instructions[step_id] = instruction
@@ -108,8 +230,151 @@ class Coder:
                 self.step_output[step_id] = result
             else:
                 self.step_output[step_id] = local_context
-                self.local_context = self.local_context | local_context
+            recorder.record_output(self.step_output[step_id])
+        self.step_metrics[step_id] = recorder.metrics
         logger.info(f"Step output: {self.step_output}")
-        self.local_context_by_step[step_id] = self.local_context.copy()
+        logger.info(f"Step metrics: {recorder.metrics}")
+        self.namespace.commit(step_id, local_context if compiled and expression_type == 'exec' else {})
+        if compiled and self.prune_variables and instructions is not None:
+            self.prune(step_id, instructions, logger)
         return code,compiled
-    
\ No newline at end of file
+    
+
+    def prefetch(self, step_id: str, code: str, instruction: str, prompter: ESCARGOTPrompter, logger: logging.Logger, full_code = ""):
+        """
+        Execute a step that does not depend on other steps in the background, e.g. while the rest of the plan is
+        still being generated, and keep its outcome until execute_code reaches the step with the same code and
+        inputs. The plan has not been validated yet, so only steps without side effects are prefetched: steps
+        that write files, or read a path computed at run time, are not.
+
+        :param step_id: The id of the step.
+        :type step_id: str
+        :param code: The code of the step.
+        :type code: str
+        :return: The future of the background execution, or None if the step is not prefetched.
+        :rtype: Future
+        """
+        code = normalize_code(code)
+        if read_paths(code) is None:
+            return None
+        memo_key = self.prefetch_keys.key(code, self.local_context, exclude=self.namespace.base)
+        if memo_key is None or memo_key in self.prefetched or (self.memo is not None and self.memo.get(memo_key) is not None):
+            return None
+
+        def prefetch_step():
+            knowledge_extract = self.knowledge_extractor(prompter, instruction, code, full_code)
+            namespace = dict(self.local_context)
+            namespace["knowledge_extract"] = knowledge_extract
+            with deadline_scope(self.step_timeout, name=f"prefetched step {step_id}"):
+                result, expression_type, local_context = self.run(code, namespace, knowledge_extract)
+            logger.info(f"Prefetched step {step_id}")
+            return code, result, expression_type, local_context
+
+        if self.prefetch_executor is None:
+            self.prefetch_executor = ThreadPoolExecutor(max_workers=4)
+        future = self.prefetch_executor.submit(contextvars.copy_context().run, prefetch_step)
+        self.prefetched[memo_key] = future
+        return future
+
+    @staticmethod
+    def knowledge_extractor(prompter: ESCARGOTPrompter, instruction: str, code: str, full_code: str, recorder: StepRecorder = None) -> Callable:
+        """
+        Get the knowledge_extract function of a step, which passes the code it runs for to the prompter.
+        """
+        def knowledge_extract(request):
+            return run_with_deadline(prompter.get_knowledge, request, instruction, code, full_code)
+        if recorder is not None:
+            knowledge_extract = recorder.wrap_knowledge_extract(knowledge_extract)
+        return knowledge_extract
+
+    def run(self, code: str, namespace: Dict, knowledge_extract) -> Tuple:
+        """
+        Execute normalized code in the namespace, in a worker process if an executor is set.
+        """
+        if self.executor is not None:
+            namespace = {name: value for name, value in namespace.items() if name != "prompter"}
+            return self.executor.execute(code, namespace, {"knowledge_extract": knowledge_extract})
+        return determine_and_execute(code, namespace)
+
+    def run_candidates(self, candidates: List[str], instruction: str, prompter: ESCARGOTPrompter, full_code: str, recorder: StepRecorder = None) -> Tuple:
+        """
+        Execute repair candidates in parallel, each in its own copy of the namespace.
+        The candidate kept is the first in response order that succeeds, so the choice does not depend on timing,
+        and the call returns as soon as it and every candidate before it have finished.
+        The other candidates are then cancelled: in a WorkerPool their workers are killed, in process they stop
+        at their next knowledge_extract call, but pure Python code cannot be interrupted and runs to completion
+        in the background on its own copy of the variables.
+
+        :param candidates: The candidate codes, in the order the language model returned them.
+        :type candidates: List[str]
+        :return: The code kept, its (result, expression type, local variables) or None, and the error of the first candidate if all failed.
+        :rtype: Tuple
+        """
+        candidates = [normalize_code(candidate) for candidate in candidates]
+        deadlines = [Deadline(float("inf"), parent=get_deadline(), name=f"repair candidate {i}") for i in range(len(candidates))]
+
+        def attempt(candidate, deadline):
+            knowledge_extract = self.knowledge_extractor(prompter, instruction, candidate, full_code, recorder)
+            namespace = self.candidate_namespace(candidate)
+            namespace["knowledge_extract"] = knowledge_extract
+            with enter_deadline(deadline):
+                return self.run(candidate, namespace, knowledge_extract)
+
+        pool = ThreadPoolExecutor(max_workers=len(candidates))
+        futures = [pool.submit(contextvars.copy_context().run, attempt, candidate, deadline) for candidate, deadline in zip(candidates, deadlines)]
+        pool.shutdown(wait=False)
+        first_error = None
+        try:
+            for candidate, future in zip(candidates, futures):
+                try:
+                    return candidate, future.result(), None
+                except Exception as e:
+                    if first_error is None:
+                        first_error = e
+            return candidates[0], None, first_error
+        finally:
+            for deadline, future in zip(deadlines, futures):
+                if not future.done():
+                    deadline.cancel()
+
+    def candidate_namespace(self, code: str) -> Dict:
+        """
+        Get a namespace for a repair candidate in which it cannot modify the variables of the other candidates.
+        A WorkerPool serializes the namespace anyway; in process, the variables the candidate reads are deep-copied.
+        """
+        namespace = dict(self.local_context)
+        if self.executor is not None:
+            return namespace
+        analysis = analyze_code(code)
+        names = live_closure(analysis[0], namespace) if analysis is not None else list(namespace)
+        for name in names:
+            if name not in namespace or name in self.namespace.base or name == "__builtins__":
+                continue
+            try:
+                namespace[name] = copy.deepcopy(namespace[name])
+            except Exception:
+                # modules, locks, ... are shared
+                pass
+        return namespace
+
+    def prune(self, step_id: str, instructions: List[Dict], logger: logging.Logger) -> None:
+        """
+        Release the variables that no pending step reads, and keep only the consumed variables in the step output.
+
+        :param step_id: The id of the step that was just executed.
+        :type step_id: str
+        :param instructions: All instructions of the plan.
+        :type instructions: List[Dict]
+        """
+        reads = plan_reads(instructions, normalize_code)
+        if reads is None:
+            return
+        executed = {step_key(cur_step_id) for cur_step_id in self.executed_code}
+        pending = [cur_step_id for cur_step_id in reads if cur_step_id not in executed]
+        live = live_closure(live_variables(reads, pending), self.namespace)
+        if isinstance(self.step_output.get(step_id), dict):
+            self.step_output[step_id] = consumed_outputs(step_id, self.step_output[step_id], reads)
+        dead = [name for name in self.namespace if name not in live]
+        if len(dead) > 0:
+            logger.debug(f"Releasing variables no pending step reads: {dead}")
+            self.namespace.release(dead)
@@ -0,0 +1,201 @@
+from __future__ import annotations
+import contextvars
+import sys
+import threading
+import time
+import tracemalloc
+from typing import Any, Dict, Optional
+
+
+def process_rss_mb(pid: int = None) -> Optional[float]:
+    """
+    Get the resident set size of a process in MB, or None where /proc is not available.
+    """
+    try:
+        with open(f"/proc/{pid if pid is not None else 'self'}/status", "r") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        return None
+    return None
+
+
+def estimate_size(value: Any) -> int:
+    """
+    Estimate the number of bytes held by a step output without serializing it.
+    """
+    if hasattr(value, "memory_usage") and hasattr(value, "index"):
+        try:
+            usage = value.memory_usage(index=True)
+            return int(usage.sum()) if hasattr(usage, "sum") else int(usage)
+        except Exception:
+            pass
+    if hasattr(value, "nbytes"):
+        return int(value.nbytes)
+    size = sys.getsizeof(value, 0)
+    if isinstance(value, dict):
+        size += sum(sys.getsizeof(key, 0) + sys.getsizeof(item, 0) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(sys.getsizeof(item, 0) for item in value)
+    return size
+
+
+# the recorder of the step being executed, so a WorkerPool can report the usage of the worker running it
+current_recorder: contextvars.ContextVar[Optional["StepRecorder"]] = contextvars.ContextVar("escargot_step_recorder", default=None)
+# recorders of the steps running in this process, and how many of them trace allocations
+active_recorders = set()
+tracing_recorders = 0
+# whether the recorders started tracemalloc, and so stop it when the last of them exits
+tracing_started = False
+active_recorders_lock = threading.Lock()
+
+
+class RssSampler:
+    """
+    RssSampler polls the resident set size of the process from a background thread and keeps the highest value seen.
+    """
+
+    def __init__(self, interval: float = 0.01) -> None:
+        self.interval = interval
+        self.peak = process_rss_mb()
+        self._stop = threading.Event()
+        self._thread = None
+        if self.peak is not None:
+            self._thread = threading.Thread(target=self.sample, name="escargot-rss-sampler", daemon=True)
+            self._thread.start()
+
+    def sample(self) -> None:
+        while not self._stop.wait(self.interval):
+            rss = process_rss_mb()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+
+    def stop(self) -> Optional[float]:
+        """
+        Stop sampling.
+
+        :return: The highest RSS seen in MB, or None where /proc is not available.
+        :rtype: Optional[float]
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            rss = process_rss_mb()
+            if rss is not None and rss > self.peak:
+                self.peak = rss
+        return self.peak
+
+
+class StepRecorder:
+    """
+    StepRecorder measures one step: wall and CPU time, peak memory, knowledge_extract calls and output size.
+
+    cpu_seconds is the CPU time of the thread running the step, so concurrent steps do not count each other.
+    Memory is a process-wide measure: peak_memory_growth_mb is the peak above the level at the start of the step,
+    traced with tracemalloc when trace_memory is set, otherwise sampled from the RSS. While other steps run in the
+    process (batched questions, repair candidates), their allocations are included and concurrent is set.
+    Steps run in a WorkerPool also report the CPU time and the peak RSS of their worker process.
+    """
+
+    def __init__(self, step_id: str, trace_memory: bool = False) -> None:
+        """
+        Initialize the StepRecorder.
+
+        :param step_id: The id of the step.
+        :type step_id: str
+        :param trace_memory: Whether to trace allocations with tracemalloc, which is exact but slows the step down. Defaults to False.
+        :type trace_memory: bool
+        """
+        self.step_id = step_id
+        self.trace_memory = trace_memory
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Any] = {
+            "step_id": step_id,
+            "wall_seconds": None,
+            "cpu_seconds": None,
+            "peak_memory_growth_mb": None,
+            "memory_source": "tracemalloc" if trace_memory else "rss_sampled",
+            "concurrent": False,
+            "worker_cpu_seconds": None,
+            "worker_peak_rss_mb": None,
+            "knowledge_extract_calls": 0,
+            "knowledge_extract_seconds": 0.0,
+            "attempts": 0,
+            "memoized": False,
+            "prefetched": False,
+            "output_variables": None,
+            "output_bytes": None,
+        }
+
+    def __enter__(self) -> StepRecorder:
+        global tracing_recorders, tracing_started
+        with active_recorders_lock:
+            if len(active_recorders) > 0:
+                self.metrics["concurrent"] = True
+                for recorder in active_recorders:
+                    recorder.metrics["concurrent"] = True
+            active_recorders.add(self)
+            if self.trace_memory:
+                # resetting the peak would lose the peak of the other traced steps
+                if tracing_recorders == 0:
+                    tracing_started = not tracemalloc.is_tracing()
+                    if tracing_started:
+                        tracemalloc.start()
+                    tracemalloc.reset_peak()
+                tracing_recorders += 1
+                self.traced_before = tracemalloc.get_traced_memory()[0]
+        self.token = current_recorder.set(self)
+        self.rss_before = process_rss_mb()
+        self.sampler = RssSampler() if not self.trace_memory else None
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        return self
+
+    def __exit__(self, *args) -> None:
+        global tracing_recorders
+        self.metrics["wall_seconds"] = time.perf_counter() - self.wall_started
+        self.metrics["cpu_seconds"] = time.thread_time() - self.cpu_started
+        current_recorder.reset(self.token)
+        if self.sampler is not None:
+            peak = self.sampler.stop()
+            if self.rss_before is not None and peak is not None:
+                self.metrics["peak_memory_growth_mb"] = max(peak - self.rss_before, 0)
+        with active_recorders_lock:
+            active_recorders.discard(self)
+            if self.trace_memory:
+                self.metrics["peak_memory_growth_mb"] = max(tracemalloc.get_traced_memory()[1] - self.traced_before, 0) / (1024 * 1024)
+                tracing_recorders -= 1
+                if tracing_recorders == 0 and tracing_started:
+                    tracemalloc.stop()
+
+    def record_worker_usage(self, cpu_seconds: float, peak_rss_mb: Optional[float]) -> None:
+        """
+        Add the usage a worker process reported for running (an attempt of) the step.
+        """
+        with self.lock:
+            self.metrics["worker_cpu_seconds"] = (self.metrics["worker_cpu_seconds"] or 0.0) + cpu_seconds
+            if peak_rss_mb is not None:
+                self.metrics["worker_peak_rss_mb"] = max(self.metrics["worker_peak_rss_mb"] or 0.0, peak_rss_mb)
+
+    def wrap_knowledge_extract(self, knowledge_extract):
+        """
+        Wrap knowledge_extract so its calls and their latency are counted for this step.
+        """
+        def timed_knowledge_extract(request):
+            started = time.perf_counter()
+            try:
+                return knowledge_extract(request)
+            finally:
+                with self.lock:
+                    self.metrics["knowledge_extract_calls"] += 1
+                    self.metrics["knowledge_extract_seconds"] += time.perf_counter() - started
+        return timed_knowledge_extract
+
+    def record_output(self, output: Any) -> None:
+        if isinstance(output, dict):
+            self.metrics["output_variables"] = len(output)
+            self.metrics["output_bytes"] = sum(estimate_size(value) for value in output.values())
+        else:
+            self.metrics["output_variables"] = 1
+            self.metrics["output_bytes"] = estimate_size(output)
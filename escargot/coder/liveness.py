@@ -0,0 +1,151 @@
+from __future__ import annotations
+import ast
+import functools
+import types
+from typing import Any, Dict, FrozenSet, List, Mapping, Optional, Set, Tuple
+
+# code calling these can read any variable, so nothing is pruned while such a step is pending
+DYNAMIC_ACCESS = {"locals", "globals", "vars", "eval", "exec", "dir", "__import__"}
+
+
+@functools.lru_cache(maxsize=1024)
+def analyze_code(code: str) -> Optional[Tuple[FrozenSet[str], FrozenSet[str]]]:
+    """
+    Determine which variables a step reads and which it writes.
+    Names read inside functions and comprehensions count as reads of the step.
+
+    :param code: The normalized code of the step.
+    :type code: str
+    :return: The names read and the names written, or None if the code cannot be analyzed.
+    :rtype: Optional[Tuple[FrozenSet[str], FrozenSet[str]]]
+    """
+    try:
+        tree = ast.parse(code.replace('print','') if 'print' in code else code)
+    except SyntaxError:
+        return None
+    reads = set()
+    writes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if isinstance(node.ctx, ast.Store):
+                writes.add(node.id)
+            else:
+                reads.add(node.id)
+        elif isinstance(node, ast.AugAssign) and isinstance(node.target, ast.Name):
+            reads.add(node.target.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            writes.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                writes.add((alias.asname or alias.name).split(".")[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            reads.update(node.names)
+    if len(reads & DYNAMIC_ACCESS) > 0:
+        return None
+    return frozenset(reads), frozenset(writes)
+
+
+def step_key(step_id) -> str:
+    return str(step_id).replace("StepID_", "")
+
+
+def plan_reads(instructions: List[Dict], normalize=None) -> Optional[Dict[str, FrozenSet[str]]]:
+    """
+    Get the variables read by every step of a plan.
+
+    :param instructions: The instructions of the plan, each with a StepID and a list of Code.
+    :type instructions: List[Dict]
+    :param normalize: Function applied to the code before analysis. Defaults to None.
+    :type normalize: Callable
+    :return: The names read per step id, or None if some step cannot be analyzed.
+    :rtype: Optional[Dict[str, FrozenSet[str]]]
+    """
+    reads = {}
+    for instruction in instructions:
+        codes = instruction.get("Code")
+        if codes is None or len(codes) == 0 or codes[0] is None:
+            continue
+        code = normalize(codes[0]) if normalize is not None else codes[0]
+        analysis = analyze_code(code)
+        if analysis is None:
+            return None
+        reads[step_key(instruction["StepID"])] = analysis[0]
+    return reads
+
+
+def live_variables(reads: Dict[str, FrozenSet[str]], pending: List[str]) -> FrozenSet[str]:
+    """
+    Get the variables that a step which has not been executed yet may still read.
+    """
+    live = set()
+    for step_id in pending:
+        live.update(reads.get(step_key(step_id), ()))
+    return frozenset(live)
+
+
+def code_globals(code: types.CodeType) -> Set[str]:
+    """
+    Get the global names a code object and the code objects nested in it (inner functions, lambdas,
+    comprehensions) may read.
+    """
+    names = set(code.co_names)
+    for constant in code.co_consts:
+        if isinstance(constant, types.CodeType):
+            names.update(code_globals(constant))
+    return names
+
+
+def referenced_globals(value: Any) -> Set[str]:
+    """
+    Get the global names a function, lambda, method or class defined by a step reads when it is called.
+    Other values reference no globals.
+    """
+    if isinstance(value, types.MethodType):
+        value = value.__func__
+    if isinstance(value, types.FunctionType):
+        return code_globals(value.__code__)
+    if isinstance(value, type):
+        names = set()
+        for attribute in vars(value).values():
+            if isinstance(attribute, (staticmethod, classmethod)):
+                attribute = attribute.__func__
+            if isinstance(attribute, property):
+                attribute = attribute.fget
+            if isinstance(attribute, types.FunctionType):
+                names.update(code_globals(attribute.__code__))
+        return names
+    return set()
+
+
+def live_closure(live: FrozenSet[str], namespace: Mapping[str, Any]) -> FrozenSet[str]:
+    """
+    Extend the live variables with the globals read by the live functions and classes, transitively,
+    e.g. a list that a live function looks up when a later step calls it.
+    """
+    live = set(live)
+    pending = list(live)
+    while len(pending) > 0:
+        name = pending.pop()
+        if name not in namespace:
+            continue
+        for referenced in referenced_globals(namespace[name]):
+            if referenced not in live:
+                live.add(referenced)
+                pending.append(referenced)
+    return frozenset(live)
+
+
+def consumed_outputs(step_id: str, outputs: Dict, reads: Dict[str, FrozenSet[str]]) -> Dict:
+    """
+    Keep the variables of a step's output that another step reads.
+    A step whose variables are read by no other step is a final step and keeps its whole output.
+    """
+    read_elsewhere = set()
+    for other_step_id, names in reads.items():
+        if other_step_id != step_key(step_id):
+            read_elsewhere.update(names)
+    read_elsewhere = live_closure(frozenset(read_elsewhere), outputs)
+    consumed = {name: value for name, value in outputs.items() if name in read_elsewhere}
+    if len(consumed) == 0:
+        return outputs
+    return consumed
@@ -0,0 +1,353 @@
+from __future__ import annotations
+import ast
+import builtins
+import functools
+import hashlib
+import os
+import threading
+import types
+from collections import OrderedDict
+from typing import Any, Dict, FrozenSet, Optional, Tuple
+
+import dill
+
+from escargot.coder.liveness import analyze_code
+
+
+def fingerprint(value: Any) -> Optional[str]:
+    """
+    Hash the content of a variable. DataFrames and arrays are hashed from their data, other values from their pickle.
+
+    :param value: The value to fingerprint.
+    :type value: Any
+    :return: The hex digest, or None if the value cannot be fingerprinted.
+    :rtype: Optional[str]
+    """
+    digest = hashlib.sha256()
+    if hasattr(value, "to_numpy") and hasattr(value, "index"):
+        try:
+            import pandas as pd
+            labels = list(value.columns) if hasattr(value, "columns") else [value.name]
+            digest.update(repr((type(value).__name__, value.shape, labels)).encode("utf-8"))
+            digest.update(pd.util.hash_pandas_object(value, index=True).to_numpy().tobytes())
+            return digest.hexdigest()
+        except Exception:
+            # e.g. cells holding lists cannot be hashed by pandas, fall back to the pickle
+            digest = hashlib.sha256()
+    try:
+        if hasattr(value, "tobytes") and hasattr(value, "dtype") and getattr(value.dtype, "hasobject", True) is False:
+            digest.update(repr((value.shape, str(value.dtype))).encode("utf-8"))
+            digest.update(value.tobytes())
+        else:
+            digest.update(dill.dumps(value, protocol=dill.HIGHEST_PROTOCOL))
+    except Exception:
+        return None
+    return digest.hexdigest()
+
+
+# calls that write files or change the process, a step making them is never memoized
+WRITE_CALLS = {
+    "to_csv", "to_excel", "to_json", "to_parquet", "to_pickle", "to_feather", "to_hdf", "to_sql", "to_html",
+    "savefig", "save", "savez", "savetxt", "write", "writelines", "dump", "remove", "unlink", "rename", "rmdir",
+    "rmtree", "mkdir", "makedirs", "chdir", "system", "move", "copyfile", "write_text", "write_bytes", "touch",
+}
+# calls that read a path, a step making them is memoized only if the path is a constant
+READ_CALLS = {
+    "open", "read_csv", "read_excel", "read_json", "read_parquet", "read_pickle", "read_table", "read_feather",
+    "read_hdf", "read_fwf", "load", "loadtxt", "genfromtxt", "fromfile", "listdir", "scandir", "walk", "exists",
+    "isfile", "isdir", "getsize", "read_text", "read_bytes", "imread", "glob",
+}
+# methods that change their receiver in place
+MUTATING_METHODS = {
+    "append", "extend", "insert", "pop", "popitem", "remove", "clear", "update", "setdefault", "sort", "reverse",
+    "add", "discard", "difference_update", "intersection_update", "symmetric_difference_update", "fill", "resize",
+    "itemset", "put", "setflags",
+}
+
+
+def call_name(node: ast.Call) -> Optional[str]:
+    if isinstance(node.func, ast.Name):
+        return node.func.id
+    if isinstance(node.func, ast.Attribute):
+        return node.func.attr
+    return None
+
+
+def root_name(node: ast.AST) -> Optional[str]:
+    while isinstance(node, (ast.Attribute, ast.Subscript)):
+        node = node.value
+    return node.id if isinstance(node, ast.Name) else None
+
+
+@functools.lru_cache(maxsize=1024)
+def read_paths(code: str) -> Optional[FrozenSet[str]]:
+    """
+    Get the files a step reads, so their state can be part of its memo key.
+
+    :param code: The normalized code of the step.
+    :type code: str
+    :return: The constant paths the step reads, or None if it writes files or reads a path computed at run time.
+    :rtype: Optional[FrozenSet[str]]
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    paths = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Call):
+            continue
+        name = call_name(node)
+        if name in WRITE_CALLS:
+            return None
+        if name not in READ_CALLS:
+            continue
+        if name == "open":
+            modes = node.args[1:2] + [keyword.value for keyword in node.keywords if keyword.arg == "mode"]
+            for mode in modes:
+                if not isinstance(mode, ast.Constant) or any(flag in str(mode.value) for flag in "wax+"):
+                    return None
+        if len(node.args) == 0:
+            # e.g. os.listdir() reads the working directory
+            paths.add(".")
+        elif isinstance(node.args[0], ast.Constant) and isinstance(node.args[0].value, str) and name != "glob":
+            paths.add(node.args[0].value)
+        else:
+            return None
+    return frozenset(paths)
+
+
+@functools.lru_cache(maxsize=1024)
+def mutated_names(code: str) -> FrozenSet[str]:
+    """
+    Get the variables a step may change in place: item and attribute assignments, augmented assignments,
+    mutating method calls and calls with inplace=True, and arguments passed to functions defined by steps.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return frozenset()
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Assign, ast.AugAssign, ast.AnnAssign, ast.Delete)):
+            targets = node.targets if isinstance(node, (ast.Assign, ast.Delete)) else [node.target]
+            for target in targets:
+                if isinstance(target, (ast.Attribute, ast.Subscript)) or isinstance(node, ast.AugAssign):
+                    names.add(root_name(target))
+        elif isinstance(node, ast.Call):
+            if isinstance(node.func, ast.Attribute):
+                inplace = any(keyword.arg == "inplace" for keyword in node.keywords)
+                if node.func.attr in MUTATING_METHODS or inplace:
+                    names.add(root_name(node.func.value))
+            elif isinstance(node.func, ast.Name) and not hasattr(builtins, node.func.id):
+                names.update(root_name(arg) for arg in node.args)
+                names.update(root_name(keyword.value) for keyword in node.keywords)
+    names.discard(None)
+    return frozenset(names)
+
+
+class StepMemo:
+    """
+    StepMemo stores the outcome of executed steps, keyed by the normalized step code, the fingerprints
+    of the variables the step reads, the working directory and the state of the files it reads, so retries
+    only execute steps whose code or inputs changed. Steps that write files are never memoized.
+    Outcomes are kept pickled, in memory up to a size bound and on disk beyond it.
+    """
+
+    def __init__(self, max_items: int = 256, max_memory_mb: float = 256, spill_path: str = None, spill_threshold_mb: float = 4) -> None:
+        """
+        Initialize the StepMemo.
+
+        :param max_items: Maximum number of outcomes kept. Defaults to 256.
+        :type max_items: int
+        :param max_memory_mb: Maximum size of the outcomes kept in memory in MB. Defaults to 256.
+        :type max_memory_mb: float
+        :param spill_path: Directory where large outcomes are written. Defaults to None (large outcomes are not kept).
+        :type spill_path: str
+        :param spill_threshold_mb: Outcomes larger than this are written to spill_path. Defaults to 4.
+        :type spill_threshold_mb: float
+        """
+        self.max_items = max_items
+        self.max_memory_bytes = int(max_memory_mb * 1024 * 1024)
+        self.spill_path = spill_path
+        self.spill_threshold_bytes = int(spill_threshold_mb * 1024 * 1024)
+        if spill_path is not None:
+            os.makedirs(spill_path, exist_ok=True)
+        # key -> pickled outcome, or None when the outcome is on disk
+        self.entries = OrderedDict()
+        self.memory_bytes = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def inputs(self, code: str, namespace: Dict[str, Any], exclude=()) -> Optional[Dict[str, str]]:
+        """
+        Fingerprint the inputs of a step: the variables it reads, the working directory and the files it reads.
+
+        :param code: The normalized code of the step.
+        :type code: str
+        :param namespace: The variables available to the step.
+        :type namespace: Dict[str, Any]
+        :param exclude: Names that are not inputs, e.g. knowledge_extract. Defaults to ().
+        :type exclude: Iterable[str]
+        :return: The fingerprint of every input, or None if the step cannot be memoized.
+        :rtype: Optional[Dict[str, str]]
+        """
+        analysis = analyze_code(code)
+        paths = read_paths(code)
+        if analysis is None or paths is None:
+            return None
+        cwd = os.getcwd()
+        inputs = {"\0cwd": cwd}
+        for path in paths:
+            path = os.path.join(cwd, path)
+            try:
+                stat = os.stat(path)
+                inputs["\0file " + path] = f"{stat.st_mtime_ns}:{stat.st_size}"
+            except OSError:
+                inputs["\0file " + path] = "missing"
+        for name in analysis[0]:
+            if name in exclude or name not in namespace or isinstance(namespace[name], types.ModuleType):
+                continue
+            value_fingerprint = fingerprint(namespace[name])
+            if value_fingerprint is None:
+                return None
+            inputs[name] = value_fingerprint
+        return inputs
+
+    def key(self, code: str, namespace: Dict[str, Any] = None, exclude=(), inputs: Dict[str, str] = None) -> Optional[str]:
+        """
+        Compute the memo key of a step from its normalized code and its inputs.
+
+        :param code: The normalized code of the step.
+        :type code: str
+        :param namespace: The variables available to the step, fingerprinted if inputs is not given. Defaults to None.
+        :type namespace: Dict[str, Any]
+        :param exclude: Names that are not inputs, e.g. knowledge_extract. Defaults to ().
+        :type exclude: Iterable[str]
+        :param inputs: The fingerprints returned by inputs. Defaults to None.
+        :type inputs: Dict[str, str]
+        :return: The key, or None if the step cannot be memoized.
+        :rtype: Optional[str]
+        """
+        if inputs is None:
+            inputs = self.inputs(code, namespace, exclude)
+        if inputs is None:
+            return None
+        digest = hashlib.sha256(code.encode("utf-8"))
+        for name in sorted(inputs):
+            digest.update(f"\0{name}\0{inputs[name]}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def unchanged(self, code: str, inputs: Dict[str, str], namespace: Dict[str, Any]) -> bool:
+        """
+        Check that a step did not change its inputs in place; reusing a step that did would skip the change.
+        Only the inputs the code may mutate are fingerprinted again.
+        """
+        for name in mutated_names(code):
+            if name in inputs and (name not in namespace or fingerprint(namespace[name]) != inputs[name]):
+                return False
+        return True
+
+    def spill_file(self, key: str) -> str:
+        return os.path.join(self.spill_path, key + ".pkl")
+
+    def get(self, key: str) -> Optional[Tuple]:
+        """
+        Get a fresh copy of a memoized outcome.
+
+        :param key: The memo key.
+        :type key: str
+        :return: The outcome, or None on a miss.
+        :rtype: Optional[Tuple]
+        """
+        with self.lock:
+            known = key in self.entries
+            data = self.entries.get(key)
+            if known:
+                self.entries.move_to_end(key)
+        if data is None and self.spill_path is not None and os.path.exists(self.spill_file(key)):
+            try:
+                with open(self.spill_file(key), "rb") as f:
+                    data = f.read()
+            except OSError:
+                data = None
+            if data is not None and not known:
+                self.index(key, None)
+        if data is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return dill.loads(data)
+
+    def put(self, key: str, outcome: Tuple) -> bool:
+        """
+        Store an outcome. Outcomes that cannot be pickled are not stored.
+
+        :param key: The memo key.
+        :type key: str
+        :param outcome: The outcome of the step.
+        :type outcome: Tuple
+        :return: Whether the outcome was stored.
+        :rtype: bool
+        """
+        try:
+            data = dill.dumps(outcome, protocol=dill.HIGHEST_PROTOCOL)
+        except Exception:
+            return False
+        if len(data) > self.spill_threshold_bytes or len(data) > self.max_memory_bytes:
+            if self.spill_path is None:
+                return False
+            temp_file = self.spill_file(key) + ".tmp"
+            with open(temp_file, "wb") as f:
+                f.write(data)
+            os.replace(temp_file, self.spill_file(key))
+            data = None
+        self.index(key, data)
+        return True
+
+    def index(self, key: str, data: Optional[bytes]) -> None:
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.memory_bytes -= len(previous)
+            self.entries[key] = data
+            if data is not None:
+                self.memory_bytes += len(data)
+            while len(self.entries) > self.max_items or self.memory_bytes > self.max_memory_bytes:
+                evicted_key, evicted = self.entries.popitem(last=False)
+                if evicted is not None:
+                    self.memory_bytes -= len(evicted)
+                elif self.spill_path is not None:
+                    try:
+                        os.remove(self.spill_file(evicted_key))
+                    except OSError:
+                        pass
+
+    def clear(self) -> None:
+        with self.lock:
+            keys = list(self.entries.keys())
+            self.entries.clear()
+            self.memory_bytes = 0
+        if self.spill_path is not None:
+            for key in keys:
+                try:
+                    os.remove(self.spill_file(key))
+                except OSError:
+                    pass
+
+
+shared_memo = None
+shared_memo_lock = threading.Lock()
+
+
+def get_shared_memo() -> StepMemo:
+    """
+    Get an in-memory StepMemo shared by all Coders of the process, for callers that opt in to reusing step
+    outcomes across questions by passing it to their Coders.
+    """
+    global shared_memo
+    with shared_memo_lock:
+        if shared_memo is None:
+            shared_memo = StepMemo()
+        return shared_memo
@@ -0,0 +1,107 @@
+from __future__ import annotations
+from collections import ChainMap
+from typing import Any, Dict, Iterator, Mapping
+
+
+class StepNamespace:
+    """
+    StepNamespace is a copy-on-write namespace for step execution. Each step only stores the
+    variables it created or overwrote, as a layer over the layers of the previous steps, and the
+    namespace is a ChainMap over those layers, so no step copies it. A failed attempt is rolled back
+    to the last committed layer. A variable overwritten by a later step or released is deleted from
+    the layer that held it, so values no step can read are freed while the plan runs.
+    """
+
+    def __init__(self, base: Dict[str, Any] = None) -> None:
+        """
+        Initialize the StepNamespace.
+
+        :param base: Variables available to every step, e.g. knowledge_extract. Defaults to None.
+        :type base: Dict[str, Any]
+        """
+        self.base = dict(base or {})
+        self.chain = ChainMap(self.base)
+        # the view of the last committed step, the views of finished steps would keep their values alive
+        self.views = {}
+        # flat dictionary handed to eval/exec as globals, so functions defined in a step see earlier variables
+        self.globals = dict(self.base)
+
+    def __getitem__(self, name: str) -> Any:
+        return self.chain[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.chain
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.chain)
+
+    def __len__(self) -> int:
+        return len(self.chain)
+
+    def set_base(self, name: str, value: Any) -> None:
+        """
+        Set a variable that is available to every step and is not part of any step's layer.
+        """
+        self.base[name] = value
+        self.globals[name] = value
+
+    def discard(self, names) -> None:
+        # delete variables from the step layers, keeping the base and dropping layers left empty
+        for layer in self.chain.maps[:-1]:
+            for name in names:
+                layer.pop(name, None)
+        self.chain = ChainMap(*[layer for layer in self.chain.maps[:-1] if len(layer) > 0], self.base)
+
+    def commit(self, step_id: str, delta: Mapping[str, Any]) -> None:
+        """
+        Add the variables created by a step as a new layer, deleting the values they overwrite.
+
+        :param step_id: The id of the step.
+        :type step_id: str
+        :param delta: The variables the step created or overwrote.
+        :type delta: Mapping[str, Any]
+        """
+        if len(delta) > 0:
+            self.discard(delta)
+            self.chain = self.chain.new_child(dict(delta))
+            self.globals.update(delta)
+        self.views = {step_id: self.chain}
+
+    def rollback(self) -> None:
+        """
+        Undo the changes a failed attempt made to the globals, restoring the last committed state.
+        Values are restored by reference, nothing is copied.
+        """
+        for name in list(self.globals.keys()):
+            if name != "__builtins__" and name not in self.chain:
+                del self.globals[name]
+        for name in self.chain:
+            value = self.chain[name]
+            if self.globals.get(name, self) is not value:
+                self.globals[name] = value
+
+    def release(self, names) -> None:
+        """
+        Delete variables from the namespace the next steps run in, and from the layers of the steps that
+        created them, so their values are freed. Variables set with set_base are never released.
+
+        :param names: The names of the variables to release.
+        :type names: Iterable[str]
+        """
+        names = [name for name in names if name not in self.base]
+        self.discard(names)
+        for name in names:
+            self.globals.pop(name, None)
+        for step_id in self.views:
+            self.views[step_id] = self.chain
+
+    def view(self, step_id: str) -> ChainMap:
+        """
+        Get a view of the namespace after the last committed step.
+
+        :param step_id: The id of the step.
+        :type step_id: str
+        :return: The variables visible after the step.
+        :rtype: ChainMap
+        """
+        return self.views[step_id]
@@ -0,0 +1,284 @@
+from __future__ import annotations
+import logging
+import multiprocessing
+import os
+import queue
+import sys
+import time
+import traceback
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import dill
+
+from escargot.coder.coder import determine_and_execute
+from escargot.coder.instrumentation import current_recorder, process_rss_mb
+from escargot.deadline import get_deadline
+
+# imported once in the fork server so every worker starts with them loaded
+PRELOAD_MODULES = ["numpy", "pandas", "escargot.coder.sandbox"]
+
+
+def dumps(obj: Any) -> bytes:
+    return dill.dumps(obj, protocol=dill.HIGHEST_PROTOCOL)
+
+
+def dumps_exception(e: BaseException) -> bytes:
+    try:
+        return dumps(e)
+    except Exception:
+        return dumps(RuntimeError(f"{type(e).__name__}: {e}"))
+
+
+def dumps_namespace(namespace: Dict[str, Any]) -> Dict[str, bytes]:
+    """
+    Serialize every variable separately so one unpicklable value (e.g. an open file) does not fail the step.
+    """
+    serialized = {}
+    for name, value in namespace.items():
+        try:
+            serialized[name] = dumps(value)
+        except Exception:
+            continue
+    return serialized
+
+
+def loads_namespace(serialized: Dict[str, bytes]) -> Dict[str, Any]:
+    return {name: dill.loads(value) for name, value in serialized.items()}
+
+
+def worker_main(connection, address_space_limit_mb: Optional[int] = None) -> None:
+    """
+    Entry point of a worker process: run steps sent by the parent until told to stop.
+    Callbacks such as knowledge_extract are proxied back to the parent over the connection.
+    """
+    try:
+        import resource
+    except ImportError:
+        resource = None
+    if resource is not None and address_space_limit_mb is not None:
+        limit = address_space_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    def make_proxy(name):
+        def proxy(*args, **kwargs):
+            connection.send(("call", name, dumps((args, kwargs))))
+            status, payload = connection.recv()
+            if status == "raise":
+                raise dill.loads(payload)
+            return dill.loads(payload)
+        return proxy
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message[0] == "stop":
+            return
+        _, code, serialized, callback_names, cpu_seconds = message
+        if resource is not None and cpu_seconds is not None:
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            soft = int(usage.ru_utime + usage.ru_stime + cpu_seconds) + 1
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        cpu_started = time.process_time()
+
+        def usage():
+            # the peak RSS of the worker over its lifetime, in MB
+            peak_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 if resource is not None else None
+            return {"cpu_seconds": time.process_time() - cpu_started, "peak_rss_mb": peak_rss_mb}
+
+        try:
+            namespace = loads_namespace(serialized)
+            for name in callback_names:
+                namespace[name] = make_proxy(name)
+            result, expression_type, local_context = determine_and_execute(code, namespace)
+            connection.send(("done", dumps(result) if expression_type == "eval" else None, expression_type, dumps_namespace(local_context), usage()))
+        except BaseException as e:
+            connection.send(("error", dumps_exception(e), traceback.format_exc(), usage()))
+
+
+class Worker:
+    """
+    A warm worker process with its end of the pipe and the number of tasks it has run.
+    """
+
+    def __init__(self, context, address_space_limit_mb: Optional[int]) -> None:
+        self.connection, child_connection = context.Pipe()
+        self.process = context.Process(target=worker_main, args=(child_connection, address_space_limit_mb), daemon=True)
+        self.process.start()
+        child_connection.close()
+        self.tasks = 0
+
+    def kill(self) -> None:
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        # the only place the connection is closed, a closed worker has none
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def stop(self) -> None:
+        if self.connection is not None:
+            try:
+                self.connection.send(("stop",))
+                self.process.join(timeout=5)
+            except (OSError, BrokenPipeError):
+                pass
+        self.kill()
+
+
+class WorkerPool:
+    """
+    WorkerPool executes step code in pre-forked worker processes, outside of the serving process.
+    Each step is bound by a wall-clock, CPU time and RSS limit. Workers are recycled after a number
+    of tasks, and a worker that breaks a limit is killed and replaced. Concurrent callers are served
+    by different workers, so independent questions execute their code in parallel.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = None,
+        max_tasks_per_worker: int = 50,
+        timeout: float = 120,
+        cpu_seconds: float = 120,
+        memory_limit_mb: float = 4096,
+        address_space_limit_mb: int = None,
+        logger: logging.Logger = None,
+    ) -> None:
+        """
+        Initialize the WorkerPool and start its workers.
+
+        :param num_workers: Number of worker processes. Defaults to the number of CPUs.
+        :type num_workers: int
+        :param max_tasks_per_worker: Number of steps after which a worker is replaced. Defaults to 50.
+        :type max_tasks_per_worker: int
+        :param timeout: Wall-clock limit per step in seconds, excluding time spent in callbacks. Defaults to 120.
+        :type timeout: float
+        :param cpu_seconds: CPU time limit per step in seconds. Defaults to 120.
+        :type cpu_seconds: float
+        :param memory_limit_mb: RSS limit per worker in MB, checked while the step runs. Defaults to 4096.
+        :type memory_limit_mb: float
+        :param address_space_limit_mb: Optional hard address space limit per worker in MB. Defaults to None.
+        :type address_space_limit_mb: int
+        """
+        self.num_workers = num_workers if num_workers is not None else (os.cpu_count() or 1)
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.memory_limit_mb = memory_limit_mb
+        self.address_space_limit_mb = address_space_limit_mb
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        if sys.platform != "win32" and "forkserver" in multiprocessing.get_all_start_methods():
+            self.context = multiprocessing.get_context("forkserver")
+            self.context.set_forkserver_preload(PRELOAD_MODULES)
+        else:
+            self.context = multiprocessing.get_context("spawn")
+        self.idle = queue.Queue()
+        self.closed = False
+        for _ in range(self.num_workers):
+            self.idle.put(Worker(self.context, self.address_space_limit_mb))
+
+    def __enter__(self) -> WorkerPool:
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+    def release(self, worker: Worker, healthy: bool) -> None:
+        worker.tasks += 1
+        if not healthy:
+            worker.kill()
+        elif self.closed or worker.tasks >= self.max_tasks_per_worker:
+            worker.stop()
+        else:
+            self.idle.put(worker)
+            return
+        if not self.closed:
+            self.idle.put(Worker(self.context, self.address_space_limit_mb))
+
+    def execute(self, code: str, namespace: Dict[str, Any], callbacks: Dict[str, Callable] = {}) -> Tuple[Any, str, Dict[str, Any]]:
+        """
+        Execute code in a worker, with the same contract as determine_and_execute.
+
+        :param code: The code to execute.
+        :type code: str
+        :param namespace: The variables available to the code. Callables in callbacks are excluded and proxied instead.
+        :type namespace: Dict[str, Any]
+        :param callbacks: Functions that run in this process when the code calls them, e.g. knowledge_extract.
+        :type callbacks: Dict[str, Callable]
+        :return: The result of an expression, the expression type ('eval' or 'exec') and the new local variables.
+        :rtype: Tuple[Any, str, Dict[str, Any]]
+        """
+        assert not self.closed, "The worker pool is closed"
+        worker = self.idle.get()
+        healthy = False
+        try:
+            serialized = dumps_namespace({name: value for name, value in namespace.items() if name not in callbacks})
+            worker.connection.send(("run", code, serialized, list(callbacks.keys()), self.cpu_seconds))
+            deadline = time.monotonic() + self.timeout
+            # the deadline of the step, if any, bounds the total time including callbacks
+            step_deadline = get_deadline()
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError(f"Step exceeded the wall-clock limit of {self.timeout} seconds")
+                if step_deadline is not None:
+                    step_deadline.check("the worker finished the step")
+                if not worker.connection.poll(min(remaining, 0.1)):
+                    rss = process_rss_mb(worker.process.pid)
+                    if rss is not None and rss > self.memory_limit_mb:
+                        raise MemoryError(f"Step exceeded the memory limit of {self.memory_limit_mb} MB")
+                    if not worker.process.is_alive():
+                        raise RuntimeError(f"Worker exited with code {worker.process.exitcode}, the step probably exceeded the CPU limit of {self.cpu_seconds} seconds")
+                    continue
+                try:
+                    message = worker.connection.recv()
+                except EOFError:
+                    worker.process.join(timeout=1)
+                    raise RuntimeError(f"Worker exited with code {worker.process.exitcode}, the step probably exceeded the CPU limit of {self.cpu_seconds} seconds")
+                if message[0] == "call":
+                    _, name, payload = message
+                    args, kwargs = dill.loads(payload)
+                    started = time.monotonic()
+                    try:
+                        worker.connection.send(("return", dumps(callbacks[name](*args, **kwargs))))
+                    except Exception as e:
+                        worker.connection.send(("raise", dumps_exception(e)))
+                    # time spent in the parent (LLM and database calls) does not count against the step
+                    deadline += time.monotonic() - started
+                elif message[0] == "done":
+                    _, result, expression_type, local_context, usage = message
+                    healthy = True
+                    self.record_usage(usage)
+                    result = dill.loads(result) if result is not None else None
+                    return result, expression_type, loads_namespace(local_context)
+                elif message[0] == "error":
+                    _, exception, trace, usage = message
+                    healthy = True
+                    self.record_usage(usage)
+                    self.logger.debug("Step failed in worker: %s", trace)
+                    raise dill.loads(exception)
+        finally:
+            self.release(worker, healthy)
+
+    @staticmethod
+    def record_usage(usage: Dict[str, Any]) -> None:
+        recorder = current_recorder.get()
+        if recorder is not None:
+            recorder.record_worker_usage(usage["cpu_seconds"], usage["peak_rss_mb"])
+
+    def close(self) -> None:
+        """
+        Stop all idle workers. Workers that are busy are stopped when they are released.
+        """
+        self.closed = True
+        while True:
+            try:
+                worker = self.idle.get_nowait()
+            except queue.Empty:
+                break
+            worker.stop()
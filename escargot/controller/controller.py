@@ -6,14 +6,16 @@
 #
 # main author: Nils Blach
 
+import ast
 import json
 import logging
 from typing import List, Optional, Dict, Any
 from escargot.language_models import AbstractLanguageModel
-from escargot.operations import GraphOfOperations, Thought
+from escargot.operations import GraphOfOperations, Operation, Thought
 from escargot.prompter import ESCARGOTPrompter
 from escargot.parser import ESCARGOTParser
 from escargot.coder import Coder
+from escargot.deadline import Degradation, check_deadline, deadline_scope, degradation_scope, run_with_deadline, take_shortcut
 import copy
 import dill as pickle
 import os
@@ -53,6 +55,29 @@ class Controller:
         self.max_run_tries = 3
         self.max_operation_tries = 2
         self.coder = coder
+        # prefetch the leading steps of the plan while it is being generated
+        self.early_start = False
+        # PlanCache of validated plans, e.g. get_shared_plan_cache(). Defaults to None (no reuse).
+        self.plan_cache = None
+        # PlanLibrary of the plans of similar questions. Defaults to None (no reuse).
+        self.plan_library = None
+        # AdaptiveSampling of the planning and assessment branches. Defaults to None (all branches are requested at once).
+        self.sampling = None
+        # Speculator that converts the leading candidate while it is being assessed. Defaults to None (no speculation).
+        self.speculation = None
+        # budget in seconds for answering the question, degrading the pipeline as it runs out. Defaults to None (no budget).
+        self.deadline = None
+        # share of the budget kept for a direct answer when the graph does not finish in time
+        self.direct_answer_reserve = 0.2
+        # the shortcuts taken to answer within the deadline
+        self.shortcuts = []
+        # rerun a failed graph from the operation that failed, reusing the thoughts of the operations before it
+        self.resume = True
+        # the thoughts, successors and steps of each operation before it was executed, keyed by operation id
+        self.checkpoints: Dict[int, Dict[str, Any]] = {}
+        self.failed_operations: List[Operation] = []
+        self.last_operation = None
+        self.resumed_from = set()
 
     def initialize_execution_queue(self) -> None:
         """
@@ -96,6 +121,8 @@ class Controller:
 
         :return: The thought generated by the executed operation, or None if no operation is left to execute.
         """
+        # an abandoned run stops before its next operation
+        check_deadline("executing the next operation")
         if not self.execution_queue:
             self.initialize_execution_queue()
 
@@ -104,59 +131,222 @@ class Controller:
             return None
 
         current_operation = self.execution_queue.pop(0)
-        current_operation_backup = copy.copy(current_operation)
+        self.checkpoint(current_operation)
         
         tries = 0
         while tries < self.max_operation_tries:
             try:
+                current_operation.early_start = self.early_start
+                current_operation.plan_cache = self.plan_cache
+                current_operation.plan_library = self.plan_library
+                current_operation.sampling = self.sampling
+                current_operation.speculation = self.speculation
                 current_operation.execute(
                     self.lm, self.prompter, self.parser, self.got_steps, self.logger, self.coder, **self.problem_parameters
                 )
                 break
             except Exception as e:
+                if isinstance(e, TimeoutError):
+                    # out of time for the question, retrying would fail again
+                    check_deadline("retrying the operation")
                 self.logger.error("Error executing operation %s: %s", current_operation.operation_type, e)
-                current_operation = copy.copy(current_operation_backup)
+                self.restore(current_operation)
                 tries += 1
 
-        del current_operation_backup
-
         if tries == self.max_operation_tries:
             self.logger.error("Max tries reached on executing operation %s", current_operation.operation_type)
+            self.failed_operations.append(current_operation)
             return None
         
+        # an abandoned run must not overwrite the answer given in its place
+        check_deadline("recording the thought")
         for operation in current_operation.successors:
             if operation.can_be_executed():
                 self.execution_queue.append(operation)
         
         self.final_thought = current_operation.get_thoughts()[0]
+        self.last_operation = current_operation
         
         return self.final_thought
 
+    def checkpoint(self, operation: Operation) -> None:
+        """
+        Record the state of an operation before it is executed, so a failed execution can be undone.
+        """
+        self.checkpoints[operation.id] = {
+            "thoughts": [copy.copy(thought.state) for thought in operation.get_thoughts()],
+            "successors": list(operation.successors),
+            "got_steps": set(self.got_steps),
+        }
+
+    def restore(self, operation: Operation) -> None:
+        """
+        Undo the execution of an operation: its thoughts, the successors it added and the steps it created.
+        """
+        checkpoint = self.checkpoints[operation.id]
+        for successor in operation.successors:
+            if successor not in checkpoint["successors"] and operation in successor.predecessors:
+                successor.predecessors.remove(operation)
+        operation.successors = list(checkpoint["successors"])
+        operation.thoughts = [Thought(copy.copy(state)) for state in checkpoint["thoughts"]]
+        operation.executed = False
+        for step_id in set(self.got_steps) - checkpoint["got_steps"]:
+            self.got_steps.pop(step_id)
+
+    def resume_point(self) -> List[Operation]:
+        """
+        Get the operations a failed run resumes from: the ones that failed, or the last one executed if the run
+        ended without an output. A full rerun is needed if there is none, if the run reused the plan of another
+        question, or if the run already resumed from the same operations.
+
+        :return: The operations to execute again, or an empty list for a full rerun.
+        """
+        if self.final_thought is not None and (self.final_thought.state.get("plan_cache_hit") or "plan_library_question" in self.final_thought.state):
+            return []
+        operations = [operation for operation in self.failed_operations if operation.can_be_executed()]
+        if len(operations) == 0 and len(self.failed_operations) == 0 and self.last_operation is not None:
+            operations = [self.last_operation]
+        if len(operations) == 0 or any(operation.id in self.resumed_from for operation in operations):
+            return []
+        return operations
+
     def run(self) -> None:
         """
         Run the controller and execute the operations from the Graph of Operations based on their readiness.
         Ensures the program is in a valid state before execution.
+        With a deadline, the pipeline takes shortcuts as the budget runs out, and the question is answered
+        directly if the graph does not finish in time. The shortcuts taken are kept in shortcuts.
         """
         assert self.graph.roots is not None, "The operations graph has no root"
-        
+        if self.deadline is None:
+            self.run_graph()
+            return
+
+        self.shortcuts = []
+        with deadline_scope(self.deadline, name="question") as deadline:
+            degradation = Degradation(deadline)
+            with degradation_scope(degradation):
+                try:
+                    # the graph is abandoned once its share of the budget is spent
+                    with deadline_scope(self.deadline * (1 - self.direct_answer_reserve), name="reasoning"):
+                        run_with_deadline(self.run_graph)
+                except TimeoutError as e:
+                    self.logger.warning("Stopped reasoning: %s", e)
+                if not self.run_executed:
+                    # the thought of an unfinished run is not an answer
+                    self.final_thought = None
+                    degradation.take("direct_answer")
+                    self.answer_directly()
+        self.shortcuts = degradation.shortcuts
+        if len(self.shortcuts) > 0:
+            self.logger.warning("Shortcuts taken to answer within %.1fs: %s", self.deadline, [shortcut["shortcut"] for shortcut in self.shortcuts])
+
+    def run_graph(self) -> None:
+        """
+        Execute the Graph of Operations until it produces an output or max_run_tries is reached. A failed run
+        resumes from the operation that failed when possible, and reruns from the start otherwise.
+        """
+        attempts = 0
         while not self.run_executed and self.max_run_tries > 0:
+            check_deadline("running the graph again")
             self.max_run_tries -= 1
-            self.execution_queue = []
-            self.got_steps = {}
-            self.problem_parameters = copy.copy(self.original_problem_parameters)
-            self.initialize_execution_queue()
+            resume_from = self.resume_point() if self.resume and attempts > 0 else []
+            if len(resume_from) > 0:
+                self.resumed_from.update(operation.id for operation in resume_from)
+                for operation in resume_from:
+                    self.restore(operation)
+                thoughts = resume_from[0].get_thoughts() or resume_from[0].get_previous_thoughts()
+                self.logger.warning("Resuming the run from the %s phase", thoughts[0].state.get("phase") if thoughts else "first")
+                self.execution_queue = resume_from
+            else:
+                # detach what the previous run added to the roots, so it is not executed again
+                for operation in self.graph.roots:
+                    if operation.id in self.checkpoints:
+                        self.restore(operation)
+                self.execution_queue = []
+                self.got_steps = {}
+                self.checkpoints = {}
+                self.last_operation = None
+                self.problem_parameters = copy.copy(self.original_problem_parameters)
+                self.initialize_execution_queue()
+            self.failed_operations = []
+            attempts += 1
             
             while self.execution_queue:
                 self.execute_step()
 
-            if self.final_thought.state["phase"] == "output":
+            if self.final_thought is not None and self.final_thought.state["phase"] == "output":
                 self.logger.info("All operations executed")
                 self.run_executed = True
+            self.update_plan_cache()
+            if self.speculation is not None:
+                self.speculation.discard()
+            if not self.run_executed and self.max_run_tries > 0 and take_shortcut("no_rerun"):
+                self.logger.warning("Not enough time left to run the graph again")
+                break
 
         if self.max_run_tries == 0:
             self.logger.error("Max tries reached on executing controller")
 
 
+    def answer_directly(self) -> None:
+        """
+        Answer the question with a single prompt and no knowledge, within what is left of the deadline.
+        """
+        state = {**self.original_problem_parameters, "phase": "direct_answer", "input": ""}
+        try:
+            prompt = self.prompter.generate_prompt(**state)
+        except Exception as e:
+            self.logger.error("Could not build the direct answer prompt: %s", e)
+            return
+        if not prompt:
+            return
+        try:
+            text = run_with_deadline(lambda: self.lm.get_response_texts(self.lm.query(prompt, num_responses=1))[0])
+        except Exception as e:
+            self.logger.error("Could not answer the question directly: %s", e)
+            return
+        output = text
+        if state.get("answer_type") == "array":
+            try:
+                output = ast.literal_eval(text.replace("```python", "").replace("```", "").strip())
+            except (SyntaxError, ValueError):
+                pass
+        self.final_thought = Thought({**state, "phase": "output", "input": output, "prompt": prompt, "direct_answer": True})
+
+    def update_plan_cache(self) -> None:
+        """
+        Store the plan of the question in the plan cache and the plan library if every step of it executed,
+        and drop a reused plan that failed.
+        """
+        if (self.plan_cache is None and self.plan_library is None) or self.final_thought is None:
+            return
+        state = self.final_thought.state
+        if "question" not in state or not state.get("instructions"):
+            return
+        executed = self.run_executed and all(str(instruction["StepID"]) in self.coder.executed_code for instruction in state["instructions"])
+        reused = state.get("plan_cache_hit") or "plan_library_question" in state
+        if executed and not reused:
+            plan = {
+                "instructions": state["instructions"],
+                "edges": state.get("edges", []),
+                "full_code": state.get("full_code", ""),
+                "full_plan": state.get("full_plan", ""),
+            }
+            if self.plan_cache is not None and self.plan_cache.store(state["question"], plan):
+                self.logger.info("Cached the plan of the question template")
+            if self.plan_library is not None:
+                try:
+                    self.plan_library.store(state["question"], plan, state.get("assessment_scores"))
+                except Exception as e:
+                    self.logger.warning("Could not store the plan in the plan library: %s", e)
+        elif not executed and state.get("plan_cache_hit"):
+            self.logger.warning("The cached plan failed, planning the question from scratch")
+            self.plan_cache.discard(state["question"])
+        elif not executed and "plan_library_question" in state:
+            self.logger.warning("The plan of a similar question failed, planning the question from scratch")
+            self.plan_library.discard(state["plan_library_question"])
+
     def get_final_thoughts(self) -> List[List[Thought]]:
         """
         Retrieve the final thoughts after all operations have been executed.
@@ -166,6 +356,26 @@ class Controller:
         assert self.run_executed, "The run method has not been executed"
         return [operation.get_thoughts() for operation in self.graph.leaves]
 
+    def get_step_metrics(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Retrieve the resource usage recorded for every executed step of generated code.
+
+        :return: The metrics of each step keyed by step id: wall and CPU time, peak memory, knowledge_extract calls and latency, and output size.
+        """
+        if self.coder is None:
+            return {}
+        return dict(getattr(self.coder, "step_metrics", {}))
+
+    def get_sampling_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Retrieve the number of completions requested and used per phase with adaptive sampling.
+
+        :return: For each phase the prompts, the requested and used completions, the LM calls, early stops and skipped assessments.
+        """
+        if self.sampling is None:
+            return {}
+        return {phase: dict(stats) for phase, stats in self.sampling.stats.items()}
+
     def serialize_operation(self, operation) -> Dict[str, Any]:
         """
         Serialize an operation to a dictionary.
@@ -192,6 +402,9 @@ class Controller:
                 "prompt_tokens": self.lm.prompt_tokens,
                 "completion_tokens": self.lm.completion_tokens,
                 "cost": self.lm.cost,
+                "step_metrics": self.get_step_metrics(),
+                "sampling_stats": self.get_sampling_stats(),
+                "shortcuts": self.shortcuts,
             }
         )
 
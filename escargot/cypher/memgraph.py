@@ -4,6 +4,10 @@ import os
 from typing import Dict
 import json
 import logging
+import queue
+from escargot.deadline import run_with_deadline, take_shortcut
+from escargot.language_models.voting import MajorityVote
+from escargot.cypher.utils import clean_cypher
 
 class MemgraphClient:
     def __init__(self, config_path, logger):
@@ -20,6 +24,9 @@ class MemgraphClient:
             self.host = self.config["host"]
             self.port = self.config["port"]
             self.client = Memgraph(host=self.host, port=self.port)
+            # idle clients, one connection each, so concurrent questions never share a connection
+            self.clients = queue.Queue()
+            self.clients.put(self.client)
             self.num_responses = 7
             self.cache = {}
             self.schema = None
@@ -33,7 +40,7 @@ class MemgraphClient:
         tries = 3
         while tries > 0:
             try:
-                db_structured_schema = list(self.client.execute_and_fetch(SCHEMA_QUERY))
+                db_structured_schema = self.fetch(SCHEMA_QUERY)
                 assert db_structured_schema is not None
                 structured_schema = db_structured_schema[0]['schema']
                 break
@@ -89,54 +96,40 @@ class MemgraphClient:
         """
         self.cache = {}
 
+    def fetch(self, query):
+        # the call takes a connection of its own: a call abandoned at its deadline keeps it until the database
+        # answers, while the other calls open or reuse other connections instead of waiting on a lock
+        try:
+            client = self.clients.get_nowait()
+        except queue.Empty:
+            client = Memgraph(host=self.host, port=self.port)
+        results = list(client.execute_and_fetch(query))
+        # a connection that failed is dropped
+        self.clients.put(client)
+        return results
+
     def execute(self, lm, query, statement):
         # if statement in self.cache:
         #     results = self.cache[statement][1]
         # else:
-            num_responses = self.num_responses
             response = ''
-            responses_hash = set()
             client_results = []
-            iter = 0
-            responses = lm.get_response_texts(
-                lm.query(query, num_responses=num_responses)
-            )
-            empty_responses = True
-            while iter < num_responses and empty_responses:
+            # the first candidate query is tried alone, and the rest of the samples are only requested if it returns nothing
+            num_responses = self.num_responses
+            if num_responses > 3 and take_shortcut("fewer_candidates", "cypher"):
+                num_responses = 3
+            vote = MajorityVote(lm, query, num_responses, key=lambda candidate: " ".join(clean_cypher(candidate).split()), logger=self.logger)
+            for candidate in vote.candidates():
                 try:
-                    response = responses[iter]
-                    iter += 1
-                    # Check if the response is in the hash set
-                    if response in responses_hash:
-                        continue
-                    responses_hash.add(response)
-                    # Remove "Answer:" from the response
-                    if response.startswith("Answer:"):
-                        response= response[8:].strip()
-                    
-                    if response == "" or response == None:
-                        continue
-                    #remove ```cypher from the response
-                    response = response.replace("```cypher", "")
-
-                    #remove ``` from anywhere in the response
-                    response = response.replace("```", "")
-
-                    #remove \n from the response
-                    response = response.replace("\n", " ")
-
-                    #TODO: tweak if necessary. Get rid of directionality in the response
-                    response = response.replace("<-", "-")
-                    response = response.replace("->", "-")
-                    
+                    response = clean_cypher(candidate)
                     self.logger.info(f"Executing client for statement: {statement}, response: {response}")
-                    client_results = self.client.execute_and_fetch(response)
-                    client_results = list(client_results)
+                    client_results = run_with_deadline(lambda: self.fetch(response))
                     if client_results != []:
-                        empty_responses = False
-                        
+                        break
+                except TimeoutError:
+                    raise
                 except Exception as e:
-                    self.logger.error(f"Error in client_results: {e}, trying again {iter}")
+                    self.logger.error(f"Error in client_results: {e}, trying again {len(vote.responses)}")
             self.logger.info(f"Graph Client results: {client_results}")
             # results = []
             # # get the value in the dictionary x in memgraph_results
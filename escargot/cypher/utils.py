@@ -0,0 +1,21 @@
+def clean_cypher(response: str) -> str:
+    """
+    Extract the Cypher query of a language model response.
+
+    :param response: The response.
+    :type response: str
+    :return: The query on one line, or an empty string if the response has none.
+    :rtype: str
+    """
+    if response is None:
+        return ""
+    # Remove "Answer:" from the response
+    if response.startswith("Answer:"):
+        response = response[8:].strip()
+    #remove ```cypher and ``` from anywhere in the response
+    response = response.replace("```cypher", "").replace("```", "")
+    #remove \n from the response
+    response = response.replace("\n", " ")
+    #TODO: tweak if necessary. Get rid of directionality in the response
+    response = response.replace("<-", "-").replace("->", "-")
+    return response
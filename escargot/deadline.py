@@ -0,0 +1,283 @@
+from __future__ import annotations
+import concurrent.futures
+import contextvars
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+# the deadline of the step (or question) being executed, visible to every call made on its behalf
+current_deadline: contextvars.ContextVar[Optional["Deadline"]] = contextvars.ContextVar("escargot_deadline", default=None)
+# the degradation policy of the question being answered
+current_degradation: contextvars.ContextVar[Optional["Degradation"]] = contextvars.ContextVar("escargot_degradation", default=None)
+# share of the question's budget left below which each shortcut is taken
+SHORTCUT_THRESHOLDS = {
+    "fewer_branches": 0.6,
+    "fewer_candidates": 0.5,
+    "no_rerun": 0.5,
+    "skip_assessment": 0.4,
+    "skip_repair": 0.3,
+}
+
+
+class Deadline:
+    """
+    Deadline is a point in time by which a unit of work (a step, a question) has to finish.
+    Nested deadlines never extend the deadline they are nested in, and expire when it is cancelled.
+    """
+
+    def __init__(self, seconds: float, parent: Deadline = None, name: str = "") -> None:
+        """
+        Initialize the Deadline.
+
+        :param seconds: The budget in seconds, starting now.
+        :type seconds: float
+        :param parent: The enclosing deadline. Defaults to None.
+        :type parent: Deadline
+        :param name: What the deadline bounds, used in error messages. Defaults to "".
+        :type name: str
+        """
+        self.seconds = seconds
+        self.name = name
+        self.parent = parent
+        self.cancelled = False
+        self.expires_at = time.monotonic() + seconds
+        if parent is not None and parent.expires_at < self.expires_at:
+            self.expires_at = parent.expires_at
+            self.seconds = parent.seconds
+            self.name = parent.name
+
+    def cancel(self) -> None:
+        """
+        Expire the deadline now, so the work it bounds stops at its next check.
+        """
+        self.cancelled = True
+
+    def is_cancelled(self) -> bool:
+        return self.cancelled or (self.parent is not None and self.parent.is_cancelled())
+
+    def remaining(self) -> float:
+        if self.is_cancelled():
+            return 0.0
+        return max(self.expires_at - time.monotonic(), 0.0)
+
+    def expired(self) -> bool:
+        return self.is_cancelled() or time.monotonic() >= self.expires_at
+
+    def check(self, action: str = "") -> None:
+        """
+        Raise a TimeoutError if the deadline has passed.
+
+        :param action: What was about to be done, used in the error message. Defaults to "".
+        :type action: str
+        """
+        if self.is_cancelled():
+            raise TimeoutError(f"{self.name or 'The step'} was cancelled" + (f" before {action}" if action else ""))
+        if self.expired():
+            raise TimeoutError(f"Deadline of {self.seconds:.1f}s for {self.name or 'the step'} exceeded" + (f" before {action}" if action else ""))
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float], name: str = "") -> Iterator[Optional[Deadline]]:
+    """
+    Run the enclosed block under a deadline. With seconds set to None the enclosing deadline, if any, applies.
+
+    :param seconds: The budget in seconds. Defaults to None.
+    :type seconds: Optional[float]
+    :param name: What the deadline bounds. Defaults to "".
+    :type name: str
+    """
+    if seconds is None:
+        yield current_deadline.get()
+        return
+    with enter_deadline(Deadline(seconds, parent=current_deadline.get(), name=name)) as deadline:
+        yield deadline
+
+
+@contextmanager
+def enter_deadline(deadline: Deadline) -> Iterator[Deadline]:
+    """
+    Run the enclosed block under a deadline created beforehand, e.g. one that another thread may cancel.
+    """
+    token = current_deadline.set(deadline)
+    try:
+        yield deadline
+    finally:
+        current_deadline.reset(token)
+
+
+def get_deadline() -> Optional[Deadline]:
+    return current_deadline.get()
+
+
+def remaining_time(default: Any = None) -> Any:
+    """
+    Get the seconds left before the current deadline, or the default when no deadline is set.
+    Raises a TimeoutError if the deadline has already passed, so no new request is started.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return default
+    deadline.check()
+    return deadline.remaining()
+
+
+def check_deadline(action: str = "") -> None:
+    deadline = current_deadline.get()
+    if deadline is not None:
+        deadline.check(action)
+
+
+def deadline_expired(_: Any = None) -> bool:
+    """
+    Whether the current deadline has passed. The ignored argument lets it serve as a backoff giveup predicate.
+    """
+    deadline = current_deadline.get()
+    return deadline is not None and deadline.expired()
+
+
+@contextmanager
+def client_timeouts(*exceptions: type) -> Iterator[None]:
+    """
+    Raise the timeouts of a client library as TimeoutError while a deadline is set, so retry loops treat
+    a request cut off by the deadline as the end of the budget instead of a transient error.
+
+    :param exceptions: The timeout exceptions of the client, e.g. openai.APITimeoutError.
+    :type exceptions: type
+    """
+    try:
+        yield
+    except exceptions as e:
+        deadline = current_deadline.get()
+        if deadline is None:
+            raise
+        raise TimeoutError(f"Deadline of {deadline.seconds:.1f}s for {deadline.name or 'the step'} exceeded: {e}") from e
+
+
+def run_with_deadline(function: Callable, *args, **kwargs) -> Any:
+    """
+    Call a function and stop waiting for it when the current deadline passes.
+    The call runs in a daemon thread with the caller's context, under a child of the current deadline.
+    A call that is abandoned has its deadline cancelled, so it stops at its next check; its result is discarded.
+
+    :param function: The function to call.
+    :type function: Callable
+    :return: The return value of the function.
+    :raise TimeoutError: If the deadline passes before the function returns.
+    """
+    deadline = current_deadline.get()
+    if deadline is None:
+        return function(*args, **kwargs)
+    deadline.check(f"calling {getattr(function, '__name__', 'function')}")
+    outcome = {}
+    context = contextvars.copy_context()
+    call_deadline = Deadline(float("inf"), parent=deadline)
+
+    def call():
+        with enter_deadline(call_deadline):
+            return function(*args, **kwargs)
+
+    def target():
+        try:
+            outcome["result"] = context.run(call)
+        except BaseException as e:
+            outcome["error"] = e
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(deadline.remaining())
+    if thread.is_alive():
+        call_deadline.cancel()
+        raise TimeoutError(f"Deadline of {deadline.seconds:.1f}s for {deadline.name or 'the step'} exceeded while waiting for {getattr(function, '__name__', 'function')}")
+    if "error" in outcome:
+        raise outcome["error"]
+    return outcome["result"]
+
+
+def wait_for(future: concurrent.futures.Future, action: str = "the result") -> Any:
+    """
+    Wait for a future until the current deadline passes.
+    Before Python 3.11 concurrent.futures.TimeoutError is not the builtin TimeoutError, so it is raised as one.
+
+    :param future: The future to wait for.
+    :type future: concurrent.futures.Future
+    :param action: What is waited for, used in the error message. Defaults to "the result".
+    :type action: str
+    :return: The result of the future.
+    :raise TimeoutError: If the deadline passes before the future is done.
+    """
+    try:
+        return future.result(timeout=remaining_time())
+    except concurrent.futures.TimeoutError as e:
+        if future.done():
+            # the future itself failed with a timeout
+            raise
+        deadline = current_deadline.get()
+        raise TimeoutError(f"Deadline of {deadline.seconds:.1f}s for {deadline.name or 'the step'} exceeded while waiting for {action}") from e
+
+
+class Degradation:
+    """
+    Degradation decides which shortcuts a question takes as its deadline approaches: fewer branches and
+    candidates, no assessment, no code repair, no rerun of the graph, and finally a direct answer.
+    The shortcuts taken are recorded, so they can be reported with the answer.
+    """
+
+    def __init__(self, deadline: Deadline, thresholds: Dict[str, float] = None) -> None:
+        """
+        Initialize the Degradation.
+
+        :param deadline: The deadline of the question.
+        :type deadline: Deadline
+        :param thresholds: Share of the budget left below which each shortcut is taken. Defaults to None (SHORTCUT_THRESHOLDS).
+        :type thresholds: Dict[str, float]
+        """
+        self.deadline = deadline
+        self.thresholds = {**SHORTCUT_THRESHOLDS, **(thresholds or {})}
+        self.shortcuts: List[Dict[str, Any]] = []
+        self.lock = threading.Lock()
+
+    def time_left(self) -> float:
+        return self.deadline.remaining() / self.deadline.seconds if self.deadline.seconds > 0 else 0.0
+
+    def due(self, shortcut: str) -> bool:
+        return self.time_left() < self.thresholds.get(shortcut, 0.0)
+
+    def take(self, shortcut: str, detail: str = "") -> None:
+        """
+        Record a shortcut taken.
+
+        :param shortcut: The name of the shortcut.
+        :type shortcut: str
+        :param detail: Where it was taken, e.g. the phase. Defaults to "".
+        :type detail: str
+        """
+        with self.lock:
+            self.shortcuts.append({"shortcut": shortcut, "detail": detail, "time_left": round(self.deadline.remaining(), 3)})
+
+
+@contextmanager
+def degradation_scope(degradation: Optional[Degradation]) -> Iterator[Optional[Degradation]]:
+    token = current_degradation.set(degradation)
+    try:
+        yield degradation
+    finally:
+        current_degradation.reset(token)
+
+
+def take_shortcut(shortcut: str, detail: str = "") -> bool:
+    """
+    Take a shortcut if the current question is short on time, and record it.
+
+    :param shortcut: The name of the shortcut, one of SHORTCUT_THRESHOLDS.
+    :type shortcut: str
+    :param detail: Where it is taken, e.g. the phase. Defaults to "".
+    :type detail: str
+    :return: Whether the shortcut has to be taken.
+    :rtype: bool
+    """
+    degradation = current_degradation.get()
+    if degradation is None or not degradation.due(shortcut):
+        return False
+    degradation.take(shortcut, detail)
+    return True
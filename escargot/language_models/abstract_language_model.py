@@ -69,7 +69,7 @@ class AbstractLanguageModel(ABC):
         self.response_cache.clear()
 
     @abstractmethod
-    def query(self, query: str, num_responses: int = 1) -> Any:
+    def query(self, query: str, num_responses: int = 1, use_cache: bool = True) -> Any:
         """
         Abstract method to query the language model.
 
@@ -77,6 +77,8 @@ class AbstractLanguageModel(ABC):
         :type query: str
         :param num_responses: The number of desired responses.
         :type num_responses: int
+        :param use_cache: Whether a cached response may be returned, False for further samples of a query. Defaults to True.
+        :type use_cache: bool
         :return: The language model's response(s).
         :rtype: Any
         """
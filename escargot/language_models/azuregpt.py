@@ -2,13 +2,15 @@ import backoff
 import os
 import random
 import time
-from typing import List, Dict, Union
+from typing import Iterator, List, Dict, Union
 import openai
-from openai import AzureOpenAI, OpenAIError
-from openai.types.chat.chat_completion import ChatCompletion
+from openai import APITimeoutError, AzureOpenAI, OpenAIError, NOT_GIVEN
+from openai.types.chat.chat_completion import ChatCompletion, Choice
+from openai.types.chat.chat_completion_message import ChatCompletionMessage
 import logging
 
 from .abstract_language_model import AbstractLanguageModel
+from escargot.deadline import client_timeouts, deadline_expired, get_deadline, remaining_time
 
 
 class AzureGPT(AbstractLanguageModel):
@@ -59,8 +61,12 @@ class AzureGPT(AbstractLanguageModel):
         # Initialize the OpenAI Client
         self.client = AzureOpenAI(api_key=self.api_key,azure_endpoint=self.api_base,api_version=self.api_version)
 
+    def api(self):
+        # under a deadline the client does not retry timed out requests on its own, the deadline decides
+        return self.client.with_options(max_retries=0) if get_deadline() is not None else self.client
+
     def query(
-        self, query: str, num_responses: int = 1
+        self, query: str, num_responses: int = 1, use_cache: bool = True
     ) -> Union[List[ChatCompletion], ChatCompletion]:
         """
         Query the OpenAI model for responses.
@@ -69,20 +75,71 @@ class AzureGPT(AbstractLanguageModel):
         :type query: str
         :param num_responses: Number of desired responses, default is 1.
         :type num_responses: int
+        :param use_cache: Whether the cache is used. Further samples of a cached query pass False, default is True.
+        :type use_cache: bool
         :return: Response(s) from the OpenAI model.
         :rtype: Dict
         """
-        if self.cache and query in self.response_cache:
+        if self.cache and use_cache and query in self.response_cache:
             return self.response_cache[query]
 
         response = []
         response = self.chat([{"role": "system", "content": query}], num_responses)
         
-        if self.cache:
+        if self.cache and use_cache:
             self.response_cache[query] = response
         return response
 
-    @backoff.on_exception(backoff.expo, OpenAIError, max_time=10, max_tries=6)
+    def stream_query(self, query: str) -> Iterator[str]:
+        """
+        Query the OpenAI model for a single response and yield its text as it is generated.
+        A response streamed to the end is cached like the response of query.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :return: The chunks of the response text.
+        :rtype: Iterator[str]
+        """
+        if self.cache and query in self.response_cache:
+            yield from self.get_response_texts(self.response_cache[query])
+            return
+        with client_timeouts(APITimeoutError):
+            stream = self.api().chat.completions.create(
+                model=self.model_id,
+                messages=[{"role": "system", "content": query}],
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                n=1,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=remaining_time(NOT_GIVEN),
+            )
+        chunks = []
+        finish_reason = "stop"
+        for chunk in stream:
+            # the usage arrives in a last chunk without choices
+            if chunk.usage is not None:
+                self.prompt_tokens += chunk.usage.prompt_tokens
+                self.completion_tokens += chunk.usage.completion_tokens
+                self.cost = (
+                    self.prompt_token_cost * float(self.prompt_tokens) / 1000.0
+                    + self.response_token_cost * float(self.completion_tokens) / 1000.0
+                )
+            if len(chunk.choices) > 0:
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                if chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        if self.cache:
+            self.response_cache[query] = ChatCompletion(
+                id="stream",
+                object="chat.completion",
+                created=int(time.time()),
+                model=self.model_id,
+                choices=[Choice(index=0, finish_reason=finish_reason, message=ChatCompletionMessage(role="assistant", content="".join(chunks)))],
+            )
+
+    @backoff.on_exception(backoff.expo, OpenAIError, max_time=10, max_tries=6, giveup=deadline_expired)
     def chat(self, messages: List[Dict], num_responses: int = 1) -> ChatCompletion:
         """
         Send chat messages to the OpenAI model and retrieves the model's response.
@@ -97,14 +154,16 @@ class AzureGPT(AbstractLanguageModel):
         """
 
         #TODO: Optimize temperature, max_tokens, and stop
-        response = self.client.chat.completions.create(
-            model=self.model_id,
-            messages=messages,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            n=num_responses,
-            # stop=self.stop,
-        )
+        with client_timeouts(APITimeoutError):
+            response = self.api().chat.completions.create(
+                model=self.model_id,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                n=num_responses,
+                # stop=self.stop,
+                timeout=remaining_time(NOT_GIVEN),
+            )
 
         self.prompt_tokens += response.usage.prompt_tokens
         self.completion_tokens += response.usage.completion_tokens
@@ -137,9 +196,32 @@ class AzureGPT(AbstractLanguageModel):
     
     def get_embedding(self, text_to_embed):
 
-        response = self.client.embeddings.create(
-            model=self.embedding_id,
-            input=text_to_embed
-        )
+        with client_timeouts(APITimeoutError):
+            response = self.api().embeddings.create(
+                model=self.embedding_id,
+                input=text_to_embed,
+                timeout=remaining_time(NOT_GIVEN),
+            )
 
         return response.data[0].embedding
+
+    def get_embeddings(self, texts_to_embed: List[str]) -> List[List[float]]:
+        """
+        Embed several texts with a single request to the embedding model.
+
+        :param texts_to_embed: The texts to be embedded.
+        :type texts_to_embed: List[str]
+        :return: The embeddings, in the same order as the texts.
+        :rtype: List[List[float]]
+        """
+        if len(texts_to_embed) == 0:
+            return []
+        with client_timeouts(APITimeoutError):
+            response = self.api().embeddings.create(
+                model=self.embedding_id,
+                input=texts_to_embed,
+                timeout=remaining_time(NOT_GIVEN),
+            )
+        # the API does not guarantee ordering, so sort by the returned index
+        data = sorted(response.data, key=lambda item: item.index)
+        return [item.embedding for item in data]
@@ -0,0 +1,124 @@
+from __future__ import annotations
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, List, Tuple
+
+from escargot.deadline import wait_for
+
+
+class BatchingLanguageModel:
+    """
+    BatchingLanguageModel wraps a language model shared by many questions answered at once. Queries are sent
+    concurrently by a pool of max_batch threads, which bounds the requests in flight. A model with a query_batch
+    method instead gets the queries that arrive within a short window, typically the same phase of different
+    questions, in one call; the OpenAI models have none, so their queries are not delayed. Every other attribute
+    is the wrapped model's, so the wrapper can be handed to a Controller in its place.
+    """
+
+    def __init__(self, lm, max_batch: int = 16, window: float = 0.02, logger: logging.Logger = None) -> None:
+        """
+        Initialize the BatchingLanguageModel.
+
+        :param lm: The language model.
+        :type lm: AbstractLanguageModel
+        :param max_batch: Maximum number of requests in flight, and of queries in one query_batch call. Defaults to 16.
+        :type max_batch: int
+        :param window: Seconds a query waits for others to join its batch, for a model with query_batch. Defaults to 0.02.
+        :type window: float
+        """
+        self.lm = lm
+        self.max_batch = max_batch
+        self.window = window
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.executor = ThreadPoolExecutor(max_workers=max_batch)
+        self.pending: List[Tuple[str, int, bool, contextvars.Context, Future]] = []
+        self.condition = threading.Condition()
+        self.closed = False
+        self.batches = 0
+        self.queries = 0
+        self.largest_batch = 0
+        self.dispatcher = threading.Thread(target=self.dispatch, daemon=True)
+        self.dispatcher.start()
+
+    def __getattr__(self, name: str) -> Any:
+        return getattr(self.lm, name)
+
+    def query(self, query: str, num_responses: int = 1, use_cache: bool = True) -> Any:
+        """
+        Queue a query for the next batch and wait for its response.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :param num_responses: Number of desired responses. Defaults to 1.
+        :type num_responses: int
+        :param use_cache: Whether the model may answer from its cache. Defaults to True.
+        :type use_cache: bool
+        :return: The response of the language model.
+        :rtype: Any
+        """
+        if not use_cache and hasattr(self.lm, "query_batch"):
+            # query_batch has no way to bypass the cache
+            return self.lm.query(query, num_responses, use_cache=False)
+        future = Future()
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("BatchingLanguageModel is closed")
+            self.pending.append((query, num_responses, use_cache, contextvars.copy_context(), future))
+            self.condition.notify()
+        return wait_for(future, "the language model")
+
+    def dispatch(self) -> None:
+        while True:
+            with self.condition:
+                while len(self.pending) == 0 and not self.closed:
+                    self.condition.wait()
+                if len(self.pending) == 0:
+                    return
+            if hasattr(self.lm, "query_batch"):
+                # let the queries of the other questions join the batch
+                time.sleep(self.window)
+            with self.condition:
+                batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.batches += 1
+            self.queries += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+            self.logger.debug(f"Dispatching a batch of {len(batch)} queries")
+            if hasattr(self.lm, "query_batch"):
+                self.run_batch(batch)
+            else:
+                futures = [
+                    self.executor.submit(context.run, self.lm.query, query, num_responses, **({} if use_cache else {"use_cache": False}))
+                    for query, num_responses, use_cache, context, _ in batch
+                ]
+                for request_future, (_, _, _, _, future) in zip(futures, batch):
+                    request_future.add_done_callback(lambda done, future=future: self.resolve(future, done))
+
+    def run_batch(self, batch: List[Tuple[str, int, bool, contextvars.Context, Future]]) -> None:
+        try:
+            responses = self.lm.query_batch([(query, num_responses) for query, num_responses, _, _, _ in batch])
+        except Exception as e:
+            for _, _, _, _, future in batch:
+                future.set_exception(e)
+            return
+        for (_, _, _, _, future), response in zip(batch, responses):
+            future.set_result(response)
+
+    @staticmethod
+    def resolve(future: Future, done: Future) -> None:
+        if done.exception() is not None:
+            future.set_exception(done.exception())
+        else:
+            future.set_result(done.result())
+
+    def close(self) -> None:
+        """
+        Stop accepting queries once the queued ones have been dispatched.
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify()
+        self.dispatcher.join()
+        self.executor.shutdown(wait=False)
@@ -10,12 +10,14 @@ import backoff
 import os
 import random
 import time
-from typing import List, Dict, Union
-from openai import OpenAI, OpenAIError
-from openai.types.chat.chat_completion import ChatCompletion
+from typing import Iterator, List, Dict, Union
+from openai import APITimeoutError, OpenAI, OpenAIError, NOT_GIVEN
+from openai.types.chat.chat_completion import ChatCompletion, Choice
+from openai.types.chat.chat_completion_message import ChatCompletionMessage
 import logging
 
 from .abstract_language_model import AbstractLanguageModel
+from escargot.deadline import client_timeouts, deadline_expired, get_deadline, remaining_time
 
 
 class ChatGPT:
@@ -62,8 +64,12 @@ class ChatGPT:
         self.completion_tokens = 0
         self.cost = 0
 
+    def api(self):
+        # under a deadline the client does not retry timed out requests on its own, the deadline decides
+        return self.client.with_options(max_retries=0) if get_deadline() is not None else self.client
+
     def query(
-        self, query: str, num_responses: int = 1
+        self, query: str, num_responses: int = 1, use_cache: bool = True
     ) -> Union[List[ChatCompletion], ChatCompletion]:
         """
         Query the OpenAI model for responses.
@@ -72,10 +78,12 @@ class ChatGPT:
         :type query: str
         :param num_responses: Number of desired responses, default is 1.
         :type num_responses: int
+        :param use_cache: Whether the cache is used. Further samples of a cached query pass False, default is True.
+        :type use_cache: bool
         :return: Response(s) from the OpenAI model.
         :rtype: Dict
         """
-        if self.cache and query in self.respone_cache:
+        if self.cache and use_cache and query in self.respone_cache:
             return self.respone_cache[query]
 
         if num_responses == 1:
@@ -91,6 +99,8 @@ class ChatGPT:
                     response.append(res)
                     num_responses -= next_try
                     next_try = min(num_responses, next_try)
+                except TimeoutError:
+                    raise
                 except Exception as e:
                     next_try = (next_try + 1) // 2
                     self.logger.warning(
@@ -99,11 +109,11 @@ class ChatGPT:
                     time.sleep(random.randint(1, 3))
                     total_num_attempts -= 1
 
-        if self.cache:
+        if self.cache and use_cache:
             self.respone_cache[query] = response
         return response
 
-    @backoff.on_exception(backoff.expo, OpenAIError, max_tries=3)
+    @backoff.on_exception(backoff.expo, OpenAIError, max_tries=3, giveup=deadline_expired)
     def ask(self, query):
         """
         Ask a question to the ChatGPT model.
@@ -115,19 +125,71 @@ class ChatGPT:
             The model's response
         """
         try:
-            response = self.client.chat.completions.create(
+            with client_timeouts(APITimeoutError):
+                response = self.api().chat.completions.create(
+                    model=self.model_id,
+                    messages=[{"role": "user", "content": query}],
+                    temperature=self.temperature,
+                    max_tokens=self.max_tokens,
+                    stop=self.stop,
+                    timeout=remaining_time(NOT_GIVEN),
+                )
+            return response.choices[0].message.content
+        except OpenAIError as e:
+            self.logger.error(f"Error calling OpenAI API: {e}")
+            raise
+
+    def stream_query(self, query: str) -> Iterator[str]:
+        """
+        Query the OpenAI model for a single response and yield its text as it is generated.
+        A response streamed to the end is cached like the response of query.
+
+        :param query: The query to be posed to the language model.
+        :type query: str
+        :return: The chunks of the response text.
+        :rtype: Iterator[str]
+        """
+        if self.cache and query in self.respone_cache:
+            yield from self.get_response_texts(self.respone_cache[query])
+            return
+        with client_timeouts(APITimeoutError):
+            stream = self.api().chat.completions.create(
                 model=self.model_id,
                 messages=[{"role": "user", "content": query}],
                 temperature=self.temperature,
                 max_tokens=self.max_tokens,
-                stop=self.stop
+                n=1,
+                stop=self.stop,
+                stream=True,
+                stream_options={"include_usage": True},
+                timeout=remaining_time(NOT_GIVEN),
+            )
+        chunks = []
+        finish_reason = "stop"
+        for chunk in stream:
+            # the usage arrives in a last chunk without choices
+            if chunk.usage is not None:
+                self.prompt_tokens += chunk.usage.prompt_tokens
+                self.completion_tokens += chunk.usage.completion_tokens
+                self.cost = (
+                    self.prompt_token_cost * float(self.prompt_tokens) / 1000.0
+                    + self.response_token_cost * float(self.completion_tokens) / 1000.0
+                )
+            if len(chunk.choices) > 0:
+                finish_reason = chunk.choices[0].finish_reason or finish_reason
+                if chunk.choices[0].delta.content:
+                    chunks.append(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+        if self.cache:
+            self.respone_cache[query] = ChatCompletion(
+                id="stream",
+                object="chat.completion",
+                created=int(time.time()),
+                model=self.model_id,
+                choices=[Choice(index=0, finish_reason=finish_reason, message=ChatCompletionMessage(role="assistant", content="".join(chunks)))],
             )
-            return response.choices[0].message.content
-        except OpenAIError as e:
-            self.logger.error(f"Error calling OpenAI API: {e}")
-            raise
 
-    @backoff.on_exception(backoff.expo, OpenAIError, max_time=10, max_tries=6)
+    @backoff.on_exception(backoff.expo, OpenAIError, max_time=10, max_tries=6, giveup=deadline_expired)
     def chat(self, messages: List[Dict], num_responses: int = 1) -> ChatCompletion:
         """
         Send chat messages to the OpenAI model and retrieves the model's response.
@@ -140,14 +202,16 @@ class ChatGPT:
         :return: The OpenAI model's response.
         :rtype: ChatCompletion
         """
-        response = self.client.chat.completions.create(
-            model=self.model_id,
-            messages=messages,
-            temperature=self.temperature,
-            max_tokens=self.max_tokens,
-            n=num_responses,
-            stop=self.stop,
-        )
+        with client_timeouts(APITimeoutError):
+            response = self.api().chat.completions.create(
+                model=self.model_id,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                n=num_responses,
+                stop=self.stop,
+                timeout=remaining_time(NOT_GIVEN),
+            )
 
         self.prompt_tokens += response.usage.prompt_tokens
         self.completion_tokens += response.usage.completion_tokens
@@ -0,0 +1,144 @@
+from __future__ import annotations
+import logging
+from collections import Counter
+from typing import Callable, Iterator, List, Optional
+
+
+def votes_needed(counts: Counter, remaining: int) -> int:
+    """
+    Get the number of further samples that could decide a vote, if they all went to the leading answer.
+    The vote is decided once the leader has more votes than the runner-up could reach with every remaining sample.
+
+    :param counts: The votes of each answer.
+    :type counts: Counter
+    :param remaining: The number of samples left in the budget.
+    :type remaining: int
+    :return: The number of samples to request next, 0 if the vote is decided or the budget is spent.
+    :rtype: int
+    """
+    if remaining <= 0:
+        return 0
+    ranked = counts.most_common(2) + [(None, 0), (None, 0)]
+    leader, runner_up = ranked[0][1], ranked[1][1]
+    if leader > runner_up + remaining:
+        return 0
+    return min(remaining, (runner_up + remaining - leader) // 2 + 1)
+
+
+class MajorityVote:
+    """
+    MajorityVote samples the responses of a prompt in small batches instead of all at once, and stops as soon
+    as one answer has a majority the remaining samples cannot overturn. With num_responses=3, two agreeing
+    samples decide the vote and the third is never requested.
+    """
+
+    def __init__(self, lm, query: str, num_responses: int, key: Callable[[str], str] = None, logger: logging.Logger = None) -> None:
+        """
+        Initialize the MajorityVote.
+
+        :param lm: The language model.
+        :type lm: AbstractLanguageModel
+        :param query: The prompt.
+        :type query: str
+        :param num_responses: The maximum number of samples.
+        :type num_responses: int
+        :param key: Normalizes a response to the answer it votes for; responses with an empty key do not vote. Defaults to None (the stripped response).
+        :type key: Callable[[str], str]
+        """
+        self.lm = lm
+        self.query = query
+        self.num_responses = num_responses
+        self.key = key if key is not None else str.strip
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.responses: List[str] = []
+        self.counts = Counter()
+        self.first: dict = {}
+        self.raw_responses = []
+        self.calls = 0
+
+    @property
+    def remaining(self) -> int:
+        return self.num_responses - len(self.responses)
+
+    def sample(self, count: int) -> int:
+        """
+        Request count more responses and count their votes.
+
+        :return: The number of new responses.
+        :rtype: int
+        """
+        if self.calls == 0:
+            raw_response = self.lm.query(self.query, num_responses=count)
+        else:
+            raw_response = self.lm.query(self.query, num_responses=count, use_cache=False)
+        self.calls += 1
+        # a model that ignores use_cache returns the same response again, which is not a new sample
+        if any(raw_response is previous for previous in self.raw_responses):
+            self.num_responses = len(self.responses)
+            return 0
+        self.raw_responses.append(raw_response)
+        texts = self.lm.get_response_texts(raw_response)[:self.remaining]
+        for text in texts:
+            self.responses.append(text)
+            answer = self.key(text)
+            if answer == "" or answer is None:
+                continue
+            self.counts[answer] += 1
+            self.first.setdefault(answer, text)
+        if len(texts) == 0:
+            self.num_responses = len(self.responses)
+        return len(texts)
+
+    def decide(self) -> Optional[str]:
+        """
+        Sample until the vote is decided or the budget is spent.
+
+        :return: The first response voting for the winning answer, ties going to the earliest answer, or None if no response voted.
+        :rtype: Optional[str]
+        """
+        count = votes_needed(self.counts, self.remaining)
+        while count > 0 and self.sample(count) > 0:
+            count = votes_needed(self.counts, self.remaining)
+        if self.remaining > 0:
+            self.logger.info(f"Vote decided after {len(self.responses)} of {self.num_responses} samples")
+        ranked = self.ranked()
+        return ranked[0] if len(ranked) > 0 else None
+
+    def ranked(self) -> List[str]:
+        """
+        Get one response per answer, the answers with the most votes first and ties in order of appearance.
+        """
+        return [self.first[answer] for answer in sorted(self.first, key=lambda answer: -self.counts[answer])]
+
+    def candidates(self) -> Iterator[str]:
+        """
+        Yield one response per answer, for callers that try candidates until one works. A single sample is
+        tried first; if the caller asks for another, the rest of the budget is requested in one call and its
+        answers are yielded by votes, so a failing first candidate costs two round trips in total.
+        """
+        yielded = set()
+        count = min(1, self.remaining)
+        while count > 0 and self.sample(count) > 0:
+            for response in self.ranked():
+                if self.key(response) not in yielded:
+                    yielded.add(self.key(response))
+                    yield response
+            count = self.remaining
+
+
+def majority_vote(lm, query: str, num_responses: int, key: Callable[[str], str] = None, logger: logging.Logger = None) -> Optional[str]:
+    """
+    Get the most common response of a prompt, sampling only until the majority is decided.
+
+    :param lm: The language model.
+    :type lm: AbstractLanguageModel
+    :param query: The prompt.
+    :type query: str
+    :param num_responses: The maximum number of samples.
+    :type num_responses: int
+    :param key: Normalizes a response to the answer it votes for. Defaults to None (the stripped response).
+    :type key: Callable[[str], str]
+    :return: The winning response, or None if no response voted.
+    :rtype: Optional[str]
+    """
+    return MajorityVote(lm, query, num_responses, key=key, logger=logger).decide()
@@ -1,4 +1,6 @@
 from escargot.memory.memory import Memory
+from escargot.memory.ingest import BulkLoader
+from escargot.memory.retention import RetentionPolicy, RetentionManager
 from .simple_memory import SimpleMemory
 
 __all__ = ['SimpleMemory']
\ No newline at end of file
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from escargot.memory.memory import Memory
+
+
+def clean_metadata(metadata: Dict) -> Optional[Dict]:
+    """
+    Convert a metadata dictionary into the flat scalar values Chroma accepts.
+    Lists are joined with "; " and other objects are stringified.
+
+    :param metadata: The metadata to clean.
+    :type metadata: Dict
+    :return: The cleaned metadata, or None if nothing is left.
+    :rtype: Optional[Dict]
+    """
+    cleaned = {}
+    for key, value in metadata.items():
+        if key is None or value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = "; ".join(str(elem) for elem in value)
+        elif not isinstance(value, (str, int, float, bool)):
+            value = str(value)
+        cleaned[str(key)] = value
+    if len(cleaned) == 0:
+        return None
+    return cleaned
+
+
+def record_text(record: Dict, text_field: str = "text") -> Tuple[str, Dict]:
+    """
+    Split a record into the text to embed and its metadata.
+    Records without the text field (e.g. medical_literature.json) are embedded as title and abstract.
+
+    :param record: The record read from the source file.
+    :type record: Dict
+    :param text_field: The key holding the text. Defaults to "text".
+    :type text_field: str
+    :return: The text and the remaining metadata.
+    :rtype: Tuple[str, Dict]
+    """
+    record = dict(record)
+    if text_field in record:
+        text = str(record.pop(text_field))
+    else:
+        text = "\n".join(str(record[key]) for key in ("title", "abstract") if record.get(key))
+    return text, record
+
+
+def read_records(path: str, text_field: str = "text") -> Iterator[Tuple[str, Dict]]:
+    """
+    Stream (text, metadata) pairs from a JSONL, Parquet or JSON file.
+
+    :param path: The path to the source file.
+    :type path: str
+    :param text_field: The key holding the text. Defaults to "text".
+    :type text_field: str
+    :return: An iterator over the records in file order.
+    :rtype: Iterator[Tuple[str, Dict]]
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".jsonl":
+        with open(path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield record_text(json.loads(line), text_field)
+    elif extension == ".parquet":
+        import pyarrow.parquet as pq
+        parquet_file = pq.ParquetFile(path)
+        for batch in parquet_file.iter_batches():
+            for record in batch.to_pylist():
+                yield record_text(record, text_field)
+    elif extension == ".json":
+        with open(path, "r") as f:
+            records = json.load(f)
+        if isinstance(records, dict):
+            records = list(records.values())
+        for record in records:
+            yield record_text(record, text_field)
+    else:
+        raise ValueError(f"Unsupported file type for ingestion: {path}")
+
+
+class BulkLoader:
+    """
+    BulkLoader streams a corpus into a Memory collection. Texts are stored with the text as id, as
+    Memory.store_memory does, so queries return them and delete_vector removes them. They are deduplicated,
+    embedded in concurrent batches and written to Chroma in sized chunks. Progress is checkpointed
+    so an interrupted load resumes where it stopped.
+    """
+
+    def __init__(
+        self,
+        memory: Memory,
+        collection_name: str = None,
+        embed_batch_size: int = 512,
+        write_batch_size: int = 4096,
+        max_workers: int = 4,
+        checkpoint_path: str = None,
+        logger: logging.Logger = None,
+    ) -> None:
+        """
+        Initialize the BulkLoader.
+
+        :param memory: The memory to load into.
+        :type memory: Memory
+        :param collection_name: The collection to load into. Defaults to the memory's collection.
+        :type collection_name: str
+        :param embed_batch_size: Number of texts per embedding request. Defaults to 512.
+        :type embed_batch_size: int
+        :param write_batch_size: Number of vectors per Chroma add. Defaults to 4096.
+        :type write_batch_size: int
+        :param max_workers: Number of concurrent embedding requests. Defaults to 4.
+        :type max_workers: int
+        :param checkpoint_path: Path of the checkpoint file. Defaults to None (no checkpointing).
+        :type checkpoint_path: str
+        """
+        self.memory = memory
+        self.collection_name = collection_name if collection_name is not None else memory.collection_name
+        self.collection = memory.get_collection(self.collection_name)
+        self.embed_batch_size = embed_batch_size
+        self.write_batch_size = write_batch_size
+        if memory.quantization is None and hasattr(memory.client, "get_max_batch_size"):
+            self.write_batch_size = min(write_batch_size, memory.client.get_max_batch_size())
+        self.max_workers = max_workers
+        self.checkpoint_path = checkpoint_path
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+
+    def load_checkpoint(self, source: str) -> int:
+        """
+        Get the number of records of the source that were already ingested.
+
+        :param source: The path to the source file.
+        :type source: str
+        :return: The number of records to skip.
+        :rtype: int
+        """
+        if self.checkpoint_path is None or not os.path.exists(self.checkpoint_path):
+            return 0
+        with open(self.checkpoint_path, "r") as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("source") != os.path.abspath(source) or checkpoint.get("collection") != self.collection_name:
+            return 0
+        return checkpoint.get("records_done", 0)
+
+    def save_checkpoint(self, source: str, records_done: int) -> None:
+        """
+        Atomically record how many records of the source have been ingested.
+
+        :param source: The path to the source file.
+        :type source: str
+        :param records_done: The number of records consumed so far.
+        :type records_done: int
+        """
+        if self.checkpoint_path is None:
+            return
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w") as f:
+            json.dump({"source": os.path.abspath(source), "collection": self.collection_name, "records_done": records_done}, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def embed(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a batch of texts, falling back to one request per text for language models without batch support.
+        """
+        if hasattr(self.memory.lm, "get_embeddings"):
+            return self.memory.lm.get_embeddings(texts)
+        return [self.memory.lm.get_embedding(text) for text in texts]
+
+    def write(self, ids: List[str], embeddings: List[List[float]], metadatas: List[Dict], documents: List[str]) -> None:
+        """
+        Write embedded records to the collection in chunks of write_batch_size.
+        """
+        for start in range(0, len(ids), self.write_batch_size):
+            end = start + self.write_batch_size
+            self.memory.store_memories(
+                ids[start:end], embeddings[start:end], metadatas[start:end], documents[start:end],
+                collection_name=self.collection_name
+            )
+
+    def ingest(self, source: str, text_field: str = "text") -> Dict[str, int]:
+        """
+        Ingest a JSONL, Parquet or JSON file into the collection.
+
+        :param source: The path to the source file.
+        :type source: str
+        :param text_field: The key holding the text. Defaults to "text".
+        :type text_field: str
+        :return: Counts of records read, skipped as duplicates and written.
+        :rtype: Dict[str, int]
+        """
+        records_done = self.load_checkpoint(source)
+        stats = {"read": 0, "duplicates": 0, "written": 0, "resumed_from": records_done}
+        if records_done > 0:
+            self.logger.info(f"Resuming ingestion of {source} after {records_done} records")
+
+        # one window is max_workers embedding batches, embedded concurrently and then written together
+        window_size = self.embed_batch_size * self.max_workers
+        seen = set()
+        window = []
+        position = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for text, metadata in read_records(source, text_field):
+                position += 1
+                if position <= records_done:
+                    continue
+                stats["read"] += 1
+                if text.strip() == "":
+                    continue
+                # the same id scheme as Memory.store_memory
+                text_id = text
+                if text_id in seen:
+                    stats["duplicates"] += 1
+                    continue
+                seen.add(text_id)
+                window.append((text_id, text, clean_metadata(metadata)))
+                if len(window) >= window_size:
+                    stats["written"] += self.flush(executor, window, stats)
+                    self.save_checkpoint(source, position)
+                    window = []
+            if len(window) > 0:
+                stats["written"] += self.flush(executor, window, stats)
+            self.save_checkpoint(source, position)
+
+        self.logger.info(f"Ingested {source}: {stats}")
+        return stats
+
+    def flush(self, executor: ThreadPoolExecutor, window: List[Tuple[str, str, Dict]], stats: Dict[str, int]) -> int:
+        """
+        Embed and write one window of records, skipping ids already present in the collection.
+
+        :return: The number of records written.
+        :rtype: int
+        """
+        existing = set(self.collection.get(ids=[record[0] for record in window], include=[])["ids"])
+        if len(existing) > 0:
+            stats["duplicates"] += len(existing)
+            window = [record for record in window if record[0] not in existing]
+        if len(window) == 0:
+            return 0
+
+        ids = [record[0] for record in window]
+        documents = [record[1] for record in window]
+        metadatas = [record[2] for record in window]
+        batches = [documents[start:start + self.embed_batch_size] for start in range(0, len(documents), self.embed_batch_size)]
+        embeddings = []
+        for batch_embeddings in executor.map(self.embed, batches):
+            embeddings.extend(batch_embeddings)
+        self.write(ids, embeddings, metadatas, documents)
+        return len(ids)
@@ -1,51 +1,258 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
 import chromadb
 from chromadb.config import Settings
 import pandas as pd
+from escargot.memory.quantization import get_quantized_collection, reset_quantized_collections
+from escargot.memory.retention import get_access_log
+
+# resolved once so that later os.chdir calls (e.g. MultiAgentManager) do not create stray stores
+DEFAULT_MEMORY_PATH = os.path.abspath("./escargot_memory")
+
+# one lazily created client per absolute store path, shared by every Memory in the process
+chroma_clients = {}
+chroma_clients_lock = threading.Lock()
+
+def get_client(path=None):
+    path = os.path.abspath(path) if path is not None else DEFAULT_MEMORY_PATH
+    with chroma_clients_lock:
+        if path not in chroma_clients:
+            chroma_clients[path] = chromadb.PersistentClient(path=path, settings=Settings(allow_reset=True))
+        return chroma_clients[path]
+
+def close_client(path=None):
+    path = os.path.abspath(path) if path is not None else DEFAULT_MEMORY_PATH
+    with chroma_clients_lock:
+        client = chroma_clients.pop(path, None)
+        if client is None:
+            return
+        # chromadb has no public close, stopping the system releases the SQLite handle
+        system = getattr(client, "_system", None)
+        if system is None:
+            return
+        system.stop()
+        # evict only this path from chromadb's system cache, so the next client for it starts fresh
+        # while the clients of other paths keep their systems
+        shared = chromadb.api.client.SharedSystemClient
+        identifier = shared._get_identifier_from_settings(system.settings)
+        if shared._identifier_to_system.get(identifier) is system:
+            shared._identifier_to_system.pop(identifier, None)
+            shared._identifier_to_refcount.pop(identifier, None)
+
+def close_all_clients():
+    for path in list(chroma_clients.keys()):
+        close_client(path)
+
+class QueryCache:
+    """
+    Small LRU of query results keyed by (collection, where, max_results, query hash).
+    Writes to a collection invalidate its entries and bump its generation, so results
+    computed concurrently with a write are not cached.
+    """
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.generations = {}
+        # bumped when every collection is invalidated at once
+        self.epoch = 0
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def generation(self, collection_name):
+        with self.lock:
+            return (self.epoch, self.generations.get(collection_name, 0))
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value, generation):
+        with self.lock:
+            if (self.epoch, self.generations.get(key[0], 0)) != generation:
+                return
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, collection_name=None):
+        with self.lock:
+            if collection_name is None:
+                self.epoch += 1
+                self.entries.clear()
+                return
+            self.generations[collection_name] = self.generations.get(collection_name, 0) + 1
+            for key in [key for key in self.entries if key[0] == collection_name]:
+                del self.entries[key]
+
+# one query cache per absolute store path, so every Memory on a store sees the same invalidations
+query_caches = {}
+query_caches_lock = threading.Lock()
+
+def get_query_cache(path=None):
+    path = os.path.abspath(path) if path is not None else DEFAULT_MEMORY_PATH
+    with query_caches_lock:
+        if path not in query_caches:
+            query_caches[path] = QueryCache()
+        return query_caches[path]
+
 class Memory:
-    def __init__(self, lm, collection_name="escargot_memory"):
-        # Initialize ChromaDB client and specify the collection for storing vectors
-        self.client = chromadb.PersistentClient(path="./escargot_memory", settings=Settings(allow_reset=True))
+    def __init__(self, lm, collection_name="escargot_memory", path=None, quantization=None, rerank=True, retention_policy=None):
+        # Use the shared ChromaDB client of the store path and specify the collection for storing vectors
+        self.path = os.path.abspath(path) if path is not None else DEFAULT_MEMORY_PATH
         self.collection_name = collection_name
         self.lm = lm
+        # optional quantized storage tier ("float16", "int8" or "pq") used instead of Chroma collections
+        self.quantization = quantization
+        self.rerank = rerank
+        # optional RetentionPolicy, enforced by a RetentionManager
+        self.retention_policy = retention_policy
+        self._collection = None
+        self._collection_client = None
+
+        # create the collection if it does not exist yet
+        self.collection
+
+    @property
+    def client(self):
+        # Looked up on every access so a closed client is reopened lazily
+        return get_client(self.path)
 
-        self.collection = self.client.get_or_create_collection(collection_name)
+    @property
+    def collection(self):
+        if self.quantization is not None:
+            return self.get_collection(self.collection_name)
+        client = self.client
+        if self._collection is None or self._collection_client is not client:
+            self._collection = client.get_or_create_collection(self.collection_name)
+            self._collection_client = client
+        return self._collection
+
+    def get_collection(self, collection_name, create=True):
+        # Return the Chroma collection, or its quantized counterpart when quantization is enabled
+        if self.quantization is not None:
+            quantized_path = os.path.join(self.path, "quantized")
+            if not create and not os.path.exists(os.path.join(quantized_path, collection_name + ".json")):
+                raise ValueError(f"Collection {collection_name} does not exist.")
+            return get_quantized_collection(collection_name, quantized_path, method=self.quantization, rerank=self.rerank)
+        if create:
+            return self.client.get_or_create_collection(collection_name)
+        return self.client.get_collection(collection_name)
 
     def reset_collection(self):
+        # Clear the Chroma collections and the quantized ones of the store
         self.client.reset() 
+        reset_quantized_collections(os.path.join(self.path, "quantized"))
+        self.invalidate_cache()
+
+    def invalidate_cache(self, collection_name=None):
+        # Drop cached query results of a collection (or of all collections) after a write
+        get_query_cache(self.path).invalidate(collection_name)
+
+    def close(self):
+        # Write the buffered accesses, then close the shared client of this store, any Memory on the same path will reopen it lazily
+        access_log = get_access_log(self.path)
+        for collection_name in list(access_log.pending):
+            try:
+                access_log.flush(collection_name, self.get_collection(collection_name, create=False))
+            except Exception:
+                continue
+        close_client(self.path)
 
     def store_memory(self, text, metadata={None:None},collection_name = None):
         # Embed the text using the lm's embed function
         vector = self.lm.get_embedding(text)
+        if self.retention_policy is not None:
+            metadata = self.retention_policy.stamp(metadata)
 
         # Add the embedded vector to the collection
         if collection_name is None:
             self.collection.add(ids=text, embeddings=[vector], metadatas=[metadata])
         else:
-            collection = self.client.get_collection(collection_name)
+            collection = self.get_collection(collection_name, create=False)
             collection.add(ids=text, embeddings=[vector], metadatas=[metadata])
+        self.invalidate_cache(collection_name if collection_name is not None else self.collection_name)
 
-    def query_collection(self,query, max_results=10, collection_name = "escargot_memory", metadata = None):
-        collection = self.client.get_collection(collection_name)
-        query_embeddings = self.lm.get_embedding(query)
-        if metadata is not None:
-            results = collection.query(
-                query_embeddings=query_embeddings,
-                n_results=max_results,
-                where=metadata,
-                include=['distances']
-            )
+    def store_memories(self, ids, embeddings, metadatas=None, documents=None, collection_name=None):
+        # Add already embedded vectors to the collection in a single transaction
+        if self.retention_policy is not None:
+            now = time.time()
+            metadatas = [self.retention_policy.stamp(metadata, now) for metadata in (metadatas or [None] * len(ids))]
+        if collection_name is None:
+            collection = self.collection
         else:
-            results = collection.query(
-                query_embeddings=query_embeddings,
-                n_results=max_results,
-                include=['distances']
-            )
+            collection = self.get_collection(collection_name)
+        collection.add(ids=ids, embeddings=embeddings, metadatas=metadatas, documents=documents)
+        self.invalidate_cache(collection_name if collection_name is not None else self.collection_name)
+
+    def query_collection(self,query, max_results=10, collection_name = "escargot_memory", metadata = None):
+        return self.query_collections([query], max_results=max_results, collection_name=collection_name, metadata=metadata)
+
+    def query_collections(self, queries, max_results=10, collection_name = "escargot_memory", metadata = None):
+        # Answer several queries with one embedding request and one Chroma multi-query, reusing cached results
+        collection = self.get_collection(collection_name, create=False)
+        cache = get_query_cache(self.path)
+        generation = cache.generation(collection_name)
+        where_key = json.dumps(metadata, sort_keys=True, default=str)
+        keys = [(collection_name, where_key, max_results, hashlib.sha256(query.encode("utf-8")).hexdigest()) for query in queries]
+        results = [cache.get(key) for key in keys]
+        missing = [i for i, result in enumerate(results) if result is None]
+        if len(missing) > 0:
+            missing_queries = [queries[i] for i in missing]
+            if hasattr(self.lm, "get_embeddings"):
+                query_embeddings = self.lm.get_embeddings(missing_queries)
+            else:
+                query_embeddings = [self.lm.get_embedding(query) for query in missing_queries]
+            if metadata is not None:
+                response = collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=max_results,
+                    where=metadata,
+                    include=['distances']
+                )
+            else:
+                response = collection.query(
+                    query_embeddings=query_embeddings,
+                    n_results=max_results,
+                    include=['distances']
+                )
+            for j, i in enumerate(missing):
+                results[i] = (tuple(response["ids"][j]), tuple(response["distances"][j]))
+                cache.put(keys[i], results[i], generation)
+        results = {
+            "ids": [list(result[0]) for result in results],
+            "distances": [list(result[1]) for result in results],
+        }
+        if self.retention_policy is not None and self.retention_policy.track_access:
+            self.record_access(collection, collection_name, results["ids"])
         return results
 
+    def record_access(self, collection, collection_name, ids):
+        # Buffer the access time and retrieval count of retrieved items, used for LRU and least-retrieved eviction,
+        # and write them to the collection at most every access_flush_seconds
+        ids = [id for query_ids in ids for id in query_ids]
+        if len(ids) == 0:
+            return
+        access_log = get_access_log(self.path)
+        access_log.record(collection_name, ids)
+        if access_log.due(collection_name, self.retention_policy.access_flush_seconds):
+            access_log.flush(collection_name, collection)
+
     def get_all_vectors(self):
         # Return all vectors stored in the collection
         return self.collection.get()
 
     def delete_vector(self, text):
         # Delete a vector by id (text)
-        self.collection.delete(ids=text)
\ No newline at end of file
+        self.collection.delete(ids=text)
+        self.invalidate_cache(self.collection_name)
\ No newline at end of file
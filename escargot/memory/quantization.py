@@ -0,0 +1,657 @@
+import json
+import os
+import shutil
+import threading
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+
+class ScalarQuantizer:
+    """
+    ScalarQuantizer stores every dimension of a vector in a smaller type.
+    float16 halves the size, int8 quarters it using one symmetric scale per vector.
+    """
+
+    def __init__(self, dtype: str = "int8") -> None:
+        """
+        Initialize the ScalarQuantizer.
+
+        :param dtype: Either "float16" or "int8". Defaults to "int8".
+        :type dtype: str
+        """
+        assert dtype in ("float16", "int8"), f"Unsupported scalar quantization {dtype}"
+        self.dtype = dtype
+        self.trained = True
+
+    def train(self, vectors: np.ndarray) -> None:
+        pass
+
+    def needs_training(self, count: int) -> bool:
+        return False
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        """
+        Encode float vectors into codes.
+
+        :param vectors: The vectors to encode, shape (n, dim).
+        :type vectors: np.ndarray
+        :return: The codes, and the per vector scales for int8.
+        :rtype: Dict[str, np.ndarray]
+        """
+        if self.dtype == "float16":
+            return {"codes": vectors.astype(np.float16)}
+        scales = np.abs(vectors).max(axis=1) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return {"codes": codes, "scales": scales.astype(np.float32)}
+
+    def decode(self, encoded: Dict[str, np.ndarray]) -> np.ndarray:
+        if self.dtype == "float16":
+            return encoded["codes"].astype(np.float32)
+        return encoded["codes"].astype(np.float32) * encoded["scales"][:, None]
+
+    def distances(self, query: np.ndarray, encoded: Dict[str, np.ndarray], chunk_size: int = 65536) -> np.ndarray:
+        """
+        Approximate squared L2 distances between a query and all encoded vectors.
+        The codes are decoded chunk by chunk, so a query never holds a float32 copy of the whole collection.
+        """
+        codes = encoded["codes"]
+        distances = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), chunk_size):
+            chunk = {key: value[start:start + chunk_size] for key, value in encoded.items()}
+            distances[start:start + chunk_size] = ((self.decode(chunk) - query[None, :]) ** 2).sum(axis=1)
+        return distances
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        pass
+
+
+class ProductQuantizer:
+    """
+    ProductQuantizer splits each vector into subspaces and stores the index of the nearest
+    k-means centroid of every subspace in one byte. Distances are computed with lookup tables.
+    """
+
+    def __init__(self, num_subspaces: int = 96, num_centroids: int = 256, iterations: int = 20, seed: int = 0,
+                 training_size: int = 1024, retrain_factor: int = 4, max_training: int = 65536) -> None:
+        """
+        Initialize the ProductQuantizer.
+
+        :param num_subspaces: Number of subspaces, must divide the vector dimension. Defaults to 96.
+        :type num_subspaces: int
+        :param num_centroids: Number of centroids per subspace, at most 256. Defaults to 256.
+        :type num_centroids: int
+        :param iterations: Number of k-means iterations. Defaults to 20.
+        :type iterations: int
+        :param seed: The random seed for the centroid initialization. Defaults to 0.
+        :type seed: int
+        :param training_size: Number of vectors a collection buffers unquantized before the first training. Defaults to 1024.
+        :type training_size: int
+        :param retrain_factor: Retrain once a collection has grown this many times past the size it was trained at. Defaults to 4.
+        :type retrain_factor: int
+        :param max_training: Maximum number of vectors sampled for a training. Defaults to 65536.
+        :type max_training: int
+        """
+        assert num_centroids <= 256, "Codes are stored in one byte, use at most 256 centroids"
+        self.num_subspaces = num_subspaces
+        self.num_centroids = num_centroids
+        self.iterations = iterations
+        self.seed = seed
+        self.training_size = max(training_size, num_centroids)
+        self.retrain_factor = retrain_factor
+        self.max_training = max_training
+        self.centroids: Optional[np.ndarray] = None
+        self.trained = False
+        self.trained_on = 0
+
+    def split(self, vectors: np.ndarray) -> np.ndarray:
+        n, dim = vectors.shape
+        assert dim % self.num_subspaces == 0, f"Dimension {dim} is not divisible by {self.num_subspaces} subspaces"
+        return vectors.reshape(n, self.num_subspaces, dim // self.num_subspaces)
+
+    def train(self, vectors: np.ndarray) -> None:
+        """
+        Fit the centroids of every subspace with k-means.
+
+        :param vectors: The training vectors, shape (n, dim).
+        :type vectors: np.ndarray
+        """
+        rng = np.random.default_rng(self.seed)
+        subvectors = self.split(vectors.astype(np.float32))
+        num_centroids = min(self.num_centroids, len(vectors))
+        centroids = []
+        for m in range(self.num_subspaces):
+            data = subvectors[:, m, :]
+            centers = data[rng.choice(len(data), num_centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = self.nearest(data, centers)
+                for c in range(num_centroids):
+                    members = data[assignment == c]
+                    if len(members) > 0:
+                        centers[c] = members.mean(axis=0)
+            centroids.append(centers)
+        self.centroids = np.stack(centroids)
+        self.trained = True
+
+    def needs_training(self, count: int) -> bool:
+        """
+        Whether a collection of count vectors should (re)train the quantizer: first once enough vectors are
+        buffered, then whenever the collection has grown retrain_factor times past the size it was trained at.
+        """
+        if not self.trained:
+            return count >= self.training_size
+        return count >= self.retrain_factor * max(self.trained_on, self.training_size)
+
+    @staticmethod
+    def nearest(data: np.ndarray, centers: np.ndarray) -> np.ndarray:
+        distances = (data ** 2).sum(axis=1)[:, None] - 2 * data @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+        return distances.argmin(axis=1)
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        subvectors = self.split(vectors.astype(np.float32))
+        codes = np.empty((len(vectors), self.num_subspaces), dtype=np.uint8)
+        for m in range(self.num_subspaces):
+            codes[:, m] = self.nearest(subvectors[:, m, :], self.centroids[m])
+        return {"codes": codes}
+
+    def decode(self, encoded: Dict[str, np.ndarray]) -> np.ndarray:
+        codes = encoded["codes"]
+        parts = [self.centroids[m][codes[:, m]] for m in range(self.num_subspaces)]
+        return np.concatenate(parts, axis=1)
+
+    def distances(self, query: np.ndarray, encoded: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Asymmetric squared L2 distances: the query stays exact, the stored vectors are codes.
+        """
+        query = query.astype(np.float32).reshape(self.num_subspaces, -1)
+        tables = ((self.centroids - query[:, None, :]) ** 2).sum(axis=2)
+        codes = encoded["codes"]
+        return tables[np.arange(self.num_subspaces)[None, :], codes].sum(axis=1)
+
+    def state(self) -> Dict[str, np.ndarray]:
+        return {"centroids": self.centroids, "trained_on": np.array(self.trained_on)} if self.trained else {}
+
+    def load_state(self, state: Dict[str, np.ndarray]) -> None:
+        if "centroids" in state:
+            self.centroids = state["centroids"]
+            self.trained = True
+            self.trained_on = int(state["trained_on"]) if "trained_on" in state else len(self.centroids[0])
+
+
+def make_quantizer(method: str):
+    """
+    Create a quantizer from its name: "float16", "int8" or "pq".
+    """
+    if method in ("float16", "int8"):
+        return ScalarQuantizer(method)
+    elif method == "pq":
+        return ProductQuantizer()
+    raise ValueError(f"Unknown quantization method {method}")
+
+
+def matches_where(metadata: Optional[Dict], where: Optional[Dict]) -> bool:
+    """
+    Evaluate a Chroma style where filter against one metadata dictionary.
+    Supports equality, $eq, $ne, $gt, $gte, $lt, $lte, $in, $nin, $and and $or.
+    """
+    if where is None or len(where) == 0:
+        return True
+    metadata = metadata or {}
+    for key, condition in where.items():
+        if key == "$and":
+            if not all(matches_where(metadata, sub) for sub in condition):
+                return False
+            continue
+        if key == "$or":
+            if not any(matches_where(metadata, sub) for sub in condition):
+                return False
+            continue
+        value = metadata.get(key)
+        if not isinstance(condition, dict):
+            condition = {"$eq": condition}
+        for operator, operand in condition.items():
+            if operator == "$eq" and not value == operand:
+                return False
+            elif operator == "$ne" and not value != operand:
+                return False
+            elif operator == "$in" and value not in operand:
+                return False
+            elif operator == "$nin" and value in operand:
+                return False
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                if value is None:
+                    return False
+                if operator == "$gt" and not value > operand:
+                    return False
+                if operator == "$gte" and not value >= operand:
+                    return False
+                if operator == "$lt" and not value < operand:
+                    return False
+                if operator == "$lte" and not value <= operand:
+                    return False
+    return True
+
+
+class QuantizedCollection:
+    """
+    QuantizedCollection is a drop-in replacement for the subset of the Chroma collection API used by Memory.
+    Vectors are kept in RAM only as quantized codes. Optionally, the full precision vectors are appended to a
+    file on disk that is memory mapped and read only for the exact re-ranking of the top candidates.
+
+    Quantizers that need training (pq) keep the first vectors unquantized until there are enough of them to train
+    on, and retrain once the collection has outgrown its training. On disk, a snapshot of the collection is followed
+    by an append-only log of the later writes, which is folded into a new snapshot once it grows as long as the
+    collection.
+    """
+
+    def __init__(self, name: str, path: str, method: str = "int8", rerank: bool = True, rerank_candidates: int = 50) -> None:
+        """
+        Initialize the QuantizedCollection, loading it from disk if it exists.
+
+        :param name: The name of the collection.
+        :type name: str
+        :param path: The directory the collection is stored in.
+        :type path: str
+        :param method: The quantization method, "float16", "int8" or "pq". Defaults to "int8".
+        :type method: str
+        :param rerank: Whether to keep full precision vectors on disk for exact re-ranking. Defaults to True.
+        :type rerank: bool
+        :param rerank_candidates: Number of approximate candidates to re-rank exactly. Defaults to 50.
+        :type rerank_candidates: int
+        """
+        self.name = name
+        self.path = path
+        self.method = method
+        self.rerank = rerank
+        self.rerank_candidates = rerank_candidates
+        self.quantizer = make_quantizer(method)
+        self.lock = threading.RLock()
+        self.ids: List[str] = []
+        self.index: Dict[str, int] = {}
+        self.metadatas: List[Optional[Dict]] = []
+        self.documents: List[Optional[str]] = []
+        self.encoded: Dict[str, np.ndarray] = {}
+        self.rows = np.zeros(0, dtype=np.int64)
+        self.dim: Optional[int] = None
+        self.rerank_rows = 0
+        self.generation = 0
+        self.log_entries = 0
+        self._rerank_map = None
+        os.makedirs(path, exist_ok=True)
+        self.load()
+
+    def file(self, suffix: str) -> str:
+        return os.path.join(self.path, f"{self.name}.{suffix}")
+
+    def load(self) -> None:
+        if not os.path.exists(self.file("json")):
+            return
+        with open(self.file("json"), "r") as f:
+            header = json.load(f)
+        assert header["method"] == self.method, f"Collection {self.name} is stored with {header['method']} quantization"
+        self.ids = header["ids"]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+        self.metadatas = header["metadatas"]
+        self.documents = header["documents"]
+        self.dim = header["dim"]
+        self.rerank_rows = header["rerank_rows"]
+        self.generation = header.get("generation", 0)
+        with np.load(self.file("npz")) as arrays:
+            self.rows = arrays["rows"]
+            self.encoded = {key[len("encoded_"):]: arrays[key] for key in arrays.files if key.startswith("encoded_")}
+            self.quantizer.load_state({key[len("state_"):]: arrays[key] for key in arrays.files if key.startswith("state_")})
+        self.replay()
+
+    def replay(self) -> None:
+        """
+        Apply the writes logged after the snapshot. A write interrupted by a crash ends the log.
+        """
+        if not os.path.exists(self.file(f"{self.generation}.log")):
+            return
+        with open(self.file(f"{self.generation}.log"), "r") as log, open(self.file(f"{self.generation}.codes"), "rb") as codes:
+            for line in log:
+                if not line.endswith("\n"):
+                    break
+                entry = json.loads(line)
+                if entry["op"] == "add":
+                    try:
+                        encoded = {key: np.load(codes) for key in entry["keys"]}
+                    except (ValueError, EOFError):
+                        break
+                    self.insert(entry["ids"], entry["metadatas"], entry["documents"], encoded)
+                elif entry["op"] == "update":
+                    self.merge(entry["ids"], entry["metadatas"])
+                elif entry["op"] == "delete":
+                    self.remove([self.index[id] for id in entry["ids"] if id in self.index])
+                self.log_entries += 1
+
+    def save(self) -> None:
+        """
+        Persist a snapshot of the codes, ids and metadata of the collection, and start a new log.
+        """
+        with self.lock:
+            generation = self.generation + 1
+            arrays = {"rows": self.rows}
+            arrays.update({"encoded_" + key: value for key, value in self.encoded.items()})
+            arrays.update({"state_" + key: value for key, value in self.quantizer.state().items()})
+            np.savez(self.file("tmp.npz"), **arrays)
+            os.replace(self.file("tmp.npz"), self.file("npz"))
+            header = {
+                "method": self.method, "dim": self.dim, "rerank_rows": self.rerank_rows, "generation": generation,
+                "ids": self.ids, "metadatas": self.metadatas, "documents": self.documents,
+            }
+            with open(self.file("tmp.json"), "w") as f:
+                json.dump(header, f)
+            os.replace(self.file("tmp.json"), self.file("json"))
+            for suffix in ("log", "codes"):
+                if os.path.exists(self.file(f"{self.generation}.{suffix}")):
+                    os.remove(self.file(f"{self.generation}.{suffix}"))
+            self.generation = generation
+            self.log_entries = 0
+
+    def append(self, entry: Dict[str, Any], encoded: Dict[str, np.ndarray] = None) -> None:
+        """
+        Persist one write by appending it to the log, or by a new snapshot once the log is as long as the collection.
+        """
+        if not os.path.exists(self.file("json")) or self.log_entries >= max(1024, len(self.ids)):
+            self.save()
+            return
+        if encoded is not None:
+            entry["keys"] = sorted(encoded)
+            with open(self.file(f"{self.generation}.codes"), "ab") as f:
+                for key in entry["keys"]:
+                    np.save(f, encoded[key])
+        with open(self.file(f"{self.generation}.log"), "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.log_entries += 1
+
+    def count(self) -> int:
+        return len(self.ids)
+
+    def nbytes(self) -> Dict[str, int]:
+        """
+        Report the memory used by the codes and the disk used by the re-ranking vectors.
+        """
+        codes = sum(value.nbytes for value in self.encoded.values()) + self.rows.nbytes
+        state = sum(value.nbytes for value in self.quantizer.state().values())
+        rerank = os.path.getsize(self.file("f32")) if os.path.exists(self.file("f32")) else 0
+        return {"codes": codes, "codebook": state, "rerank_on_disk": rerank, "float32_equivalent": len(self.ids) * (self.dim or 0) * 4}
+
+    def rerank_vectors(self) -> Optional[np.memmap]:
+        if not self.rerank or self.rerank_rows == 0:
+            return None
+        if self._rerank_map is None or self._rerank_map.shape[0] != self.rerank_rows:
+            self._rerank_map = np.memmap(self.file("f32"), dtype=np.float32, mode="r", shape=(self.rerank_rows, self.dim))
+        return self._rerank_map
+
+    def encode(self, vectors: np.ndarray) -> Dict[str, np.ndarray]:
+        # vectors stay unquantized until the quantizer has been trained
+        if "raw" in self.encoded or not self.quantizer.trained:
+            return {"raw": vectors}
+        return self.quantizer.encode(vectors)
+
+    def decode(self, encoded: Dict[str, np.ndarray]) -> np.ndarray:
+        if "raw" in encoded:
+            return encoded["raw"]
+        return self.quantizer.decode(encoded)
+
+    def approximate_distances(self, query: np.ndarray, encoded: Dict[str, np.ndarray]) -> np.ndarray:
+        if "raw" in encoded:
+            return ((encoded["raw"] - query[None, :]) ** 2).sum(axis=1)
+        return self.quantizer.distances(query, encoded)
+
+    def train(self, chunk_size: int = 65536) -> bool:
+        """
+        Train the quantizer on a sample of the collection and re-encode every vector with it.
+        Retraining reads the full precision vectors, so without re-ranking a trained collection keeps its codebook.
+
+        :return: Whether the quantizer was trained.
+        :rtype: bool
+        """
+        reranked = self.rerank_vectors()
+        if "raw" in self.encoded:
+            source = self.encoded["raw"]
+        elif reranked is not None:
+            source = reranked
+        else:
+            return False
+        positions = np.arange(len(self.ids))
+        if len(positions) > self.quantizer.max_training:
+            rng = np.random.default_rng(self.quantizer.seed)
+            positions = np.sort(rng.choice(len(positions), self.quantizer.max_training, replace=False))
+        rows = positions if source is not reranked else self.rows[positions]
+        self.quantizer.train(np.array(source[rows]))
+        self.quantizer.trained_on = len(self.ids)
+        parts = []
+        for start in range(0, len(self.ids), chunk_size):
+            rows = np.arange(start, min(start + chunk_size, len(self.ids)))
+            parts.append(self.quantizer.encode(np.array(source[rows if source is not reranked else self.rows[rows]])))
+        self.encoded = {key: np.concatenate([part[key] for part in parts]) for key in parts[0]}
+        return True
+
+    def insert(self, ids, metadatas, documents, encoded: Dict[str, np.ndarray]) -> None:
+        for key, value in encoded.items():
+            self.encoded[key] = value if key not in self.encoded else np.concatenate([self.encoded[key], value])
+        self.rows = np.concatenate([self.rows, np.arange(self.rerank_rows, self.rerank_rows + len(ids), dtype=np.int64)])
+        self.rerank_rows += len(ids)
+        for i, id in enumerate(ids):
+            self.index[id] = len(self.ids)
+            self.ids.append(id)
+            self.metadatas.append(metadatas[i])
+            self.documents.append(documents[i])
+
+    def merge(self, ids, metadatas) -> None:
+        for id, metadata in zip(ids, metadatas):
+            if id in self.index and metadata is not None:
+                position = self.index[id]
+                self.metadatas[position] = {**(self.metadatas[position] or {}), **metadata}
+
+    def remove(self, positions: List[int]) -> None:
+        keep = np.ones(len(self.ids), dtype=bool)
+        keep[positions] = False
+        self.ids = [id for i, id in enumerate(self.ids) if keep[i]]
+        self.metadatas = [metadata for i, metadata in enumerate(self.metadatas) if keep[i]]
+        self.documents = [document for i, document in enumerate(self.documents) if keep[i]]
+        self.encoded = {key: value[keep] for key, value in self.encoded.items()}
+        self.rows = self.rows[keep]
+        self.index = {id: i for i, id in enumerate(self.ids)}
+
+    def add(self, ids, embeddings, metadatas=None, documents=None) -> None:
+        if isinstance(ids, str):
+            ids = [ids]
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.ndim == 1:
+            vectors = vectors[None, :]
+        metadatas = metadatas if metadatas is not None else [None] * len(ids)
+        documents = documents if documents is not None else [None] * len(ids)
+        with self.lock:
+            duplicates = [id for id in ids if id in self.index]
+            if len(duplicates) > 0:
+                raise ValueError(f"IDs already exist in collection {self.name}: {duplicates[:5]}")
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            encoded = self.encode(vectors)
+            if self.rerank:
+                with open(self.file("f32"), "ab") as f:
+                    f.write(vectors.tobytes())
+            self.insert(ids, metadatas, documents, encoded)
+            if self.quantizer.needs_training(len(self.ids)) and self.train():
+                self.save()
+            else:
+                self.append({"op": "add", "ids": list(ids), "metadatas": list(metadatas), "documents": list(documents)}, encoded)
+
+    def update(self, ids, metadatas) -> None:
+        """
+        Merge new metadata values into existing entries, like Chroma's update.
+        """
+        if isinstance(ids, str):
+            ids = [ids]
+        with self.lock:
+            self.merge(ids, metadatas)
+            self.append({"op": "update", "ids": list(ids), "metadatas": list(metadatas)})
+
+    def delete(self, ids=None, where=None) -> None:
+        if isinstance(ids, str):
+            ids = [ids]
+        with self.lock:
+            positions = self.select(ids, where)
+            if len(positions) == 0:
+                return
+            deleted = [self.ids[i] for i in positions]
+            self.remove(positions)
+            self.append({"op": "delete", "ids": deleted})
+
+    def compact(self) -> None:
+        """
+        Rewrite the re-ranking file without the rows of deleted vectors.
+        """
+        with self.lock:
+            vectors = self.rerank_vectors()
+            if vectors is None:
+                return
+            live = np.array(vectors[self.rows])
+            self._rerank_map = None
+            with open(self.file("tmp.f32"), "wb") as f:
+                f.write(live.tobytes())
+            os.replace(self.file("tmp.f32"), self.file("f32"))
+            self.rows = np.arange(len(self.ids), dtype=np.int64)
+            self.rerank_rows = len(self.ids)
+            self.save()
+
+    def select(self, ids=None, where=None) -> List[int]:
+        if ids is not None:
+            positions = [self.index[id] for id in ids if id in self.index]
+        else:
+            positions = list(range(len(self.ids)))
+        if where is not None:
+            positions = [i for i in positions if matches_where(self.metadatas[i], where)]
+        return positions
+
+    def vectors(self, positions: List[int]) -> np.ndarray:
+        reranked = self.rerank_vectors()
+        if reranked is not None:
+            return np.array(reranked[self.rows[positions]])
+        return self.decode({key: value[positions] for key, value in self.encoded.items()})
+
+    def get(self, ids=None, where=None, limit=None, offset=None, include=["metadatas", "documents"]) -> Dict[str, Any]:
+        if isinstance(ids, str):
+            ids = [ids]
+        with self.lock:
+            positions = self.select(ids, where)
+            if offset is not None:
+                positions = positions[offset:]
+            if limit is not None:
+                positions = positions[:limit]
+            return {
+                "ids": [self.ids[i] for i in positions],
+                "embeddings": self.vectors(positions).tolist() if "embeddings" in include else None,
+                "metadatas": [self.metadatas[i] for i in positions] if "metadatas" in include else None,
+                "documents": [self.documents[i] for i in positions] if "documents" in include else None,
+                "included": list(include),
+            }
+
+    def query(self, query_embeddings, n_results=10, where=None, include=["metadatas", "documents", "distances"]) -> Dict[str, Any]:
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.ndim == 1:
+            queries = queries[None, :]
+        results = {"ids": [], "distances": [], "metadatas": [], "documents": [], "embeddings": None, "included": list(include)}
+        with self.lock:
+            positions = np.array(self.select(None, where), dtype=np.int64)
+            encoded = self.encoded if where is None else {key: value[positions] for key, value in self.encoded.items()}
+            reranked = self.rerank_vectors()
+            for query in queries:
+                if len(positions) == 0:
+                    top, distances = np.zeros(0, dtype=np.int64), np.zeros(0)
+                else:
+                    approximate = self.approximate_distances(query, encoded)
+                    num_candidates = min(len(positions), max(n_results, self.rerank_candidates) if reranked is not None else n_results)
+                    candidates = np.argpartition(approximate, num_candidates - 1)[:num_candidates]
+                    if reranked is not None:
+                        exact = np.array(reranked[self.rows[positions[candidates]]])
+                        distances = ((exact - query[None, :]) ** 2).sum(axis=1)
+                    else:
+                        distances = approximate[candidates]
+                    order = np.argsort(distances)[:n_results]
+                    top, distances = positions[candidates[order]], distances[order]
+                results["ids"].append([self.ids[i] for i in top])
+                results["distances"].append(distances.tolist())
+                results["metadatas"].append([self.metadatas[i] for i in top])
+                results["documents"].append([self.documents[i] for i in top])
+        for key in ("distances", "metadatas", "documents"):
+            if key not in include:
+                results[key] = None
+        return results
+
+
+quantized_collections = {}
+quantized_collections_lock = threading.Lock()
+
+def get_quantized_collection(name: str, path: str, method: str = "int8", rerank: bool = True) -> QuantizedCollection:
+    """
+    Get the process-wide QuantizedCollection for a store path and name, loading it on first use.
+    """
+    key = (os.path.abspath(path), name)
+    with quantized_collections_lock:
+        if key not in quantized_collections:
+            quantized_collections[key] = QuantizedCollection(name, key[0], method=method, rerank=rerank)
+        return quantized_collections[key]
+
+
+def reset_quantized_collections(path: str) -> None:
+    """
+    Drop every QuantizedCollection stored in a directory, in memory and on disk.
+    """
+    path = os.path.abspath(path)
+    with quantized_collections_lock:
+        for key in [key for key in quantized_collections if key[0] == path]:
+            collection = quantized_collections.pop(key)
+            # release the memory map of the re-ranking file before it is removed
+            collection._rerank_map = None
+        if os.path.exists(path):
+            shutil.rmtree(path)
+
+
+def evaluate_quantization(vectors: np.ndarray, queries: np.ndarray, k: int = 10, rerank_candidates: int = 50, methods=("float16", "int8", "pq")) -> List[Dict[str, Any]]:
+    """
+    Report the recall/size trade-off of each quantization method against exact search.
+
+    :param vectors: The stored vectors, shape (n, dim).
+    :type vectors: np.ndarray
+    :param queries: The query vectors, shape (q, dim).
+    :type queries: np.ndarray
+    :param k: The number of neighbours to compare. Defaults to 10.
+    :type k: int
+    :param rerank_candidates: Number of candidates re-ranked exactly. Defaults to 50.
+    :type rerank_candidates: int
+    :return: One row per method with bytes per vector, compression, recall@k and recall@k after re-ranking.
+    :rtype: List[Dict[str, Any]]
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    queries = np.asarray(queries, dtype=np.float32)
+    exact_distances = (queries ** 2).sum(axis=1)[:, None] - 2 * queries @ vectors.T + (vectors ** 2).sum(axis=1)[None, :]
+    truth = np.argsort(exact_distances, axis=1)[:, :k]
+    report = []
+    for method in methods:
+        quantizer = make_quantizer(method)
+        quantizer.train(vectors)
+        encoded = quantizer.encode(vectors)
+        hits, reranked_hits = 0, 0
+        for q, query in enumerate(queries):
+            approximate = quantizer.distances(query, encoded)
+            hits += len(set(np.argsort(approximate)[:k]) & set(truth[q]))
+            candidates = np.argsort(approximate)[:max(k, rerank_candidates)]
+            exact = exact_distances[q, candidates]
+            reranked_hits += len(set(candidates[np.argsort(exact)[:k]]) & set(truth[q]))
+        bytes_per_vector = sum(value.nbytes for value in encoded.values()) / len(vectors)
+        report.append({
+            "method": method,
+            "bytes_per_vector": bytes_per_vector,
+            "compression": vectors.shape[1] * 4 / bytes_per_vector,
+            "recall_at_k": hits / (len(queries) * k),
+            "recall_at_k_reranked": reranked_hits / (len(queries) * k),
+        })
+    return report
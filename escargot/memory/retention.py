@@ -0,0 +1,270 @@
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List
+
+# metadata keys maintained on every stored item when a retention policy is set
+CREATED_AT_KEY = "escargot_created_at"
+LAST_ACCESSED_KEY = "escargot_last_accessed"
+RETRIEVALS_KEY = "escargot_retrievals"
+
+
+class RetentionPolicy:
+    """
+    RetentionPolicy describes how long items are kept in a Memory collection and how many of them.
+    """
+
+    def __init__(self, ttl_seconds: float = None, max_items: int = None, eviction: str = "lru", track_access: bool = True, access_flush_seconds: float = 60) -> None:
+        """
+        Initialize the RetentionPolicy.
+
+        :param ttl_seconds: Items older than this are deleted. Defaults to None (no expiry).
+        :type ttl_seconds: float
+        :param max_items: Maximum number of items per collection. Defaults to None (no cap).
+        :type max_items: int
+        :param eviction: Which items to evict over the cap, "lru" or "least_retrieved". Defaults to "lru".
+        :type eviction: str
+        :param track_access: Whether queries update the access time and retrieval count of the returned items. Defaults to True.
+        :type track_access: bool
+        :param access_flush_seconds: Seconds the accesses are buffered before they are written to the collection. Defaults to 60.
+        :type access_flush_seconds: float
+        """
+        assert eviction in ("lru", "least_retrieved"), f"Unknown eviction strategy {eviction}"
+        self.ttl_seconds = ttl_seconds
+        self.max_items = max_items
+        self.eviction = eviction
+        self.track_access = track_access
+        self.access_flush_seconds = access_flush_seconds
+
+    def stamp(self, metadata: Dict, now: float = None) -> Dict:
+        """
+        Add the creation and access bookkeeping to the metadata of a new item.
+        """
+        now = time.time() if now is None else now
+        metadata = {key: value for key, value in (metadata or {}).items() if key is not None}
+        metadata.setdefault(CREATED_AT_KEY, now)
+        metadata.setdefault(LAST_ACCESSED_KEY, now)
+        metadata.setdefault(RETRIEVALS_KEY, 0)
+        return metadata
+
+
+class AccessLog:
+    """
+    AccessLog buffers the retrievals of the items of a store, so that queries do not write to the collection.
+    The buffered access times and retrieval counts are written with one update per collection when flushed.
+    """
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        # collection name -> item id -> [last access time, retrievals since the last flush]
+        self.pending: Dict[str, Dict[str, List]] = {}
+        self.last_flush: Dict[str, float] = {}
+
+    def record(self, collection_name: str, ids: List[str], now: float = None) -> None:
+        now = time.time() if now is None else now
+        with self.lock:
+            pending = self.pending.setdefault(collection_name, {})
+            self.last_flush.setdefault(collection_name, now)
+            for id in ids:
+                entry = pending.setdefault(id, [now, 0])
+                entry[0] = now
+                entry[1] += 1
+
+    def due(self, collection_name: str, interval_seconds: float) -> bool:
+        with self.lock:
+            return time.time() - self.last_flush.get(collection_name, time.time()) >= interval_seconds
+
+    def flush(self, collection_name: str, collection) -> int:
+        """
+        Write the buffered accesses of a collection.
+
+        :return: The number of items updated.
+        :rtype: int
+        """
+        with self.lock:
+            pending = self.pending.pop(collection_name, {})
+            self.last_flush[collection_name] = time.time()
+        if len(pending) == 0:
+            return 0
+        entries = collection.get(ids=list(pending), include=['metadatas'])
+        metadatas = [
+            {LAST_ACCESSED_KEY: pending[id][0], RETRIEVALS_KEY: (metadata or {}).get(RETRIEVALS_KEY, 0) + pending[id][1]}
+            for id, metadata in zip(entries["ids"], entries["metadatas"])
+        ]
+        if len(metadatas) > 0:
+            collection.update(ids=entries["ids"], metadatas=metadatas)
+        return len(metadatas)
+
+
+access_logs = {}
+access_logs_lock = threading.Lock()
+
+def get_access_log(path: str) -> AccessLog:
+    """
+    Get the process-wide AccessLog of a store path.
+    """
+    path = os.path.abspath(path)
+    with access_logs_lock:
+        if path not in access_logs:
+            access_logs[path] = AccessLog()
+        return access_logs[path]
+
+
+class RetentionManager:
+    """
+    RetentionManager enforces a RetentionPolicy on the collections of a Memory, either on demand
+    or from a background thread, and keeps size and eviction metrics.
+    """
+
+    def __init__(self, memory, collection_names: List[str] = None, interval_seconds: float = 3600, logger: logging.Logger = None) -> None:
+        """
+        Initialize the RetentionManager.
+
+        :param memory: The memory whose collections are managed. Its retention_policy is enforced.
+        :type memory: Memory
+        :param collection_names: The collections to manage. Defaults to the memory's collection.
+        :type collection_names: List[str]
+        :param interval_seconds: Seconds between two background compactions. Defaults to 3600.
+        :type interval_seconds: float
+        """
+        assert memory.retention_policy is not None, "The memory has no retention policy"
+        self.memory = memory
+        self.policy = memory.retention_policy
+        self.collection_names = collection_names if collection_names is not None else [memory.collection_name]
+        self.interval_seconds = interval_seconds
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.stats: Dict[str, Dict[str, Any]] = {
+            name: {"size": None, "ttl_evictions": 0, "capacity_evictions": 0, "last_enforced": None} for name in self.collection_names
+        }
+        self.compactions = 0
+        self.last_compaction = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def expire(self, collection, now: float) -> int:
+        if self.policy.ttl_seconds is None:
+            return 0
+        expired = collection.get(where={CREATED_AT_KEY: {"$lt": now - self.policy.ttl_seconds}}, include=[])["ids"]
+        if len(expired) > 0:
+            collection.delete(ids=expired)
+        return len(expired)
+
+    def evict(self, collection) -> int:
+        if self.policy.max_items is None:
+            return 0
+        overflow = collection.count() - self.policy.max_items
+        if overflow <= 0:
+            return 0
+        entries = collection.get(include=["metadatas"])
+        if self.policy.eviction == "lru":
+            key = lambda entry: (entry[1].get(LAST_ACCESSED_KEY, 0), entry[1].get(CREATED_AT_KEY, 0))
+        else:
+            key = lambda entry: (entry[1].get(RETRIEVALS_KEY, 0), entry[1].get(LAST_ACCESSED_KEY, 0))
+        entries = sorted(zip(entries["ids"], [metadata or {} for metadata in entries["metadatas"]]), key=key)
+        evicted = [id for id, _ in entries[:overflow]]
+        collection.delete(ids=evicted)
+        return len(evicted)
+
+    def enforce(self) -> Dict[str, Dict[str, Any]]:
+        """
+        Apply the TTL and the capacity cap to every managed collection.
+
+        :return: The metrics after enforcement.
+        :rtype: Dict[str, Dict[str, Any]]
+        """
+        now = time.time()
+        for name in self.collection_names:
+            try:
+                collection = self.memory.get_collection(name, create=False)
+            except Exception:
+                continue
+            stats = self.stats[name]
+            # eviction orders by the access bookkeeping, so the buffered accesses are written first
+            get_access_log(self.memory.path).flush(name, collection)
+            expired = self.expire(collection, now)
+            evicted = self.evict(collection)
+            if expired + evicted > 0:
+                self.memory.invalidate_cache(name)
+            stats["ttl_evictions"] += expired
+            stats["capacity_evictions"] += evicted
+            stats["size"] = collection.count()
+            stats["last_enforced"] = now
+        return self.metrics()
+
+    def compact(self) -> None:
+        """
+        Reclaim the space freed by evictions: vacuum the Chroma SQLite file, or rewrite quantized re-ranking files.
+        VACUUM only shrinks the SQLite file holding the metadata and documents. Chroma's HNSW segment files mark
+        deleted vectors without rewriting the index, so disk_bytes barely drops after evicting from a Chroma
+        collection; those segments only shrink when the collection is rebuilt.
+        """
+        if self.memory.quantization is not None:
+            for name in self.collection_names:
+                try:
+                    self.memory.get_collection(name, create=False).compact()
+                except Exception:
+                    continue
+        else:
+            sqlite_path = os.path.join(self.memory.path, "chroma.sqlite3")
+            if os.path.exists(sqlite_path):
+                # the shared client holds the database open, it is reopened lazily on the next access
+                self.memory.close()
+                try:
+                    connection = sqlite3.connect(sqlite_path, timeout=30)
+                    connection.execute("VACUUM")
+                    connection.close()
+                except sqlite3.Error as e:
+                    self.logger.warning(f"Could not vacuum {sqlite_path}: {e}")
+                    return
+        self.compactions += 1
+        self.last_compaction = time.time()
+
+    def run_once(self) -> Dict[str, Dict[str, Any]]:
+        self.enforce()
+        self.compact()
+        metrics = self.metrics()
+        self.logger.info(f"Memory retention metrics: {metrics}")
+        return metrics
+
+    def metrics(self) -> Dict[str, Any]:
+        """
+        Get the size and eviction counts of every managed collection, and the store size on disk.
+        """
+        disk_bytes = 0
+        for root, _, files in os.walk(self.memory.path):
+            disk_bytes += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        return {
+            "collections": {name: dict(stats) for name, stats in self.stats.items()},
+            "compactions": self.compactions,
+            "last_compaction": self.last_compaction,
+            "disk_bytes": disk_bytes,
+        }
+
+    def start(self) -> None:
+        """
+        Start the background compaction thread.
+        """
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self._stop.clear()
+
+        def loop():
+            while not self._stop.wait(self.interval_seconds):
+                try:
+                    self.run_once()
+                except Exception as e:
+                    self.logger.error(f"Error enforcing memory retention: {e}")
+
+        self._thread = threading.Thread(target=loop, name="escargot-memory-retention", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Stop the background compaction thread.
+        """
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
@@ -6,63 +6,8 @@ import logging
 import os
 import pandas as pd
 import numpy as np
-
-def strip_answer_helper(text: str, tag: str = "") -> str:
-    """
-    Helper function to remove tags from a text.
-
-    :param text: The input text.
-    :type text: str
-    :param tag: The tag to be stripped. Defaults to "".
-    :type tag: str
-    :return: The stripped text.
-    :rtype: str
-    """
-
-    text = text.strip()
-    if "Output:" in text:
-        text = text[text.index("Output:") + len("Output:") :].strip()
-    if tag != "":
-        start = text.rfind(f"<{tag}>")
-        end = text.rfind(f"</{tag}>")
-        if start != -1 and end != -1:
-            text = text[start + len(f"<{tag}>") : end].strip()
-        elif start != -1:
-            logging.warning(
-                f"Only found the start tag <{tag}> in answer: {text}. Returning everything after the tag."
-            )
-            text = text[start + len(f"<{tag}>") :].strip()
-        elif end != -1:
-            logging.warning(
-                f"Only found the end tag </{tag}> in answer: {text}. Returning everything before the tag."
-            )
-            text = text[:end].strip()
-        else:
-            logging.warning(
-                f"Could not find any tag {tag} in answer: {text}. Returning the full answer."
-            )
-    return text
-
-#strip answer helper but returns all instances of the tag
-def strip_answer_helper_all(text: str, tag: str = "") -> str:
-    """
-    Helper function to remove tags from a text.
-
-    :param text: The input text.
-    :type text: str
-    :param tag: The tag to be stripped. Defaults to "".
-    :type tag: str
-    :return: The stripped text.
-    :rtype: str
-    """
-
-    text = text.strip()
-    #get all instances of the tag
-    start = [m.start() for m in re.finditer(f"<{tag}>", text)]
-    end = [m.start() for m in re.finditer(f"</{tag}>", text)]
-    # print(start)
-    # print(end)
-    return [text[text.index(f"<{tag}>", start[i]) + len(f"<{tag}>") : end[i]].strip() for i in range(len(start))]
+from escargot.preview import preview
+from escargot.parser.utils import strip_answer_helper, strip_answer_helper_all
 
 def parse_xml(xml_data, logger):
     # Parse the XML string
@@ -222,21 +167,20 @@ def retrieve_file_descriptions(user_message_id, step_limit = float('inf')):
             if hasattr(obj, 'shape'):
                 pickle_info['shape'] = obj.shape
             if hasattr(obj, 'keys'):
-                pickle_info['keys'] = obj.keys()
-                pickle_info['examples'] = str(obj)[:100]+'...'
+                pickle_info['keys'] = preview(obj.keys())
+                pickle_info['examples'] = preview(obj, 100)
                 # for key in obj.keys():
                 #     #stringity the values and put the first 100 characters in the description
                 #     pickle_info['examples'][key] = str(obj[key])[:100]+'...'
-            if hasattr(obj, 'describe'):
-                pickle_info['describe'] = obj.describe()
-            if hasattr(obj, 'info'):
-                pickle_info['info'] = obj.info()
+            if hasattr(obj, 'dtypes'):
+                #head, shape and dtypes only, describe() and info() scan the whole DataFrame
+                pickle_info['preview'] = preview(obj, 1024)
             if type(obj) == list:
                 pickle_info['length'] = len(obj)
-                pickle_info['peek inside'] = str(obj)[:100]+'...'
+                pickle_info['peek inside'] = preview(obj, 100)
             if type(obj) == str:
                 pickle_info['length'] = len(obj)
-                pickle_info['peek inside'] = obj
+                pickle_info['peek inside'] = preview(obj, 1024)
             file_descriptions.append(pickle_info)
 
     return file_descriptions
@@ -13,6 +13,12 @@ from escargot.language_models import AbstractLanguageModel
 from escargot.prompter import ESCARGOTPrompter
 from escargot.parser import ESCARGOTParser
 from escargot.coder import Coder
+from escargot.coder.coder import normalize_code
+from escargot.coder.liveness import analyze_code
+from escargot.parser.utils import PlanStreamParser
+from escargot.deadline import take_shortcut
+from escargot.operations.sampling import ASSESSMENT_TAGS, GENERATION_PHASES
+from escargot.operations.speculation import leading_candidate
 
 class OperationType(Enum):
     """
@@ -41,6 +47,15 @@ class Operation(ABC):
         self.successors: List[Operation] = []
         self.executed: bool = False
         self.coder = None
+        # prefetch steps of a plan while the plan is still being generated
+        self.early_start: bool = False
+        # reuse the plans of questions with the same template, or of similar questions
+        self.plan_cache = None
+        self.plan_library = None
+        # AdaptiveSampling of the branches of planning and assessment, None requests all branches at once
+        self.sampling = None
+        # Speculator that starts the phase after an assessment for the leading candidate
+        self.speculation = None
 
     def can_be_executed(self) -> bool:
         """
@@ -180,6 +195,26 @@ class Generate(Operation):
         prompts = []
         responses = []
         new_states = []
+        if base_state.get("phase") == "planning" and (base_state.get("input") is None or base_state.get("input") == ""):
+            plan = self.plan_cache.lookup(base_state["question"]) if self.plan_cache is not None else None
+            reused = {"plan_cache_hit": True}
+            if plan is None and self.plan_library is not None:
+                try:
+                    match = self.plan_library.lookup(base_state["question"])
+                except Exception as e:
+                    self.logger.warning("Could not look up similar questions: %s", e)
+                    match = None
+                if match is not None and match["reuse"]:
+                    plan = match["plan"]
+                    reused = {"plan_library_question": match["question"]}
+                elif match is not None:
+                    # plan from scratch, with the plan of the similar question as an example
+                    base_state = {**base_state, "plan_example": {"question": match["question"], "plan": match["plan"]["full_plan"]}}
+            if plan is not None:
+                # continue as if the plan had just been converted to XML
+                self.logger.info("Reusing the plan of a prior question: \n%s", plan["instructions"])
+                new_states.append({**base_state, **plan, **reused, "input": plan["full_code"], "previous_phase": "xml_conversion", "phase": "steps"})
+                return prompts, responses, new_states
         if len(self.thoughts) > 0 and self.thoughts[-1].state["phase"] == "output":
             temp_state = copy.deepcopy(base_state)
             temp_state["phase"] = "output"
@@ -188,7 +223,7 @@ class Generate(Operation):
             self.logger.debug("Prompt for LM: \n%s", prompts[-1])
         elif "StepID" in base_state and "instruction" in base_state and base_state["instruction"]["Code"] is not None:
             code = base_state["instruction"]["Code"][0]
-            new_code, compiled = self.coder.execute_code(code, base_state["instruction"]["Instruction"], base_state["StepID"], prompter, self.logger, base_state["full_code"])
+            new_code, compiled = self.coder.execute_code(code, base_state["instruction"]["Instruction"], base_state["StepID"], prompter, self.logger, base_state["full_code"], base_state["instructions"])
             new_state  = {**base_state, "input": new_code, "compiled": compiled}
             new_state["instructions"][int(base_state["StepID"])-1]['Code'] = [new_code]
             new_states.append(new_state)
@@ -196,6 +231,22 @@ class Generate(Operation):
             self.logger.info("Compiled: %s", compiled)
             
             return prompts, responses, new_states
+        elif self.sampling is not None and self.sampling.unanimous(base_state.get("phase"), base_state.get("input")):
+            # every candidate is the same, there is nothing to assess
+            self.logger.info("Skipping %s, all candidates agree", base_state["phase"])
+            new_state = parser.parse_generate_answer(base_state, "")
+            new_state["scores"] = [1] * len(base_state["input"])
+            new_states.append(new_state)
+            self.sampling.record(base_state["phase"], self.num_branches_response, 0, 0, True)
+        elif base_state.get("phase") in ASSESSMENT_TAGS and base_state.get("input") and take_shortcut("skip_assessment", base_state["phase"]):
+            # no time left to assess the candidates: keep the leading candidate
+            self.logger.info("Skipping %s, keeping the leading candidate", base_state["phase"])
+            if not isinstance(base_state["input"], list):
+                base_state = {**base_state, "input": [base_state["input"]]}
+            leader = leading_candidate(base_state["input"])
+            new_state = parser.parse_generate_answer(base_state, "")
+            new_state["scores"] = [int(i == leader) for i in range(len(base_state["input"]))]
+            new_states.append(new_state)
         else:
             prompts.append(prompter.generate_prompt( **base_state))
         for prompt in prompts:
@@ -204,14 +255,28 @@ class Generate(Operation):
                 return prompt, []
             self.logger.debug("Prompt for LM: %s", prompt)
             
+            num_responses = self.num_branches_response
+            if num_responses > 1 and base_state.get("phase") in GENERATION_PHASES and take_shortcut("fewer_branches", base_state["phase"]):
+                num_responses = 1
             tries = 0
             while tries < 3:
                 try:
                     new_states = []
                     responses = []
-                    lm_responses =lm.get_response_texts(
-                        lm.query(prompt, num_responses=self.num_branches_response)
-                    )
+                    lm_responses = self.speculation.take(prompt, num_responses) if self.speculation is not None else None
+                    if lm_responses is not None:
+                        pass
+                    elif self.early_start and base_state.get("phase") == "xml_conversion" and num_responses == 1 and hasattr(lm, "stream_query"):
+                        lm_responses = [self.stream_plan(lm, prompt, prompter, parser, base_state)]
+                    else:
+                        if self.speculation is not None:
+                            self.speculation.speculate(lm, prompter, base_state)
+                        if self.sampling is not None and num_responses > 1 and self.sampling.adapts(base_state.get("phase")):
+                            lm_responses = self.sampling.sample(lm, prompt, base_state["phase"], num_responses)
+                        else:
+                            lm_responses =lm.get_response_texts(
+                                lm.query(prompt, num_responses=num_responses)
+                            )
                     for response in lm_responses:
                         responses.append(response)
                         if len(self.thoughts) > 0 and self.thoughts[-1].state["phase"] == "output":
@@ -221,6 +286,8 @@ class Generate(Operation):
                         new_states.append(new_state)
                         self.logger.debug("Response from LM: %s", response)
                     break
+                except TimeoutError:
+                    raise
                 except Exception as e:
                     self.logger.warning("Error in LM: %s, trying again with prompt: %s", e, prompt)
                     tries += 1
@@ -236,6 +303,7 @@ class Generate(Operation):
             new_states = [new_states[0]]
             new_states[0]["input"] = base_state["input"][highest_score_index]
             new_states[0]["scores"] = sum_scores
+            new_states[0]["assessment_scores"] = {**base_state.get("assessment_scores", {}), base_state["phase"]: sum_scores[highest_score_index]}
             if "full_plan" not in new_states[0] and (new_states[0]["phase"] == "python_conversion" or new_states[0]["phase"] == "plan_multihop"):
                 new_states[0]["full_plan"] = new_states[0]["input"]
                 self.logger.warning("Strategy:\n%s", new_states[0]["input"])
@@ -244,6 +312,51 @@ class Generate(Operation):
         
         return prompts, responses, new_states
 
+    def stream_plan(self, lm: AbstractLanguageModel, prompt: str, prompter: ESCARGOTPrompter, parser: ESCARGOTParser, base_state: Dict) -> str:
+        """
+        Streams the XML plan and prefetches its leading steps as soon as they are complete. A step is prefetched
+        while it reads no variable written by the steps before it; the first step that does ends the prefetching.
+
+        :param lm: The language model, which has to implement stream_query.
+        :type lm: AbstractLanguageModel
+        :param prompt: The xml_conversion prompt.
+        :type prompt: str
+        :param prompter: The prompter used by the prefetched steps to extract knowledge.
+        :type prompter: ESCARGOTPrompter
+        :param parser: The parser, handed the steps and edges parsed from the stream so the plan is not parsed again.
+        :type parser: ESCARGOTParser
+        :param base_state: The state of the xml_conversion phase.
+        :type base_state: Dict
+        :return: The full response text.
+        :rtype: str
+        """
+        stream_parser = PlanStreamParser(self.logger)
+        chunks = []
+        written = set()
+        prefetching = self.coder is not None
+        complete = False
+        try:
+            for chunk in lm.stream_query(prompt):
+                chunks.append(chunk)
+                for kind, step in stream_parser.feed(chunk):
+                    if kind != "step" or not prefetching:
+                        continue
+                    code = step["Code"][0] if step.get("Code") else None
+                    analysis = analyze_code(normalize_code(code)) if code else None
+                    if analysis is None or len(analysis[0] & written) > 0:
+                        prefetching = False
+                        continue
+                    written |= analysis[1]
+                    # a step with side effects is not prefetched, and the steps after it may depend on them
+                    if self.coder.prefetch(step["StepID"], code, step["Instruction"], prompter, self.logger, base_state.get("full_code", "")) is None:
+                        prefetching = False
+            complete = True
+        finally:
+            steps, edges = stream_parser.close()
+        if complete and steps:
+            parser.parsed_plans["".join(chunks)] = (steps, edges)
+        return "".join(chunks)
+
     def _execute(
         self, lm: AbstractLanguageModel, prompter: ESCARGOTPrompter, parser: ESCARGOTParser, got_steps: Dict, **kwargs
     ) -> None:
@@ -0,0 +1,139 @@
+from __future__ import annotations
+import ast
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Union
+
+from escargot.parser.utils import nested_spans
+
+# phases that generate candidates, and phases that score them with the tag holding each candidate's score
+GENERATION_PHASES = ("planning", "python_conversion")
+ASSESSMENT_TAGS = {"plan_assessment": "Approach", "code_assessment": "Code"}
+
+
+def normalize_candidate(phase: str, text: str) -> str:
+    """
+    Normalize a candidate so equivalent candidates compare equal: code by its syntax tree, plans by their words.
+    """
+    if phase == "python_conversion":
+        code = text.replace("```python", "").replace("```", "")
+        try:
+            return ast.dump(ast.parse(code))
+        except SyntaxError:
+            pass
+    return " ".join(text.lower().split())
+
+
+def response_scores(phase: str, text: str) -> Optional[List[int]]:
+    try:
+        return [int(text[span[0]:span[1]]) for span in nested_spans(text, ASSESSMENT_TAGS[phase], "Score")]
+    except (TypeError, ValueError):
+        return None
+
+
+class AdaptiveSampling:
+    """
+    AdaptiveSampling requests the branches of the planning, conversion and assessment phases incrementally,
+    and stops once the responses agree: identical candidates, or assessments that pick the same winner.
+    Easy questions then cost min_branches completions per phase, hard ones keep the full ensemble.
+    """
+
+    def __init__(self, min_branches: Union[int, Dict[str, int]] = 2, max_branches: Union[int, Dict[str, int]] = None, agreement: float = 1.0) -> None:
+        """
+        Initialize the AdaptiveSampling.
+
+        :param min_branches: Number of responses requested before checking for agreement, overall or per phase. Defaults to 2.
+        :type min_branches: Union[int, Dict[str, int]]
+        :param max_branches: Maximum number of responses, overall or per phase. Defaults to None (the number the phase requests).
+        :type max_branches: Union[int, Dict[str, int]]
+        :param agreement: Share of the responses that have to agree to stop. Defaults to 1.0 (all of them).
+        :type agreement: float
+        """
+        self.min_branches = min_branches
+        self.max_branches = max_branches
+        self.agreement = agreement
+        self.lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, int]] = {}
+
+    def adapts(self, phase: str) -> bool:
+        return phase in GENERATION_PHASES or phase in ASSESSMENT_TAGS
+
+    def limits(self, phase: str, requested: int):
+        """
+        Get the minimum and maximum number of responses of a phase.
+        """
+        minimum = self.min_branches.get(phase, requested) if isinstance(self.min_branches, dict) else self.min_branches
+        maximum = self.max_branches.get(phase, requested) if isinstance(self.max_branches, dict) else self.max_branches
+        maximum = requested if maximum is None else maximum
+        return max(1, min(minimum, maximum)), maximum
+
+    def agree(self, phase: str, responses: List[str]) -> bool:
+        """
+        Check whether enough of the responses agree to stop sampling.
+        """
+        if phase in ASSESSMENT_TAGS:
+            scores = [response_scores(phase, response) for response in responses]
+            scores = [score for score in scores if score]
+            if len(scores) == 0 or any(len(score) != len(scores[0]) for score in scores):
+                return False
+            totals = [sum(column) for column in zip(*scores)]
+            leader = totals.index(max(totals))
+            votes = sum(1 for score in scores if score.index(max(score)) == leader)
+            return votes / len(responses) >= self.agreement
+        if len(responses) == 0:
+            return False
+        candidates = Counter(normalize_candidate(phase, response) for response in responses)
+        return candidates.most_common(1)[0][1] / len(responses) >= self.agreement
+
+    def unanimous(self, phase: str, candidates: List[str]) -> bool:
+        """
+        Check whether the candidates an assessment phase has to score are all equivalent, so the assessment can be skipped.
+        """
+        generation_phase = {"plan_assessment": "planning", "code_assessment": "python_conversion"}.get(phase)
+        if generation_phase is None or not isinstance(candidates, list) or len(candidates) == 0:
+            return False
+        return len(set(normalize_candidate(generation_phase, candidate) for candidate in candidates)) == 1
+
+    def sample(self, lm, prompt: str, phase: str, requested: int) -> List[str]:
+        """
+        Query the language model for the responses of a phase, min_branches at once and then one at a time until they agree.
+        The further samples bypass the response cache, which would return the first response again.
+
+        :param lm: The language model.
+        :type lm: AbstractLanguageModel
+        :param prompt: The prompt.
+        :type prompt: str
+        :param phase: The phase of the prompt.
+        :type phase: str
+        :param requested: The number of responses the phase requests.
+        :type requested: int
+        :return: The response texts.
+        :rtype: List[str]
+        """
+        minimum, maximum = self.limits(phase, requested)
+        responses = []
+        calls = 0
+        count = minimum
+        while True:
+            if calls == 0:
+                new_responses = lm.get_response_texts(lm.query(prompt, num_responses=count))
+            else:
+                new_responses = lm.get_response_texts(lm.query(prompt, num_responses=count, use_cache=False))
+            responses += new_responses
+            calls += 1
+            # a model that returns nothing more would be asked forever
+            if len(new_responses) == 0 or len(responses) >= maximum or self.agree(phase, responses):
+                break
+            count = 1
+        self.record(phase, requested, len(responses), calls, len(responses) < maximum)
+        return responses[:maximum]
+
+    def record(self, phase: str, requested: int, completions: int, calls: int, stopped_early: bool) -> None:
+        with self.lock:
+            stats = self.stats.setdefault(phase, {"prompts": 0, "requested": 0, "completions": 0, "calls": 0, "early_stops": 0, "skipped": 0})
+            stats["prompts"] += 1
+            stats["requested"] += requested
+            stats["completions"] += completions
+            stats["calls"] += calls
+            stats["early_stops"] += int(stopped_early)
+            stats["skipped"] += int(completions == 0)
@@ -0,0 +1,125 @@
+from __future__ import annotations
+import contextvars
+import logging
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+# the phase that follows each assessment, and the number of responses it requests
+NEXT_PHASES = {"plan_assessment": ("python_conversion", 3), "code_assessment": ("xml_conversion", 1)}
+WORD = re.compile(r"\w+")
+
+
+def leading_candidate(candidates: List[str]) -> int:
+    """
+    Guess the candidate an assessment will pick without a language model: the one closest to the others,
+    by the Jaccard similarity of their words. Ties go to the earliest candidate.
+
+    :param candidates: The candidates to be assessed.
+    :type candidates: List[str]
+    :return: The index of the leading candidate.
+    :rtype: int
+    """
+    words = [set(WORD.findall(candidate.lower())) for candidate in candidates]
+    best, best_score = 0, -1.0
+    for i, candidate_words in enumerate(words):
+        score = 0.0
+        for j, other_words in enumerate(words):
+            if i != j and len(candidate_words | other_words) > 0:
+                score += len(candidate_words & other_words) / len(candidate_words | other_words)
+        if score > best_score:
+            best, best_score = i, score
+    return best
+
+
+class Speculator:
+    """
+    Speculator starts the phase that follows an assessment for the leading candidate while the assessment
+    is still running. The responses are kept under their prompt, so the next phase reuses them only if the
+    assessment picked that candidate, and discards them otherwise.
+    """
+
+    def __init__(self, max_workers: int = 2, logger: logging.Logger = None) -> None:
+        """
+        Initialize the Speculator.
+
+        :param max_workers: Number of speculative requests running at once. Defaults to 2.
+        :type max_workers: int
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.pending: Dict[str, Tuple[int, Future]] = {}
+        self.lock = threading.Lock()
+        self.speculated = 0
+        self.hits = 0
+        self.misses = 0
+
+    def speculate(self, lm, prompter, base_state: Dict) -> None:
+        """
+        Start the next phase of an assessment state for its leading candidate.
+
+        :param lm: The language model.
+        :type lm: AbstractLanguageModel
+        :param prompter: The prompter that builds the prompt of the next phase.
+        :type prompter: ESCARGOTPrompter
+        :param base_state: The state of the assessment phase.
+        :type base_state: Dict
+        """
+        if base_state.get("phase") not in NEXT_PHASES or not isinstance(base_state.get("input"), list) or len(base_state["input"]) < 2:
+            return
+        next_phase, num_responses = NEXT_PHASES[base_state["phase"]]
+        candidate = base_state["input"][leading_candidate(base_state["input"])]
+        try:
+            prompt = prompter.generate_prompt(**{**base_state, "phase": next_phase, "input": candidate})
+        except Exception as e:
+            self.logger.debug(f"Could not build the speculative {next_phase} prompt: {e}")
+            return
+        if not prompt:
+            return
+        with self.lock:
+            if prompt in self.pending:
+                return
+            future = self.executor.submit(contextvars.copy_context().run, lambda: lm.get_response_texts(lm.query(prompt, num_responses=num_responses)))
+            self.pending[prompt] = (num_responses, future)
+            self.speculated += 1
+        self.logger.info(f"Speculatively started {next_phase} for the leading candidate")
+
+    def take(self, prompt: str, num_responses: int) -> Optional[List[str]]:
+        """
+        Get the speculative responses of a prompt, waiting for them if they are still being generated.
+        Speculations of other prompts are discarded, as the assessment they raced with is over.
+
+        :param prompt: The prompt about to be sent.
+        :type prompt: str
+        :param num_responses: The number of responses needed.
+        :type num_responses: int
+        :return: The responses, or None if the prompt was not speculated.
+        :rtype: Optional[List[str]]
+        """
+        with self.lock:
+            if len(self.pending) == 0:
+                return None
+            speculation = self.pending.pop(prompt, None)
+        self.discard()
+        if speculation is None or speculation[0] < num_responses:
+            self.misses += 1
+            return None
+        try:
+            responses = speculation[1].result()
+        except Exception as e:
+            self.logger.warning(f"Speculative request failed, querying again: {e}")
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.logger.info("Using the speculative responses, the leading candidate won")
+        return responses[:num_responses]
+
+    def discard(self) -> None:
+        """
+        Discard every pending speculation. Requests that already run finish in the background and their results are dropped.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for _, future in pending.values():
+            future.cancel()
@@ -0,0 +1,72 @@
+"""
+Micro-benchmark of the assessment parsing helpers.
+
+Run with: python -m escargot.parser.benchmark
+"""
+import logging
+import re
+import timeit
+import tracemalloc
+
+from escargot.parser.utils import nested_spans, strip_answer_helper_all
+
+
+def previous_strip_answer_helper(text: str, tag: str = "") -> str:
+    text = text.strip()
+    if "Output:" in text:
+        text = text[text.index("Output:") + len("Output:") :].strip()
+    if tag != "":
+        start = text.rfind(f"<{tag}>")
+        end = text.rfind(f"</{tag}>")
+        if start != -1 and end != -1:
+            text = text[start + len(f"<{tag}>") : end].strip()
+        elif start != -1:
+            text = text[start + len(f"<{tag}>") :].strip()
+        elif end != -1:
+            text = text[:end].strip()
+    return text
+
+
+def previous_strip_answer_helper_all(text: str, tag: str = "") -> list:
+    text = text.strip()
+    start = [m.start() for m in re.finditer(f"<{tag}>", text)]
+    end = [m.start() for m in re.finditer(f"</{tag}>", text)]
+    return [text[text.index(f"<{tag}>", start[i]) + len(f"<{tag}>") : end[i]].strip() for i in range(len(start))]
+
+
+def assessment_response(num_approaches: int, approach_chars: int = 400) -> str:
+    body = ("The approach queries the knowledge graph for the genes associated with the disease. " * (approach_chars // 85 + 1))[:approach_chars]
+    return "\n".join(f"<Approach>\n<ApproachID>{i}</ApproachID>\n{body}\n<Score>{i % 10}</Score>\n</Approach>" for i in range(num_approaches))
+
+
+def previous_scores(text: str) -> list:
+    return [int(previous_strip_answer_helper(approach, "Score")) for approach in previous_strip_answer_helper_all(text, "Approach")]
+
+
+def scores(text: str) -> list:
+    return [int(text[span[0]:span[1]]) for span in nested_spans(text, "Approach", "Score")]
+
+
+def peak_kb(function, text: str) -> float:
+    tracemalloc.start()
+    function(text)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak / 1024
+
+
+def run(sizes=(3, 30, 300, 3000), repeat: int = 5) -> None:
+    logging.getLogger().setLevel(logging.ERROR)
+    print(f"{'approaches':>10} {'chars':>10} {'previous ms':>12} {'scan ms':>10} {'speedup':>8} {'previous KB':>12} {'scan KB':>10}")
+    for size in sizes:
+        text = assessment_response(size)
+        assert scores(text) == previous_scores(text)
+        assert strip_answer_helper_all(text, "Approach") == previous_strip_answer_helper_all(text, "Approach")
+        number = max(1, 3000 // size)
+        previous = min(timeit.repeat(lambda: previous_scores(text), number=number, repeat=repeat)) / number
+        current = min(timeit.repeat(lambda: scores(text), number=number, repeat=repeat)) / number
+        print(f"{size:>10} {len(text):>10} {previous * 1000:>12.3f} {current * 1000:>10.3f} {previous / current:>7.1f}x {peak_kb(previous_scores, text):>12.1f} {peak_kb(scores, text):>10.1f}")
+
+
+if __name__ == "__main__":
+    run()
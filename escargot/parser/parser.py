@@ -2,7 +2,7 @@ from __future__ import annotations
 from abc import ABC, abstractmethod
 from typing import Dict, List, Union
 import logging
-from .utils import strip_answer_helper, strip_answer_helper_all, parse_xml
+from .utils import strip_answer_helper, strip_answer_helper_all, nested_spans, parse_xml
 
 
 class ESCARGOTParser:
@@ -18,6 +18,8 @@ class ESCARGOTParser:
         Inits the response cache.
         """
         self.cache = {}
+        # steps and edges of plans already parsed while they were streamed, keyed by the plan text
+        self.parsed_plans = {}
         self.logger = logger
 
     def parse_generate_answer(self, state: Dict, texts: List[str]) -> List[Dict]:
@@ -52,10 +54,9 @@ class ESCARGOTParser:
                         #convert text to json and select from the input the top strategy
                         scores = []
                         try:
-                            text = strip_answer_helper_all(text, "Approach")
                             #get all the scores
-                            for i in text:
-                                scores.append(int(strip_answer_helper(i,"Score")))
+                            for span in nested_spans(text, "Approach", "Score"):
+                                scores.append(int(text[span[0]:span[1]]))
                             new_state["scores"] = scores
                         except Exception as e:
                             self.logger.warning(f"Could not convert text to xml: {text}. Encountered exception: {e}")
@@ -77,9 +78,8 @@ class ESCARGOTParser:
                         new_state = state.copy()
                         scores = []
                         try:
-                            text = strip_answer_helper_all(text, "Code")
-                            for i in text:
-                                scores.append(int(strip_answer_helper(i,"Score")))
+                            for span in nested_spans(text, "Code", "Score"):
+                                scores.append(int(text[span[0]:span[1]]))
                             new_state["scores"] = scores
                             # get the highest score and the approach
                             # approach = max(text, key=lambda x: int(strip_answer_helper(x,"Score")))
@@ -101,7 +101,7 @@ class ESCARGOTParser:
                         # new_state["generate_successors"] = 1
                         new_state["previous_phase"] = "xml_conversion"
                         new_state["phase"] = "steps"
-                        instructions, edges = parse_xml(text, self.logger)
+                        instructions, edges = self.parsed_plans.pop(text, None) or parse_xml(text, self.logger)
                         new_state["instructions"] = instructions
                         new_state["edges"] = edges
                         self.logger.info("Got instructions: \n%s",instructions)
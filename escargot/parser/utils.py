@@ -1,9 +1,90 @@
 import re
 import logging
 import json
+from typing import Dict, List, Optional, Tuple
 import xml.etree.ElementTree as ET
 import logging
 
+def strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    """
+    Narrow a span of the text to exclude leading and trailing whitespace, without copying the text.
+    """
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+def excerpt(text: str, start: int = 0, end: int = None, limit: int = 200) -> str:
+    end = len(text) if end is None else end
+    return text[start:min(end, start + limit)] + ("..." if end - start > limit else "")
+
+
+def tag_spans(text: str, tag: str, start: int = 0, end: int = None) -> List[Tuple[int, int]]:
+    """
+    Find the content of every instance of a tag in one pass over the text, without copying it.
+    Each opening tag is paired with the next closing tag, an opening tag without a closing tag spans to the end.
+
+    :param text: The input text.
+    :type text: str
+    :param tag: The name of the tag.
+    :type tag: str
+    :param start: Where to start scanning. Defaults to 0.
+    :type start: int
+    :param end: Where to stop scanning. Defaults to None (the end of the text).
+    :type end: int
+    :return: The stripped (start, end) spans of the content.
+    :rtype: List[Tuple[int, int]]
+    """
+    end = len(text) if end is None else end
+    open_tag = f"<{tag}>"
+    close_tag = f"</{tag}>"
+    spans = []
+    position = text.find(open_tag, start, end)
+    while position != -1:
+        content_start = position + len(open_tag)
+        content_end = text.find(close_tag, content_start, end)
+        if content_end == -1:
+            content_end = end
+        spans.append(strip_span(text, content_start, content_end))
+        position = text.find(open_tag, content_end, end)
+    return spans
+
+
+def last_tag_span(text: str, tag: str, start: int = 0, end: int = None) -> Optional[Tuple[int, int]]:
+    """
+    Find the content of the last instance of a tag between start and end, e.g. the Score of an Approach.
+
+    :return: The stripped (start, end) span of the content, or None if the tag is not complete.
+    :rtype: Optional[Tuple[int, int]]
+    """
+    end = len(text) if end is None else end
+    content_end = text.rfind(f"</{tag}>", start, end)
+    if content_end == -1:
+        return None
+    content_start = text.rfind(f"<{tag}>", start, content_end)
+    if content_start == -1:
+        return None
+    return strip_span(text, content_start + len(tag) + 2, content_end)
+
+
+def nested_spans(text: str, outer: str, inner: str) -> List[Optional[Tuple[int, int]]]:
+    """
+    Find the last inner tag of each outer tag in one pass, e.g. the Score of each Approach.
+
+    :param text: The input text.
+    :type text: str
+    :param outer: The enclosing tag.
+    :type outer: str
+    :param inner: The nested tag.
+    :type inner: str
+    :return: The stripped span of the inner tag of each outer tag, or None where the outer tag has none.
+    :rtype: List[Optional[Tuple[int, int]]]
+    """
+    return [last_tag_span(text, inner, start, end) for start, end in tag_spans(text, outer)]
+
+
 def strip_answer_helper(text: str, tag: str = "") -> str:
     """
     Helper function to remove tags from a text.
@@ -16,32 +97,29 @@ def strip_answer_helper(text: str, tag: str = "") -> str:
     :rtype: str
     """
 
-    text = text.strip()
-    if "Output:" in text:
-        text = text[text.index("Output:") + len("Output:") :].strip()
+    begin, end = strip_span(text, 0, len(text))
+    output = text.find("Output:", begin, end)
+    if output != -1:
+        begin, end = strip_span(text, output + len("Output:"), end)
     if tag != "":
-        start = text.rfind(f"<{tag}>")
-        end = text.rfind(f"</{tag}>")
-        if start != -1 and end != -1:
-            text = text[start + len(f"<{tag}>") : end].strip()
+        start = text.rfind(f"<{tag}>", begin, end)
+        close = text.rfind(f"</{tag}>", begin, end)
+        if start != -1:
+            start += len(tag) + 2
+        if start != -1 and close != -1:
+            begin, end = strip_span(text, start, max(close, start))
         elif start != -1:
-            logging.warning(
-                f"Only found the start tag <{tag}> in answer: {text}. Returning everything after the tag."
-            )
-            text = text[start + len(f"<{tag}>") :].strip()
-        elif end != -1:
-            logging.warning(
-                f"Only found the end tag </{tag}> in answer: {text}. Returning everything before the tag."
-            )
-            text = text[:end].strip()
+            logging.warning("Only found the start tag <%s> in answer: %s. Returning everything after the tag.", tag, excerpt(text, begin, end))
+            begin, end = strip_span(text, start, end)
+        elif close != -1:
+            logging.warning("Only found the end tag </%s> in answer: %s. Returning everything before the tag.", tag, excerpt(text, begin, end))
+            begin, end = strip_span(text, begin, close)
         else:
-            logging.warning(
-                f"Could not find any tag {tag} in answer: {text}. Returning the full answer."
-            )
-    return text
+            logging.warning("Could not find any tag %s in answer: %s. Returning the full answer.", tag, excerpt(text, begin, end))
+    return text[begin:end]
 
 #strip answer helper but returns all instances of the tag
-def strip_answer_helper_all(text: str, tag: str = "") -> str:
+def strip_answer_helper_all(text: str, tag: str = "") -> List[str]:
     """
     Helper function to remove tags from a text.
 
@@ -49,17 +127,123 @@ def strip_answer_helper_all(text: str, tag: str = "") -> str:
     :type text: str
     :param tag: The tag to be stripped. Defaults to "".
     :type tag: str
-    :return: The stripped text.
-    :rtype: str
+    :return: The stripped content of every instance of the tag.
+    :rtype: List[str]
     """
 
-    text = text.strip()
-    #get all instances of the tag
-    start = [m.start() for m in re.finditer(f"<{tag}>", text)]
-    end = [m.start() for m in re.finditer(f"</{tag}>", text)]
-    # print(start)
-    # print(end)
-    return [text[text.index(f"<{tag}>", start[i]) + len(f"<{tag}>") : end[i]].strip() for i in range(len(start))]
+    return [text[start:end] for start, end in tag_spans(text, tag)]
+
+def get_step(step):
+    step_id = step.find('StepID').text
+    instruction = step.find('Instruction')
+
+    if step is None:
+        return None  # Handle cases where there's no instruction element
+    
+    # Initialize empty lists to store information
+    codes = []
+    for info in step.findall('Code'):
+        code_text = info.text.strip()
+        if code_text:
+            #unescape the code
+            code_text = code_text.replace("&amp;", "&")
+        codes.append(code_text)
+
+    # Return a list with relevant information (adjust as needed)
+    return {
+        "StepID": step_id,
+        "Instruction": instruction.text.strip() if instruction.text else "",
+        "Code": codes
+    }
+
+# removed from the plan before parsing, as in parse_xml
+PLAN_MARKERS = re.compile(r"<\?xml version=\"1.0\" encoding=\"UTF-8\"\?>|```xml|```|</?Root>")
+PLAN_MARKER_PREFIXES = ['<?xml version="1.0" encoding="UTF-8"?>', "```xml", "<Root>", "</Root>"]
+
+class PlanStreamParser:
+    """
+    PlanStreamParser parses the XML plan while it is being generated. Chunks of the completion are fed
+    as they arrive, and every <Step> and <Edge> is returned as soon as its closing tag has been read.
+    """
+
+    def __init__(self, logger: logging.Logger = None) -> None:
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.parser = ET.XMLPullParser(events=("start", "end"))
+        self.parser.feed("<Root>")
+        self.pending = ""
+        self.stack = []
+        self.steps = []
+        self.edges = []
+        self.failed = False
+
+    def clean(self, final: bool = False) -> str:
+        # keep a trailing partial marker (e.g. "``" or "<Ro") until the next chunk completes it
+        end = len(self.pending)
+        if not final:
+            for i in range(max(0, end - len(PLAN_MARKER_PREFIXES[0])), end):
+                tail = self.pending[i:]
+                if any(marker.startswith(tail) for marker in PLAN_MARKER_PREFIXES):
+                    end = i
+                    break
+        text, self.pending = self.pending[:end], self.pending[end:]
+        return PLAN_MARKERS.sub("", text).replace("&", "&amp;")
+
+    def events(self):
+        parsed = []
+        for event, element in self.parser.read_events():
+            if event == "start":
+                self.stack.append(element.tag)
+                continue
+            self.stack.pop()
+            parent = self.stack[-1] if len(self.stack) > 0 else None
+            if element.tag == "Step" and parent == "Instructions":
+                step = get_step(element)
+                self.steps.append(step)
+                parsed.append(("step", step))
+            elif element.tag == "Edge" and parent == "EdgeList":
+                edge = element.text.replace("\n","").strip() if element.text else ""
+                self.edges.append(edge)
+                parsed.append(("edge", edge))
+        return parsed
+
+    def feed(self, chunk: str) -> list:
+        """
+        Feed the next chunk of the completion.
+
+        :param chunk: The text generated since the previous chunk.
+        :type chunk: str
+        :return: The ("step", step) and ("edge", edge) pairs completed by this chunk.
+        :rtype: list
+        """
+        if self.failed:
+            return []
+        self.pending += chunk
+        try:
+            self.parser.feed(self.clean())
+            return self.events()
+        except Exception as e:
+            self.logger.warning(f"Could not parse the plan incrementally, waiting for the complete plan: {e}")
+            self.failed = True
+            return []
+
+    def close(self):
+        """
+        Finish parsing once the completion is complete.
+
+        :return: The steps and the edges, or None, None if the plan is not valid XML.
+        :rtype: Tuple[List[Dict], List[str]]
+        """
+        if self.failed:
+            return None, None
+        try:
+            self.parser.feed(self.clean(final=True) + "</Root>")
+            self.events()
+            self.parser.close()
+        except Exception as e:
+            self.logger.warning(f"Could not parse the streamed plan: {e}")
+            self.failed = True
+            return None, None
+        return self.steps, self.edges
 
 def parse_xml(xml_data, logger):
     # Parse the XML string
@@ -81,29 +265,6 @@ def parse_xml(xml_data, logger):
         logger.error(f"Could not parse XML data: {xml_data}. Encountered exception: {e}")
         return None, None
 
-    def get_step(step):
-        step_id = step.find('StepID').text
-        instruction = step.find('Instruction')
-
-        if step is None:
-            return None  # Handle cases where there's no instruction element
-        
-        # Initialize empty lists to store information
-        codes = []
-        for info in step.findall('Code'):
-            code_text = info.text.strip()
-            if code_text:
-                #unescape the code
-                code_text = code_text.replace("&amp;", "&")
-            codes.append(code_text)
-
-        # Return a list with relevant information (adjust as needed)
-        return {
-            "StepID": step_id,
-            "Instruction": instruction.text.strip() if instruction.text else "",
-            "Code": codes
-        }
-
     # print('xml_data:',xml_data.split("\n"))
     # Extract and print details for each step
     instructions = root.find('Instructions').findall('Step')
@@ -0,0 +1,264 @@
+from __future__ import annotations
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+# numbered options of multiple choice questions, e.g. "? 1. CAD 2. PDS5B"
+OPTIONS_START = re.compile(r"(?:^|\s)1\.\s")
+OPTION = re.compile(r"(\d+)\.\s+(.+?)(?=\s+\d+\.\s|\s*$)")
+TOKEN = re.compile(r"\S+")
+# a name following its node type runs to the end of the question or the next "and", e.g. "the pathway Formation of the cornified envelope?"
+TYPED_ENTITY = re.compile(
+    r"\bthe (?:drugs?|genes?|diseases?|pathways?|symptoms?|classes|class|body parts?|biological process(?:es)?|molecular functions?|cellular components?)"
+    r" (?!expression\b|which\b|that\b|of\b|commonly\b|are\b|is\b)(.+?)(?=\s*\?|\s+and\s|$)"
+)
+# quoted names, e.g. the process "cell adhesion"
+QUOTED_ENTITY = re.compile(r"\"([^\"]+)\"|\u201c([^\u201d]+)\u201d|(?<!\w)'([^']+)'(?!\w)")
+TOKEN_PUNCTUATION = "?!:;,.\"'()[]{}"
+PLACEHOLDER = "⟦{}{}⟧"
+PLACEHOLDER_PATTERN = re.compile("⟦([El])(\\d+)⟧")
+
+
+def is_identifier(token: str) -> bool:
+    """
+    Whether a token looks like an identifier: letters mixed with digits (TOMM5, IL1R2, rs123) or several
+    capitals (CAD, FAD). Capitalized words are not, as most of them are ordinary words of the question.
+    """
+    if not any(character.isalpha() for character in token):
+        return False
+    return any(character.isdigit() for character in token) or sum(character.isupper() for character in token) >= 2
+
+
+def vocabulary_pattern(names) -> Optional[re.Pattern]:
+    """
+    Compile the known entity names (e.g. the node names of the knowledge graph) into a pattern matching
+    them case-insensitively as whole words, longer names first.
+
+    :param names: The entity names.
+    :type names: Iterable[str]
+    :return: The pattern, or None if there are no names.
+    :rtype: Optional[re.Pattern]
+    """
+    names = sorted({name.strip() for name in names if name and name.strip()}, key=len, reverse=True)
+    if len(names) == 0:
+        return None
+    return re.compile(r"(?<!\w)(?:" + "|".join(re.escape(name) for name in names) + r")(?!\w)", re.IGNORECASE)
+
+
+def entity_spans(question: str, vocabulary: Optional[re.Pattern] = None) -> List[Tuple[int, int]]:
+    """
+    Find the entity mentions of a question: the options of a multiple choice question, and in the stem the
+    names following their node type, quoted names, names of the vocabulary and identifier-like tokens.
+
+    :param question: The question.
+    :type question: str
+    :param vocabulary: Pattern of the known entity names, see vocabulary_pattern. Defaults to None.
+    :type vocabulary: Optional[re.Pattern]
+    :return: The (start, end) spans of the mentions, in order.
+    :rtype: List[Tuple[int, int]]
+    """
+    options = OPTIONS_START.search(question)
+    stem_end = options.start() if options is not None else len(question)
+    candidates = [match.span(1) for match in TYPED_ENTITY.finditer(question, 0, stem_end)]
+    for match in QUOTED_ENTITY.finditer(question, 0, stem_end):
+        group = next(i for i in (1, 2, 3) if match.group(i) is not None)
+        candidates.append(match.span(group))
+    if vocabulary is not None:
+        candidates.extend(match.span() for match in vocabulary.finditer(question, 0, stem_end))
+    for match in TOKEN.finditer(question, 0, stem_end):
+        start, end = match.start(), match.end()
+        while start < end and question[start] in TOKEN_PUNCTUATION:
+            start += 1
+        while end > start and question[end - 1] in TOKEN_PUNCTUATION:
+            end -= 1
+        if is_identifier(question[start:end]):
+            candidates.append((start, end))
+    # overlapping mentions keep the one starting first, then the longest
+    spans = []
+    for start, end in sorted(candidates, key=lambda span: (span[0], -span[1])):
+        if len(spans) == 0 or start >= spans[-1][1]:
+            spans.append((start, end))
+    if options is not None:
+        for match in OPTION.finditer(question, options.start()):
+            spans.append(match.span(2))
+    return spans
+
+
+def question_template(question: str, vocabulary: Optional[re.Pattern] = None) -> Tuple[str, List[str]]:
+    """
+    Abstract the entity mentions out of a question.
+
+    :param question: The question.
+    :type question: str
+    :param vocabulary: Pattern of the known entity names, see vocabulary_pattern. Defaults to None.
+    :type vocabulary: Optional[re.Pattern]
+    :return: The template key, in which repeated mentions share a placeholder, and the distinct entities in order.
+    :rtype: Tuple[str, List[str]]
+    """
+    entities = []
+    parts = []
+    position = 0
+    for start, end in entity_spans(question, vocabulary):
+        entity = question[start:end]
+        if entity not in entities:
+            entities.append(entity)
+        parts.append(question[position:start])
+        parts.append(PLACEHOLDER.format("E", entities.index(entity)))
+        position = end
+    parts.append(question[position:])
+    return " ".join("".join(parts).split()).lower(), entities
+
+
+def mention_pattern(entities: List[str]) -> re.Pattern:
+    # longer names first, so a name is never replaced inside a longer one. Short names, e.g. the gene AR,
+    # are only matched with their case, as their lowercase form is likely an unrelated word
+    forms = sorted(set(entities) | set(entity.lower() for entity in entities if len(entity) >= 4), key=len, reverse=True)
+    return re.compile(r"(?<![\w⟦])(" + "|".join(re.escape(form) for form in forms) + r")(?![\w⟧])")
+
+
+def abstract_plan(plan: Dict[str, Any], entities: List[str]) -> Optional[str]:
+    """
+    Replace the entity mentions of a plan with placeholders.
+
+    :param plan: The plan, with JSON serializable values.
+    :type plan: Dict[str, Any]
+    :param entities: The entities of the question the plan answers.
+    :type entities: List[str]
+    :return: The serialized plan template, or None if an entity is not mentioned in the plan, which means
+             the plan may rely on a form of it that cannot be replaced.
+    :rtype: Optional[str]
+    """
+    text = json.dumps(plan, ensure_ascii=False)
+    if "⟦" in text or any('"' in entity or "\\" in entity for entity in entities):
+        return None
+    if len(entities) == 0:
+        return text
+    found = set()
+
+    def replace(match):
+        form = match.group(1)
+        if form in entities:
+            found.add(form)
+            return PLACEHOLDER.format("E", entities.index(form))
+        index = [entity.lower() if len(entity) >= 4 else entity for entity in entities].index(form)
+        found.add(entities[index])
+        return PLACEHOLDER.format("l", index)
+
+    template = mention_pattern(entities).sub(replace, text)
+    if len(found) != len(entities):
+        return None
+    return template
+
+
+def instantiate_plan(template: str, entities: List[str]) -> Dict[str, Any]:
+    def replace(match):
+        entity = entities[int(match.group(2))]
+        return json.dumps(entity if match.group(1) == "E" else entity.lower(), ensure_ascii=False)[1:-1]
+    return json.loads(PLACEHOLDER_PATTERN.sub(replace, template))
+
+
+class PlanCache:
+    """
+    PlanCache stores validated plans of answered questions under the question's template, so a question
+    that only differs in its entities (drugs, genes, options, ...) reuses the plan with its entities
+    substituted and skips planning, assessment and conversion.
+    """
+
+    def __init__(self, max_items: int = 1024, path: str = None, vocabulary=None) -> None:
+        """
+        Initialize the PlanCache.
+
+        :param max_items: Maximum number of templates kept. Defaults to 1024.
+        :type max_items: int
+        :param path: JSON file the templates are persisted to. Defaults to None (kept in memory only).
+        :type path: str
+        :param vocabulary: Known entity names, e.g. the node names of the knowledge graph, abstracted wherever they are mentioned. Defaults to None.
+        :type vocabulary: Iterable[str]
+        """
+        self.max_items = max_items
+        self.path = path
+        self.vocabulary = vocabulary_pattern(vocabulary) if vocabulary is not None else None
+        self.templates = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if path is not None and os.path.exists(path):
+            with open(path, "r") as f:
+                self.templates.update(json.load(f))
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the plan of a question with the same template.
+
+        :param question: The question.
+        :type question: str
+        :return: The plan instantiated with the entities of the question, or None on a miss.
+        :rtype: Optional[Dict[str, Any]]
+        """
+        key, entities = question_template(question, self.vocabulary)
+        with self.lock:
+            template = self.templates.get(key)
+            if template is None:
+                self.misses += 1
+                return None
+            self.templates.move_to_end(key)
+            self.hits += 1
+        return instantiate_plan(template, entities)
+
+    def store(self, question: str, plan: Dict[str, Any]) -> bool:
+        """
+        Store the validated plan of a question.
+
+        :param question: The question.
+        :type question: str
+        :param plan: The plan: instructions, edges, full_code and full_plan.
+        :type plan: Dict[str, Any]
+        :return: Whether the plan was stored.
+        :rtype: bool
+        """
+        key, entities = question_template(question, self.vocabulary)
+        try:
+            template = abstract_plan(plan, entities)
+        except (TypeError, ValueError):
+            return False
+        if template is None:
+            return False
+        with self.lock:
+            self.templates[key] = template
+            self.templates.move_to_end(key)
+            while len(self.templates) > self.max_items:
+                self.templates.popitem(last=False)
+            self.save()
+        return True
+
+    def discard(self, question: str) -> None:
+        key, _ = question_template(question, self.vocabulary)
+        with self.lock:
+            if self.templates.pop(key, None) is not None:
+                self.save()
+
+    def save(self) -> None:
+        if self.path is None:
+            return
+        temp_file = self.path + ".tmp"
+        with open(temp_file, "w") as f:
+            json.dump(self.templates, f)
+        os.replace(temp_file, self.path)
+
+
+shared_plan_cache = None
+shared_plan_cache_lock = threading.Lock()
+
+
+def get_shared_plan_cache() -> PlanCache:
+    """
+    Get the in-memory PlanCache shared by all Controllers of the process.
+    """
+    global shared_plan_cache
+    with shared_plan_cache_lock:
+        if shared_plan_cache is None:
+            shared_plan_cache = PlanCache()
+        return shared_plan_cache
@@ -0,0 +1,117 @@
+from __future__ import annotations
+import hashlib
+import json
+import logging
+import math
+from typing import Any, Dict, List, Optional
+
+from escargot.memory import Memory
+from escargot.plan_cache import question_template
+
+
+def distance_to_similarity(distance: float) -> float:
+    # Chroma returns squared L2 distances, which for unit length embeddings are 2 - 2 * cosine similarity
+    return 1 - distance / 2
+
+
+def normalize(vector: List[float]) -> List[float]:
+    norm = math.sqrt(sum(value * value for value in vector))
+    return [value / norm for value in vector] if norm > 0 else vector
+
+
+class PlanLibrary:
+    """
+    PlanLibrary keeps the plans of answered questions in a vector collection keyed by the question embedding.
+    Before planning, the nearest prior question is looked up: a paraphrase that mentions the same entities
+    reuses its plan directly, a merely similar question gets the prior plan as an example in the planning prompt.
+    """
+
+    def __init__(self, lm, collection_name: str = "escargot_plans", path: str = None, reuse_threshold: float = 0.97, seed_threshold: float = 0.85, logger: logging.Logger = None) -> None:
+        """
+        Initialize the PlanLibrary.
+
+        :param lm: The language model used to embed the questions.
+        :type lm: AbstractLanguageModel
+        :param collection_name: The collection of the plans. Defaults to "escargot_plans".
+        :type collection_name: str
+        :param path: The path of the memory store. Defaults to None (the default store).
+        :type path: str
+        :param reuse_threshold: Cosine similarity from which the plan of a question with the same entities is reused directly. Defaults to 0.97.
+        :type reuse_threshold: float
+        :param seed_threshold: Cosine similarity from which the plan is used as a planning example. Defaults to 0.85.
+        :type seed_threshold: float
+        """
+        self.memory = Memory(lm, collection_name=collection_name, path=path)
+        self.collection_name = collection_name
+        self.reuse_threshold = reuse_threshold
+        self.seed_threshold = seed_threshold
+        self.logger = logger if logger is not None else logging.getLogger(__name__)
+        self.hits = 0
+        self.seeds = 0
+        self.misses = 0
+
+    def embed(self, question: str) -> List[float]:
+        return normalize(self.memory.lm.get_embedding(question))
+
+    def lookup(self, question: str) -> Optional[Dict[str, Any]]:
+        """
+        Find the plan of the nearest prior question.
+
+        :param question: The question.
+        :type question: str
+        :return: The prior "question", its "plan", "scores" and "similarity", and whether the plan can be reused directly ("reuse"), or None if no prior question is similar enough.
+        :rtype: Optional[Dict[str, Any]]
+        """
+        collection = self.memory.collection
+        if collection.count() == 0:
+            self.misses += 1
+            return None
+        response = collection.query(query_embeddings=[self.embed(question)], n_results=1, include=["distances", "documents", "metadatas"])
+        if len(response["ids"][0]) == 0:
+            self.misses += 1
+            return None
+        similarity = distance_to_similarity(response["distances"][0][0])
+        if similarity < self.seed_threshold:
+            self.misses += 1
+            return None
+        metadata = response["metadatas"][0][0] or {}
+        match = {
+            "question": metadata.get("question", ""),
+            "plan": json.loads(response["documents"][0][0]),
+            "scores": json.loads(metadata.get("scores", "null")),
+            "similarity": similarity,
+        }
+        # a paraphrase only answers the same question if it is about the same entities
+        entities = set(entity.lower() for entity in question_template(question)[1])
+        prior_entities = set(entity.lower() for entity in question_template(match["question"])[1])
+        match["reuse"] = similarity >= self.reuse_threshold and entities == prior_entities
+        if match["reuse"]:
+            self.hits += 1
+        else:
+            self.seeds += 1
+        self.logger.info(f"Nearest prior question ({similarity:.3f}): {match['question']}")
+        return match
+
+    def store(self, question: str, plan: Dict[str, Any], scores: Dict[str, Any] = None) -> None:
+        """
+        Store the validated plan of a question, replacing the plan of the same question.
+
+        :param question: The question.
+        :type question: str
+        :param plan: The plan: instructions, edges, full_code and full_plan.
+        :type plan: Dict[str, Any]
+        :param scores: The assessment scores of the plan. Defaults to None.
+        :type scores: Dict[str, Any]
+        """
+        question_id = hashlib.sha256(question.encode("utf-8")).hexdigest()
+        self.memory.collection.upsert(
+            ids=[question_id],
+            embeddings=[self.embed(question)],
+            documents=[json.dumps(plan, ensure_ascii=False)],
+            metadatas=[{"question": question, "scores": json.dumps(scores)}],
+        )
+        self.memory.invalidate_cache(self.collection_name)
+
+    def discard(self, question: str) -> None:
+        self.memory.collection.delete(ids=[hashlib.sha256(question.encode("utf-8")).hexdigest()])
+        self.memory.invalidate_cache(self.collection_name)
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import itertools
+import reprlib
+import threading
+import weakref
+from typing import Any, Dict, Optional, Tuple
+
+
+class Previewer(reprlib.Repr):
+    """
+    Previewer renders size-bounded previews of step outputs for prompts and logs. Containers are cut
+    by depth and length like reprlib, and DataFrames, Series and arrays only render their shape,
+    dtypes and first rows, so the full string of a large object is never built.
+    """
+
+    def __init__(self, max_chars: int = 256, max_rows: int = 5, max_columns: int = 10, max_level: int = 3) -> None:
+        """
+        Initialize the Previewer.
+
+        :param max_chars: Maximum length of a preview. Defaults to 256.
+        :type max_chars: int
+        :param max_rows: Number of rows shown for DataFrames and Series. Defaults to 5.
+        :type max_rows: int
+        :param max_columns: Number of columns shown for DataFrames. Defaults to 10.
+        :type max_columns: int
+        :param max_level: Nesting depth shown for containers. Defaults to 3.
+        :type max_level: int
+        """
+        super().__init__()
+        self.max_chars = max_chars
+        self.max_rows = max_rows
+        self.max_columns = max_columns
+        self.maxlevel = max_level
+        self.maxstring = 80
+        self.maxother = max_chars
+        self.maxlist = self.maxtuple = self.maxset = self.maxfrozenset = self.maxdeque = 20
+        self.maxdict = 20
+        # previews of DataFrames, Series and arrays keyed by id, checked against a fingerprint of the shown
+        # content and dropped with the object
+        self.cache: Dict[int, Tuple[Any, Tuple, str]] = {}
+        self.lock = threading.Lock()
+
+    def repr_DataFrame(self, obj, level):
+        dtypes = ", ".join(f"{column}: {dtype}" for column, dtype in obj.dtypes.iloc[:self.max_columns].items())
+        if len(obj.columns) > self.max_columns:
+            dtypes += ", ..."
+        head = obj.iloc[:self.max_rows, :self.max_columns].to_string(max_colwidth=30)
+        return f"DataFrame(shape={obj.shape}, dtypes=[{dtypes}])\n{head}"
+
+    def repr_Series(self, obj, level):
+        head = obj.iloc[:self.max_rows].to_string(max_rows=self.max_rows)
+        return f"Series(name={obj.name!r}, length={len(obj)}, dtype={obj.dtype})\n{head}"
+
+    def repr_Index(self, obj, level):
+        return self.repr_list(list(obj[:self.maxlist + 1]), level)
+
+    def repr_ndarray(self, obj, level):
+        flat = obj.reshape(-1)[:self.maxlist].tolist() if obj.size > 0 else []
+        return f"ndarray(shape={obj.shape}, dtype={obj.dtype}, values={self.repr_list(flat, level)}{'...' if obj.size > self.maxlist else ''})"
+
+    def repr_dict_keys(self, obj, level):
+        return self.repr_list(list(itertools.islice(obj, self.maxlist + 1)), level)
+
+    repr_dict_values = repr_dict_keys
+
+    def repr_instance(self, obj, level):
+        # objects without a dedicated handler: use their repr only if it is cheap to bound
+        if hasattr(obj, "shape"):
+            return f"{type(obj).__name__}(shape={obj.shape})"
+        return super().repr_instance(obj, level)
+
+    def fingerprint(self, obj) -> Optional[Tuple]:
+        """
+        Get a fingerprint of the part of an object its preview shows: the shape, the dtypes and the first
+        values, so an in-place change to them invalidates the cached preview. Computing it only touches those
+        values, not the whole object. Objects without a fingerprint are not cached.
+        """
+        kind = type(obj).__name__
+        if kind == "ndarray":
+            return (type(obj), obj.shape, obj.dtype.str, obj.reshape(-1)[:self.maxlist].tobytes())
+        if kind in ("DataFrame", "Series"):
+            import pandas as pd
+            head = obj.iloc[:self.max_rows, :self.max_columns] if kind == "DataFrame" else obj.iloc[:self.max_rows]
+            try:
+                values = pd.util.hash_pandas_object(head, index=True).values.tobytes()
+            except TypeError:
+                # unhashable cells, e.g. lists
+                return None
+            columns = tuple(obj.columns[:self.max_columns]) if kind == "DataFrame" else obj.name
+            return (type(obj), obj.shape, tuple(map(str, head.dtypes)) if kind == "DataFrame" else str(obj.dtype), columns, values)
+        return None
+
+    def preview(self, obj: Any) -> str:
+        """
+        Render a bounded preview of an object, reusing the cached preview of an unchanged DataFrame, Series or array.
+
+        :param obj: The object to preview.
+        :type obj: Any
+        :return: A preview of at most max_chars characters, followed by "..." if it was cut.
+        :rtype: str
+        """
+        key = id(obj)
+        try:
+            fingerprint = self.fingerprint(obj)
+        except Exception:
+            fingerprint = None
+        if fingerprint is not None:
+            with self.lock:
+                entry = self.cache.get(key)
+            if entry is not None and entry[0]() is obj and entry[1] == fingerprint:
+                return entry[2]
+        try:
+            # strings are shown as they are, like str(output)
+            text = obj if isinstance(obj, str) else self.repr(obj)
+        except Exception:
+            text = f"<{type(obj).__name__}>"
+        if len(text) > self.max_chars:
+            text = text[:self.max_chars] + "..."
+        if fingerprint is None:
+            return text
+        try:
+            reference = weakref.ref(obj, lambda reference, key=key: self.forget(key, reference))
+        except TypeError:
+            return text
+        with self.lock:
+            self.cache[key] = (reference, fingerprint, text)
+        return text
+
+    def forget(self, key: int, reference: weakref.ref) -> None:
+        # the id may already have been reused by an object with its own entry
+        with self.lock:
+            if key in self.cache and self.cache[key][0] is reference:
+                del self.cache[key]
+
+
+previewers: Dict[int, Previewer] = {}
+previewers_lock = threading.Lock()
+
+
+def preview(obj: Any, max_chars: int = 256) -> str:
+    """
+    Get a bounded preview of an object using the shared Previewer for that length.
+
+    :param obj: The object to preview.
+    :type obj: Any
+    :param max_chars: Maximum length of the preview. Defaults to 256.
+    :type max_chars: int
+    :return: The preview.
+    :rtype: str
+    """
+    with previewers_lock:
+        if max_chars not in previewers:
+            previewers[max_chars] = Previewer(max_chars=max_chars)
+        previewer = previewers[max_chars]
+    return previewer.preview(obj)
@@ -0,0 +1,178 @@
+from __future__ import annotations
+import ast
+from typing import Any, Dict, List, Optional
+
+# how the step code uses the knowledge variable, mapped to the shape it needs
+DICT_METHODS = {"items", "keys", "values", "get", "setdefault"}
+TABLE_ATTRIBUTES = {"columns", "iloc", "loc", "merge", "groupby", "sort_values", "drop_duplicates", "head", "query", "dropna", "shape"}
+ARROW_ATTRIBUTES = {"num_rows", "column", "column_names", "to_pandas", "to_pylist", "schema"}
+LIST_FUNCTIONS = {"set", "sorted", "list", "len", "enumerate", "zip", "tuple", "frozenset", "join", "extend", "union", "intersection", "difference"}
+TABLE_FUNCTIONS = {"DataFrame", "from_records", "from_dict"}
+
+
+def knowledge_variable(code: str, knowledge_request: str = None) -> Optional[str]:
+    """
+    Find the variable that receives the result of a knowledge_extract call in the step code.
+
+    :param code: The code of the step.
+    :type code: str
+    :param knowledge_request: The request passed to knowledge_extract, used when the step makes several calls. Defaults to None.
+    :type knowledge_request: str
+    :return: The variable name, or None if it cannot be determined.
+    :rtype: Optional[str]
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    candidates = []
+    for node in ast.walk(tree):
+        if not isinstance(node, ast.Assign) or len(node.targets) != 1 or not isinstance(node.targets[0], ast.Name):
+            continue
+        call = node.value
+        if isinstance(call, ast.Call) and isinstance(call.func, ast.Name) and call.func.id == "knowledge_extract":
+            request = call.args[0].value if len(call.args) > 0 and isinstance(call.args[0], ast.Constant) else None
+            candidates.append((node.targets[0].id, request))
+    if knowledge_request is not None:
+        matching = [name for name, request in candidates if request == knowledge_request]
+        if len(matching) > 0:
+            return matching[0]
+    if len(set(name for name, _ in candidates)) == 1:
+        return candidates[0][0]
+    return None
+
+
+def expected_shape(code: str, variable: str) -> Optional[str]:
+    """
+    Infer the shape the step code expects for a variable from how the code uses it.
+
+    :param code: The code of the step.
+    :type code: str
+    :param variable: The variable holding the knowledge.
+    :type variable: str
+    :return: "list", "dict", "table", "arrow" or "records" (rows as they are), or None if the uses disagree or give no hint.
+    :rtype: Optional[str]
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    is_variable = lambda node: isinstance(node, ast.Name) and node.id == variable
+    shapes = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Attribute) and is_variable(node.value):
+            if node.attr in DICT_METHODS:
+                shapes.add("dict")
+            elif node.attr in ARROW_ATTRIBUTES:
+                shapes.add("arrow")
+            elif node.attr in TABLE_ATTRIBUTES:
+                shapes.add("table")
+            elif node.attr in ("append", "index", "count", "sort"):
+                shapes.add("list")
+        elif isinstance(node, ast.Subscript) and is_variable(node.value):
+            key = node.slice
+            if isinstance(key, ast.Constant) and isinstance(key.value, str):
+                # a string key selects an entity or a column, the list of rows would fail either way
+                shapes.add("dict_or_table")
+            elif isinstance(key, (ast.Slice, ast.Constant)):
+                shapes.add("list")
+        elif isinstance(node, (ast.For, ast.comprehension)) and is_variable(node.iter):
+            shapes.add("iterable")
+        elif isinstance(node, ast.Compare) and any(is_variable(comparator) for comparator in node.comparators) and any(isinstance(op, (ast.In, ast.NotIn)) for op in node.ops):
+            shapes.add("iterable")
+        elif isinstance(node, ast.Call) and any(is_variable(arg) for arg in node.args):
+            name = node.func.id if isinstance(node.func, ast.Name) else node.func.attr if isinstance(node.func, ast.Attribute) else None
+            if name in TABLE_FUNCTIONS:
+                shapes.add("records")
+            elif name in LIST_FUNCTIONS:
+                shapes.add("iterable")
+        elif isinstance(node, ast.BinOp) and (is_variable(node.left) or is_variable(node.right)):
+            shapes.add("list")
+    if "dict_or_table" in shapes:
+        shapes.discard("dict_or_table")
+        shapes.add("table" if "table" in shapes else "dict")
+    if "records" in shapes:
+        # pd.DataFrame(rows) builds the table itself
+        return "records" if shapes == {"records"} else None
+    if "iterable" in shapes:
+        shapes.discard("iterable")
+        if len(shapes) == 0:
+            shapes.add("list")
+    if len(shapes) != 1:
+        return None
+    return shapes.pop()
+
+
+def flatten_values(rows: List[Dict]) -> List[Any]:
+    # repeated values are kept, the step may count them
+    values = []
+    for row in rows:
+        for value in row.values():
+            for item in (value if isinstance(value, (list, tuple, set)) else [value]):
+                if item is None or item == "":
+                    continue
+                values.append(item)
+    return values
+
+
+def rows_to_dict(rows: List[Dict]) -> Dict:
+    """
+    Key the rows by their first column. Two-column rows map to the second column's values,
+    wider rows map to the remaining columns.
+    """
+    result = {}
+    for row in rows:
+        items = list(row.items())
+        key = items[0][1]
+        value = items[1][1] if len(items) == 2 else dict(items[1:])
+        if key in result:
+            if not isinstance(result[key], list):
+                result[key] = [result[key]]
+            if isinstance(value, list):
+                result[key].extend(value)
+            else:
+                result[key].append(value)
+        else:
+            result[key] = value
+    return result
+
+
+def adapt_knowledge(rows: Any, code: str, knowledge_request: str = None) -> Optional[Any]:
+    """
+    Convert graph result rows (a list of dicts) into the shape the step code expects, without a language model.
+
+    :param rows: The rows returned by the graph database.
+    :type rows: Any
+    :param code: The code of the step that requested the knowledge.
+    :type code: str
+    :param knowledge_request: The request passed to knowledge_extract. Defaults to None.
+    :type knowledge_request: str
+    :return: The converted knowledge, or None if the expected shape cannot be determined.
+    :rtype: Optional[Any]
+    """
+    if not isinstance(rows, list) or len(rows) == 0 or not all(isinstance(row, dict) and len(row) > 0 for row in rows):
+        return None
+    variable = knowledge_variable(code, knowledge_request)
+    shape = expected_shape(code, variable) if variable is not None else None
+    num_columns = max(len(row) for row in rows)
+    if shape is None:
+        # without hints, single-column results are the common list of entities
+        if num_columns != 1:
+            return None
+        shape = "list"
+    if shape == "records":
+        return rows
+    if shape == "list":
+        return flatten_values(rows) if num_columns == 1 else None
+    if shape == "dict":
+        return rows_to_dict(rows) if num_columns >= 2 else None
+    if shape == "table":
+        import pandas as pd
+        return pd.DataFrame.from_records(rows)
+    if shape == "arrow":
+        try:
+            import pyarrow as pa
+        except ImportError:
+            return None
+        return pa.Table.from_pylist(rows)
+    return None
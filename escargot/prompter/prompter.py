@@ -3,6 +3,10 @@ from abc import ABC, abstractmethod
 from typing import Dict, List
 import re
 import logging
+from escargot.preview import preview
+from escargot.prompter.adapter import adapt_knowledge
+from escargot.language_models.voting import majority_vote
+from escargot.deadline import take_shortcut
 
 
 class ESCARGOTPrompter:
@@ -345,6 +349,14 @@ Here are the steps, code, and output:
 
 Return the final variable that answers the question."""
 
+    direct_output_prompt = """Answer the following question from your own knowledge, without access to the knowledge graph. Answer briefly and do not include any additional information.
+Question: {question}"""
+
+    direct_array_output_prompt = """Answer the following question from your own knowledge, without access to the knowledge graph.
+Question: {question}
+
+Return only a Python list of the items that answer the question."""
+
     determine_variable_name_prompt = """Given the following Python code, you will be asked to determine the variable name for the knowledge request. A knowledge request should look like: variable_a = knowledge_request("GENE OVEREXPRESSED IN BODYPART-Brain")
 
 Code: {code}
@@ -418,7 +430,12 @@ Question:
         assert question is not None, "Question should not be None."
         if method == "got":
             if (input is None or input == "") and kwargs["phase"] == "planning":
-                return self.planning_prompt.format(question=question, node_types=self.node_types, relationship_types=self.relationship_types, relationship_scores=self.relationship_scores)
+                prompt = self.planning_prompt.format(question=question, node_types=self.node_types, relationship_types=self.relationship_types, relationship_scores=self.relationship_scores)
+                if kwargs.get("plan_example"):
+                    # the plan of a similar question answered before, as the last example
+                    example = "\n\nQuestion: " + kwargs["plan_example"]["question"] + "\n" + kwargs["plan_example"]["plan"].strip()
+                    prompt = prompt.replace("\n\nHere is your question:", example + "\n\nHere is your question:", 1)
+                return prompt
             elif kwargs["phase"] == "plan_assessment":
                 return self.plan_assessment_prompt.format(question=question, approach_1=input[0], approach_2=input[1], approach_3=input[2], node_types=self.node_types, relationship_types=self.relationship_types, relationship_scores=self.relationship_scores)
             elif kwargs["phase"] == "python_conversion":
@@ -429,15 +446,17 @@ Question:
                 return self.xml_conversion_prompt.format(instructions=input)
             elif kwargs["phase"] == "xml_cleanup":
                 return self.xml_cleanup_prompt.format(xml=input, node_types=self.node_types, relationship_types=self.relationship_types)
+            elif kwargs["phase"] == "direct_answer":
+                if kwargs["answer_type"] == "array":
+                    return self.direct_array_output_prompt.format(question=question)
+                else:
+                    return self.direct_output_prompt.format(question=question)
             elif kwargs["phase"] == "output":
                 steps = ""
                 for step in kwargs["instructions"]:
                     steps += "Step " + step["StepID"] + ": " + step["Instruction"] + "\n"
                     steps += "Code: " + step["Code"][0] + "\n"
-                    output = input[step["StepID"]]
-                    if len(str(output)) > 256:
-                        output = str(output)[:256] + "..."
-                    steps += "Output: " + str(output) + "\n\n"
+                    steps += "Output: " + preview(input[step["StepID"]]) + "\n\n"
                 if kwargs["answer_type"] == "array":
                     return self.array_output_prompt.format(question=question, steps=steps)
                 else:
@@ -461,11 +480,8 @@ Question:
 
             #backup if the memgraph client fails or doesn't provide any knowledge
             if knowledge_array == [] and self.vector_db is not None:
-                statement_to_embeds = self.lm.get_response_texts(
-                    self.lm.query(self.knowledge_request_adjustment_prompt.format(node_types=self.node_types,relationship_types=self.relationship_types, statement_to_embed=statement_to_embed, instruction=instruction, relationship_scores = self.relationship_scores), num_responses=3)
-                )
-                #get the most common element in the list
-                statement_to_embed = max(set(statement_to_embeds), key = statement_to_embeds.count)
+                #get the most common adjustment, sampling only until the majority is decided
+                statement_to_embed = majority_vote(self.lm, self.knowledge_request_adjustment_prompt.format(node_types=self.node_types,relationship_types=self.relationship_types, statement_to_embed=statement_to_embed, instruction=instruction, relationship_scores = self.relationship_scores), 1 if take_shortcut("fewer_candidates", "knowledge request adjustment") else 3, logger=self.logger) or ""
                 if statement_to_embed.count("!") >= 2:
                     #if there is only once specific node and nothing else, then return the knowledge
                     embedded_question = self.lm.get_embedding(statement_to_embed_cleaned)
@@ -491,10 +507,18 @@ Question:
                         knowledge_array = knowledge_array[0]
                         knowledge_array = eval(knowledge_array)
                         break
+                    except TimeoutError:
+                        raise
                     except Exception as e:
                         self.logger.error(f"Error in vector db: {e}, trying again {tries}")
                 self.logger.info(f"Vector DB knowledge for {statement_to_embed}: {knowledge_array}")
             elif knowledge_array != []:
+                #map the rows to the shape the code expects, the language model conversion below is the fallback
+                rows = knowledge_array[0] if type(knowledge_array) == tuple else knowledge_array
+                adapted_knowledge = adapt_knowledge(rows, code, knowledge_request)
+                if adapted_knowledge is not None:
+                    self.logger.info(f"Adapted knowledge for {statement_to_embed} to {type(adapted_knowledge).__name__}")
+                    return adapted_knowledge
 
                 variable_name = self.lm.get_response_texts(
                     self.lm.query(self.determine_variable_name_prompt.format(code=code), num_responses=1)
@@ -524,6 +548,8 @@ Question:
                             exec(conversion_code)
                             knowledge_array = eval(variable_name)
                         break
+                    except TimeoutError:
+                        raise
                     except Exception as e:
                         
                         self.logger.error(f"Error in converting data structure: {e}, trying again {i}")